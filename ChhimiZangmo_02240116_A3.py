@@ -1,5 +1,20 @@
-import random
+# Modules only some features need (random, hashlib, hmac, secrets, concurrent.futures, json, argparse, ...)
+# are imported where they are used, so a one-shot command line run does not pay for them.
+import math
+import threading # lets the group commit flusher run in the background while operations continue
+import time
+import functools # wraps keeps a decorated method's name and docstring
+import sys # sys gives us the command line arguments
 import os # os is a  module that lets us use operating system-dependent functionality such as reading or writing to a file, checking if a file exists, etc.
+import mmap # maps a file into memory so records can be read and changed in place
+import struct # packs numbers into fixed-size bytes for the binary ledger
+import weakref # weak references let views disappear when nobody is using them
+import bisect # binary search in sorted arrays, used for date ranges in the transaction history
+import zlib # crc32 gives a stable hash of an account id to pick its shard
+from array import array # typed arrays store numbers without a Python object per value
+from collections import OrderedDict # remembers insertion order, used for the LRU caches
+from collections.abc import MutableMapping # base class for our own dictionary-like account stores
+from contextlib import contextmanager # turns a generator function into a "with" block
 from abc import ABC, abstractmethod # allows functions like abstract classes and abstract methods (for inheritance and polymorphism) 
 
 # Custom Exceptions
@@ -22,66 +37,359 @@ class AuthenticationError(BankingError): # subclass - to check passcode (when pa
     """Raised when login information are invalid"""
     pass
 
+# Metrics
+class Metrics:
+    """In-process counters, latency histograms and gauges for the banking operations
+
+    Everything is off until enable() is called; while disabled an instrumented
+    method only pays for one attribute check."""
+    BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0) # latency buckets in seconds
+    
+    def __init__(self):
+        self.enabled = False
+        self._lock = threading.Lock()
+        self.reset()
+    
+    def enable(self):
+        self.enabled = True
+    
+    def disable(self):
+        self.enabled = False
+    
+    def reset(self):
+        with self._lock:
+            self._counters = {} # (name, labels) -> value, labels is a sorted tuple of (key, value)
+            self._gauges = {}
+            self._histograms = {} # (name, labels) -> [bucket counts..., +Inf count, sum]
+    
+    def inc(self, name, amount=1, **labels):
+        """Add to a counter"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            self._counters[key] = self._counters.get(key, 0) + amount
+    
+    def set_gauge(self, name, value, **labels):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[(name, tuple(sorted(labels.items())))] = value
+    
+    def observe(self, name, seconds, **labels):
+        """Record one latency in a histogram"""
+        if not self.enabled:
+            return
+        key = (name, tuple(sorted(labels.items())))
+        with self._lock:
+            histogram = self._histograms.get(key)
+            if histogram is None:
+                histogram = self._histograms[key] = [0] * (len(self.BUCKETS) + 1) + [0.0]
+            for number, bound in enumerate(self.BUCKETS):
+                if seconds <= bound:
+                    histogram[number] += 1
+                    break
+            else:
+                histogram[len(self.BUCKETS)] += 1 # slower than the largest bucket
+            histogram[-1] += seconds
+    
+    def snapshot(self):
+        """Return every metric as plain dicts (histogram buckets are cumulative like Prometheus)"""
+        with self._lock:
+            counters = {self._metric_name(name, labels): value for (name, labels), value in self._counters.items()}
+            gauges = {self._metric_name(name, labels): value for (name, labels), value in self._gauges.items()}
+            histograms = {}
+            for (name, labels), histogram in self._histograms.items():
+                cumulative, total = [], 0
+                for count in histogram[:-1]:
+                    total += count
+                    cumulative.append(total)
+                histograms[self._metric_name(name, labels)] = {
+                    "buckets": dict(zip([str(bound) for bound in self.BUCKETS] + ["+Inf"], cumulative)),
+                    "count": total, "sum": histogram[-1]}
+        return {"counters": counters, "gauges": gauges, "histograms": histograms}
+    
+    @staticmethod
+    def _metric_name(name, labels, extra=()):
+        labels = tuple(labels) + tuple(extra)
+        if not labels:
+            return name
+        return name + "{" + ",".join(f'{key}="{value}"' for key, value in labels) + "}"
+    
+    def to_prometheus(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        lines = []
+        with self._lock:
+            for kind, values in (("counter", self._counters), ("gauge", self._gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f"# TYPE {name} {kind}")
+                    for (metric, labels), value in sorted(values.items()):
+                        if metric == name:
+                            lines.append(f"{self._metric_name(name, labels)} {value}")
+            for name in sorted({name for name, _ in self._histograms}):
+                lines.append(f"# TYPE {name} histogram")
+                for (metric, labels), histogram in sorted(self._histograms.items()):
+                    if metric != name:
+                        continue
+                    total = 0
+                    for bound, count in zip([str(bound) for bound in self.BUCKETS] + ["+Inf"], histogram[:-1]):
+                        total += count
+                        lines.append(f"{self._metric_name(name + '_bucket', labels, (('le', bound),))} {total}")
+                    lines.append(f"{self._metric_name(name + '_sum', labels)} {histogram[-1]}")
+                    lines.append(f"{self._metric_name(name + '_count', labels)} {total}")
+        return "\n".join(lines) + "\n"
+
+METRICS = Metrics() # one shared registry for the whole process
+_measuring = threading.local() # .active is set while this thread is inside a measured operation
+
+def instrumented(operation):
+    """Decorator that counts calls, errors and latency of a banking operation when METRICS is enabled
+
+    Only the outermost operation is counted - the withdraw and deposit a transfer
+    makes are part of the transfer, not operations of their own."""
+    def decorator(method):
+        @functools.wraps(method)
+        def wrapper(*args, **kwargs):
+            if not METRICS.enabled or getattr(_measuring, "active", False): # the common case - straight through
+                return method(*args, **kwargs)
+            _measuring.active = True
+            start = time.perf_counter()
+            try:
+                result = method(*args, **kwargs)
+            except BankingError as e:
+                METRICS.inc("banking_errors_total", operation=operation, error=type(e).__name__)
+                raise
+            finally:
+                _measuring.active = False
+                METRICS.observe("banking_operation_seconds", time.perf_counter() - start, operation=operation)
+                METRICS.inc("banking_operations_total", operation=operation)
+            return result
+        return wrapper
+    return decorator
+
+# Account Locks
+# A fixed table of locks shared by every account (lock striping) - an account uses the lock its id hashes to.
+# Using a table instead of one lock per account means no extra object per account and columnar views of the
+# same row automatically share a lock.
+_ACCOUNT_LOCKS = tuple(threading.RLock() for _ in range(256)) # RLock so a thread holding a lock can take it again
+
+def _lock_index(account_id):
+    return hash(account_id) % len(_ACCOUNT_LOCKS)
+
+@contextmanager
+def account_locks(*accounts):
+    """Hold the locks of several accounts, always taken in table order so two transfers can never deadlock"""
+    indexes = sorted({_lock_index(account.account_id) for account in accounts})
+    for index in indexes:
+        _ACCOUNT_LOCKS[index].acquire()
+    try:
+        yield
+    finally:
+        for index in reversed(indexes):
+            _ACCOUNT_LOCKS[index].release()
+
+@contextmanager
+def all_account_locks():
+    """Hold every account lock, used to take a consistent snapshot of the whole ledger"""
+    for lock in _ACCOUNT_LOCKS:
+        lock.acquire()
+    try:
+        yield
+    finally:
+        for lock in reversed(_ACCOUNT_LOCKS):
+            lock.release()
+
+# Money Helpers
+# Money is kept as a whole number of cents (an int), so adding and subtracting is exact and cheap.
+# Floats are only used at the edges - amounts passed in by callers and the "funds" property for display.
+MAX_CENTS = 2**63 - 1 # the columnar and binary stores keep balances as 64-bit integers
+
+def to_cents(amount):
+    """Convert an amount in dollars (int, float, str or Decimal) to cents, rejecting more than 2 decimals"""
+    if isinstance(amount, int) and not isinstance(amount, bool):
+        cents = amount * 100
+    elif isinstance(amount, float):
+        try:
+            cents = round(amount * 100)
+        except (ValueError, OverflowError): # nan or infinity
+            raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
+        if cents / 100 != amount: # the float was not a whole number of cents
+            raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
+    else:
+        try:
+            cents = parse_cents(str(amount), strict=True) # str, Decimal, ...
+        except ValueError:
+            raise InvalidAmountError(f"Invalid amount: {amount}")
+    if abs(cents) > MAX_CENTS:
+        raise InvalidAmountError("Amount is too large")
+    return cents
+
+def parse_cents(text, strict=False):
+    """Parse a decimal string like "12.5" or "-3.07" into cents without going through a float
+
+    When strict is False other number formats (e.g. a legacy float balance such as
+    "0.30000000000000004") are rounded to the nearest cent."""
+    text = text.strip()
+    sign = -1 if text.startswith("-") else 1
+    whole, _, fraction = text.lstrip("+-").partition(".")
+    if (whole or fraction) and (whole == "" or whole.isdecimal()) and (fraction == "" or fraction.isdecimal()):
+        if len(fraction) <= 2:
+            return sign * (int(whole or "0") * 100 + int(fraction.ljust(2, "0")))
+        if not fraction[2:].strip("0"): # extra zeros are harmless
+            return sign * (int(whole or "0") * 100 + int(fraction[:2]))
+        if strict:
+            raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
+    elif strict:
+        raise ValueError(f"Invalid amount: {text}")
+    return round(float(text) * 100) # raises ValueError for text that is not a number
+
+def format_cents(cents):
+    """Format cents as dollars with exactly 2 decimals, e.g. 100001 -> "1000.01" """
+    sign = "-" if cents < 0 else ""
+    cents = abs(cents)
+    return f"{sign}{cents // 100}.{cents % 100:02d}"
+
 # Abstract Base Class
 class Account(ABC): # ABC - Abstract Base Class - is used as a blueprint for other classes to inherit from (basically the parent)
     """Abstract base class for bank accounts"""
+    dirty = False # True once a balance or the passcode changed since the account was last saved (only set on account objects, not views)
+    index = None # the bank's AccountIndex when secondary indexes are on (views use their store's)
+    
     def __init__(self, account_id, passcode, account_type, funds=0): #
         self.account_id = account_id
         self.passcode = passcode
         self.account_type = account_type
-        self.funds = funds
+        self.cents = to_cents(funds) # balance in whole cents
+    
+    @property
+    def passcode(self):
+        """Stored passcode (plain or hashed)"""
+        return self._passcode
+    
+    @passcode.setter
+    def passcode(self, value):
+        self._passcode = value
+        self.dirty = True # a rehashed passcode has to reach the fixed-width file as well
+    
+    @property
+    def cents(self):
+        """Balance in whole cents"""
+        return self._cents
+    
+    @cents.setter
+    def cents(self, value):
+        self._cents = value
+        self.dirty = True # written by the next save of the fixed-width file
+        if self.index is not None: # moving the account to its new place in the balance index
+            self.index.set_balance(self.account_id, "funds", value)
+    
+    @property
+    def funds(self):
+        """Balance in dollars (read from the exact cents value)"""
+        return self.cents / 100
+    
+    @funds.setter
+    def funds(self, value):
+        self.cents = to_cents(value)
+    
+    @property
+    def lock(self):
+        """The lock that guards this account's balances"""
+        return _ACCOUNT_LOCKS[_lock_index(self.account_id)]
     
     @abstractmethod # abstaract method uses @abstractmethod (decorator) to implement in subclass
     def get_account_details(self):
         pass # 
 
+    @instrumented("deposit")
     def deposit(self, amount):
         """Deposit money into account"""
-        if amount <= 0 or round(amount, 2) != amount: # checks if amount is less then or zero and if it has maximum just 2 decimals or it raises Invalid amount error
+        cents = to_cents(amount) # raises InvalidAmountError if it has more than 2 decimals
+        if cents <= 0: # checks if amount is less then or zero
             raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
-        self.funds += amount # else money deposited to acount
-        return f"Deposited ${amount:.2f}. New balance: ${self.funds:.2f}"
+        with self.lock: # another thread could be changing the same balance
+            if self.cents + cents > MAX_CENTS: # would not fit in a 64-bit balance column
+                raise InvalidAmountError("Balance would be too large")
+            self.cents += cents # else money deposited to acount
+            return f"Deposited ${format_cents(cents)}. New balance: ${format_cents(self.cents)}"
 
+    @instrumented("withdraw")
     def withdraw(self, amount):
         """Withdraw money from account"""
-        if amount <= 0 or round(amount, 2) != amount: # similiar invalid error case to depositing invalid inputs
+        cents = to_cents(amount)
+        if cents <= 0: # similiar invalid error case to depositing invalid inputs
             raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
-        if amount > self.funds:
-            # gives insufficeient fund error if the balance is less then amount we want to withdraw
-            raise InsufficientFundsError("Insufficient funds for withdrawal")
-        self.funds -= amount # else amount to withdraw is subtracted from balance
-        return f"Withdrew ${amount:.2f}. New balance: ${self.funds:.2f}"
+        with self.lock: # the balance check and the subtraction must happen together
+            if cents > self.cents:
+                # gives insufficeient fund error if the balance is less then amount we want to withdraw
+                raise InsufficientFundsError("Insufficient funds for withdrawal")
+            self.cents -= cents # else amount to withdraw is subtracted from balance
+            return f"Withdrew ${format_cents(cents)}. New balance: ${format_cents(self.cents)}"
     
+    @instrumented("transfer")
     def transfer(self, amount, recipient):
         """Transfer money to another account"""
         if not isinstance(recipient, Account): # isinstance (s.note - an inbuilt function) checks if recipient is an instance of account class that is if the account exists
             raise AccountNotFoundError("Recipient account not found") # if account not an instance of annount class gives error
-        self.withdraw(amount)  # else it withdraws money 
-        recipient.deposit(amount) # and deposits to the recipient account
-        return f"Transferred ${amount:.2f} to account {recipient.account_id}"
+        cents = to_cents(amount)
+        with account_locks(self, recipient): # both balances change as one step
+            before = self.cents
+            self.withdraw(amount)  # else it withdraws money 
+            try:
+                recipient.deposit(amount) # and deposits to the recipient account
+            except Exception:
+                self.cents = before # rolling back so money is never lost
+                raise
+        return f"Transferred ${format_cents(cents)} to account {recipient.account_id}"
 
 # Concrete Account Classes
 class PersonalAccount(Account): # inherits from Account
     """Class for personal bank accounts"""
     def __init__(self, account_id, passcode, funds=0):
         super().__init__(account_id, passcode, "Personal", funds) #  getting the Account methods 
-        self.mobile_balance = 0  # Added for mobile top-up feature
+        self.mobile_cents = 0  # Added for mobile top-up feature (in cents like funds)
+    
+    @property
+    def mobile_cents(self):
+        """Mobile balance in whole cents"""
+        return self._mobile_cents
+    
+    @mobile_cents.setter
+    def mobile_cents(self, value):
+        self._mobile_cents = value
+        self.dirty = True
+        if self.index is not None:
+            self.index.set_balance(self.account_id, "mobile_balance", value)
+    
+    @property
+    def mobile_balance(self):
+        """Mobile balance in dollars"""
+        return self.mobile_cents / 100
+    
+    @mobile_balance.setter
+    def mobile_balance(self, value):
+        self.mobile_cents = to_cents(value)
     
     def get_account_details(self): # this method is implemented from the abstract method in Account class to get account details
         """Returns formatted account details"""
         return (f"Personal Account {self.account_id}\n"
-                f"Balance: ${self.funds:.2f}\n"
-                f"Mobile Balance: ${self.mobile_balance:.2f}")
+                f"Balance: ${format_cents(self.cents)}\n"
+                f"Mobile Balance: ${format_cents(self.mobile_cents)}")
     
+    @instrumented("top_up_mobile")
     def top_up_mobile(self, amount): # (Talk time or data)
         """Top up mobile phone balance"""
-        if amount <= 0:
+        cents = to_cents(amount)
+        if cents <= 0:
             raise InvalidAmountError("Top-up amount must be positive")
-        if amount > self.funds:
-            raise InsufficientFundsError("Insufficient funds for mobile top-up")
-        self.funds -= amount # subtractig from balance 
-        self.mobile_balance += amount # and adding to mobile 
-        return f"Mobile topped up with ${amount:.2f}. Account balance: ${self.funds:.2f}"
+        with self.lock:
+            if cents > self.cents:
+                raise InsufficientFundsError("Insufficient funds for mobile top-up")
+            if self.mobile_cents + cents > MAX_CENTS:
+                raise InvalidAmountError("Mobile balance would be too large")
+            self.cents -= cents # subtractig from balance 
+            self.mobile_cents += cents # and adding to mobile 
+            return f"Mobile topped up with ${format_cents(cents)}. Account balance: ${format_cents(self.cents)}"
 
 class BusinessAccount(Account):
     """Class for business bank accounts"""
@@ -90,89 +398,2859 @@ class BusinessAccount(Account):
     
     def get_account_details(self):
         """Returns formatted account details"""
-        return f"Business Account {self.account_id}\nBalance: ${self.funds:.2f}"
+        return f"Business Account {self.account_id}\nBalance: ${format_cents(self.cents)}"
+
+# Lazy Account Storage
+class LazyAccounts(MutableMapping):
+    """Dictionary-like account store that only keeps an id -> byte offset index
+    and builds each account object the first time it is looked up
+
+    When the saved sidecar index is current it is not even read at startup -
+    the first few lookups binary search the sorted sidecar for their offset
+    instead, which is what a one-shot command needs, and the index is loaded
+    once more accounts are asked for or the whole ledger is needed."""
+    SEARCHES = 8 # sidecar searches for single accounts before the whole index is loaded instead
+    
+    def __init__(self, bank, offsets):
+        self._bank = bank # the BankingSystem is used to parse lines and knows the file name
+        self._offsets = offsets # account_id -> byte offset of its line in the snapshot file (None - not loaded yet)
+        self._deleted = set() # ids deleted before the index was loaded
+        self._searches = 0
+        self._loaded = {} # accounts that have been materialized (or created / replayed) in this session
+        self._file = None
+        self._lock = threading.Lock() # seek + readline on one shared file handle must not interleave
+    
+    def _index(self):
+        """The full id -> offset index, loading the sidecar the first time it is needed"""
+        with self._lock:
+            if self._offsets is None:
+                offsets = self._bank._load_index()
+                for account_id in self._deleted:
+                    offsets.pop(account_id, None)
+                self._offsets, self._deleted = offsets, set()
+            return self._offsets
+    
+    def _offset(self, account_id):
+        """Byte offset of an account's line, or None"""
+        offsets = self._offsets
+        if offsets is not None:
+            return offsets.get(account_id)
+        if account_id in self._deleted:
+            return None
+        self._searches += 1
+        if self._searches <= self.SEARCHES: # many lookups - the index pays for itself after that
+            offset = self._bank._index_lookup(account_id)
+            if offset is not False: # False - the sidecar cannot be searched, so the index is built instead
+                return offset
+        return self._index().get(account_id)
+    
+    def __getitem__(self, account_id):
+        account = self._loaded.get(account_id)
+        if account is not None:
+            return account
+        offset = self._offset(account_id)
+        if offset is None:
+            raise KeyError(account_id)
+        with self._lock:
+            if self._file is None:
+                self._file = open(self._bank.filename, "rb")
+            self._file.seek(offset)
+            line = self._file.readline().decode()
+        try:
+            account = self._bank._parse_account(line)
+        except (ValueError, IndexError) as e: # same handling as the eager loader - a bad line is skipped
+            account = None
+            print(f"Error loading account data: {e}")
+        if account is None or account.account_id != account_id: # index is stale or the line is invalid
+            if self._offsets is None:
+                self._deleted.add(account_id)
+            else:
+                self._offsets.pop(account_id, None)
+            raise KeyError(account_id)
+        return self._loaded.setdefault(account_id, account) # if two threads parse it at once both get the same object
+    
+    def __setitem__(self, account_id, account):
+        self._loaded[account_id] = account
+    
+    def __delitem__(self, account_id):
+        if self._offsets is None:
+            found = self._offset(account_id) is not None
+            self._deleted.add(account_id)
+        else:
+            found = self._offsets.pop(account_id, None) is not None
+        found = self._loaded.pop(account_id, None) is not None or found
+        if not found:
+            raise KeyError(account_id)
+    
+    def __contains__(self, account_id):
+        return account_id in self._loaded or self._offset(account_id) is not None # no materialization needed
+    
+    def __iter__(self):
+        offsets = self._index()
+        yield from list(offsets)
+        yield from [account_id for account_id in self._loaded if account_id not in offsets]
+    
+    def __len__(self):
+        offsets = self._index()
+        return len(offsets) + sum(1 for account_id in self._loaded if account_id not in offsets)
+    
+    def snapshot_lines(self):
+        """Yield one file line per account, copying untouched lines straight from the old file"""
+        offsets = self._index()
+        file = open(self._bank.filename, "rb") if offsets else None
+        try:
+            for account_id, offset in list(offsets.items()):
+                account = self._loaded.get(account_id)
+                if account is not None:
+                    yield account_id, self._bank._format_account(account)
+                else:
+                    file.seek(offset)
+                    line = file.readline().decode()
+                    yield account_id, line if line.endswith("\n") else line + "\n"
+        finally:
+            if file is not None:
+                file.close()
+        for account_id, account in list(self._loaded.items()):
+            if account_id not in offsets: # created or replayed in this session
+                yield account_id, self._bank._format_account(account)
+    
+    def reindex(self, offsets):
+        """Point the index at a freshly written snapshot file"""
+        with self._lock:
+            self._offsets = offsets
+            self.close()
+    
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+# Columnar Account Storage
+class _ColumnarView:
+    """Mixin that reads and writes the account fields in one row of a ColumnarAccounts store"""
+    def _checked_row(self):
+        """The view's row, raising AccountNotFoundError once the account was deleted (its row may belong to someone else now)"""
+        if self._row is None:
+            raise AccountNotFoundError("Account not found")
+        return self._row
+    
+    @property
+    def account_id(self):
+        return self._store.account_id(self._checked_row())
+    
+    @property
+    def passcode(self):
+        return self._store._passcodes[self._checked_row()]
+    
+    @passcode.setter
+    def passcode(self, value):
+        self._store._passcodes[self._checked_row()] = sys.intern(value)
+    
+    @property
+    def account_type(self):
+        return ColumnarAccounts.TYPE_NAMES[self._store._types[self._checked_row()]]
+    
+    @property
+    def cents(self):
+        return self._store._funds[self._checked_row()]
+    
+    @cents.setter
+    def cents(self, value):
+        self._store._funds[self._checked_row()] = value
+        if self._store.index is not None:
+            self._store.index.set_balance(self.account_id, "funds", value)
+
+class ColumnarPersonalAccount(_ColumnarView, PersonalAccount):
+    """Personal account view over a columnar store row"""
+    @property
+    def mobile_cents(self):
+        return self._store._mobile[self._checked_row()]
+    
+    @mobile_cents.setter
+    def mobile_cents(self, value):
+        self._store._mobile[self._checked_row()] = value
+        if self._store.index is not None:
+            self._store.index.set_balance(self.account_id, "mobile_balance", value)
+
+class ColumnarBusinessAccount(_ColumnarView, BusinessAccount):
+    """Business account view over a columnar store row"""
+    pass
+
+class _IdIndex:
+    """Open addressing hash table from numeric account id to row number, kept in one typed array"""
+    EMPTY, DELETED = -1, -2
+    
+    def __init__(self, keys):
+        self._keys = keys # the store's row -> numeric id array, so the table only holds row numbers
+        self._table = array("q", [self.EMPTY]) * 8 # table and mask are always replaced together (see _resize)
+        self._used = 0 # live entries plus deleted markers
+    
+    def _slot(self, key, table=None):
+        """Return the slot holding key, or the first free slot on its probe path"""
+        if table is None:
+            table = self._table # read once, so a lookup never mixes an old and a resized table
+        keys, mask = self._keys, len(table) - 1
+        slot = (key * 0x9E3779B1) & mask # multiplying spreads nearby ids across the table
+        free = None
+        while True:
+            row = table[slot]
+            if row == self.EMPTY:
+                return slot if free is None else free
+            if row == self.DELETED:
+                if free is None:
+                    free = slot
+            elif keys[row] == key:
+                return slot
+            slot = (slot + 1) & mask # linear probing
+    
+    def get(self, key):
+        table = self._table
+        row = table[self._slot(key, table)]
+        return row if row >= 0 else None
+    
+    def put(self, key, row):
+        slot = self._slot(key)
+        if self._table[slot] == self.EMPTY:
+            self._used += 1
+        self._table[slot] = row
+        if self._used * 3 > len(self._table) * 2: # keeping the table at most two thirds full
+            self._resize()
+    
+    def remove(self, key):
+        slot = self._slot(key)
+        if self._table[slot] >= 0:
+            self._table[slot] = self.DELETED
+    
+    def _resize(self):
+        old = self._table
+        size = len(old) * 2
+        while self._used * 3 > size:
+            size *= 2
+        table = array("q", [self.EMPTY]) * size # built on the side and swapped in with one assignment
+        used = 0
+        for row in old:
+            if row >= 0:
+                table[self._slot(self._keys[row], table)] = row
+                used += 1
+        self._table, self._used = table, used
+
+class ColumnarAccounts(MutableMapping):
+    """Dictionary-like account store that keeps every field in parallel arrays
+
+    Rows are looked up through an id -> row index and handed out as small view
+    objects, so there is no per-account Python object kept in memory. Account
+    ids that are plain numbers (the normal case) are indexed by a compact array
+    hash table, anything else falls back to a normal dictionary."""
+    TYPE_NAMES = ("Business", "Personal") # type codes - 0 is Business, 1 is Personal
+    FREE = -1 # numeric id of a row left behind by a deleted account
+    TEXT = -2 # numeric id of a row whose account id is not a plain number
+    
+    def __init__(self, bank):
+        self._bank = bank
+        self._numeric_ids = array("q") # row -> account id as a number
+        self._index = _IdIndex(self._numeric_ids)
+        self._text_rows = {} # account_id -> row for ids that are not plain numbers
+        self._text_ids = {} # row -> account_id for those rows
+        self._passcodes = [] # interned strings, so equal passcodes share one object
+        self._types = bytearray() # one byte type code per row
+        self._funds = array("q") # balances in cents as 64-bit integers
+        self._mobile = array("q")
+        self._free = [] # rows left behind by deleted accounts, reused first
+        self._count = 0
+        self._views = weakref.WeakValueDictionary() # row -> live view, so one account is one object while in use
+        self.index = None # AccountIndex the views keep up to date, if the bank has one
+    
+    @staticmethod
+    def _number(account_id):
+        """Return the id as an int if it round-trips exactly, otherwise None"""
+        if (account_id.isascii() and account_id.isdigit() # isdigit alone also takes digits like "\u0667" that int() reads as 7
+                and (account_id[0] != "0" or account_id == "0") and len(account_id) < 19):
+            return int(account_id)
+        return None
+    
+    def _row(self, account_id):
+        number = self._number(account_id)
+        if number is None:
+            return self._text_rows.get(account_id)
+        return self._index.get(number)
+    
+    def account_id(self, row):
+        number = self._numeric_ids[row]
+        return str(number) if number >= 0 else self._text_ids[row]
+    
+    def add(self, account_id, passcode, account_type, funds=0, mobile_balance=0):
+        """Insert or overwrite the row for an account (funds and mobile_balance in cents)"""
+        type_code = 1 if account_type == "Personal" else 0
+        row = self._row(account_id)
+        if row is None:
+            if self._free:
+                row = self._free.pop()
+            else:
+                row = len(self._numeric_ids)
+                self._numeric_ids.append(self.FREE)
+                self._passcodes.append(None)
+                self._types.append(0)
+                self._funds.append(0)
+                self._mobile.append(0)
+            number = self._number(account_id)
+            if number is None:
+                self._numeric_ids[row] = self.TEXT
+                self._text_rows[account_id] = row
+                self._text_ids[row] = account_id
+            else:
+                self._numeric_ids[row] = number
+                self._index.put(number, row)
+            self._count += 1
+        elif self._types[row] != type_code: # the old view has the wrong class now
+            self._views.pop(row, None)
+        self._passcodes[row] = sys.intern(passcode)
+        self._types[row] = type_code
+        self._funds[row] = funds
+        self._mobile[row] = mobile_balance if type_code else 0
+    
+    def __getitem__(self, account_id):
+        row = self._row(account_id)
+        if row is None:
+            raise KeyError(account_id)
+        view = self._views.get(row)
+        if view is None:
+            view_class = ColumnarPersonalAccount if self._types[row] else ColumnarBusinessAccount
+            view = view_class.__new__(view_class) # skipping __init__, the data lives in the arrays
+            view._store = self
+            view._row = row
+            self._views[row] = view
+        return view
+    
+    def __setitem__(self, account_id, account):
+        self.add(account_id, account.passcode, account.account_type, account.cents,
+                 getattr(account, "mobile_cents", 0))
+    
+    def __delitem__(self, account_id):
+        row = self._row(account_id)
+        if row is None:
+            raise KeyError(account_id)
+        if self._numeric_ids[row] == self.TEXT:
+            del self._text_rows[account_id]
+            del self._text_ids[row]
+        else:
+            self._index.remove(self._numeric_ids[row])
+        self._numeric_ids[row] = self.FREE
+        self._passcodes[row] = None
+        view = self._views.pop(row, None)
+        if view is not None: # a view someone still holds must not follow the row to the next account
+            view._row = None
+        self._free.append(row)
+        self._count -= 1
+    
+    def __contains__(self, account_id):
+        return self._row(account_id) is not None
+    
+    def _live_rows(self):
+        return [row for row, number in enumerate(self._numeric_ids) if number != self.FREE]
+    
+    def __iter__(self):
+        return iter([self.account_id(row) for row in self._live_rows()])
+    
+    def __len__(self):
+        return self._count
+    
+    def snapshot_lines(self):
+        """Yield one file line per account straight from the columns"""
+        format_fields = self._bank._format_fields
+        for row in self._live_rows():
+            account_id = self.account_id(row)
+            type_code = self._types[row]
+            yield account_id, format_fields(account_id, self._passcodes[row], self.TYPE_NAMES[type_code],
+                                            self._funds[row], self._mobile[row] if type_code else None)
+
+# Binary Ledger
+class BinaryLedger:
+    """Fixed-width binary account file opened through mmap
+
+    Layout: a 32 byte header (magic, version, id size, passcode size, number of
+    sorted records, total records, deleted records), then fixed-size records of
+    (id, passcode, type code, funds cents, mobile cents). The first sorted_count
+    records are sorted by id and are searched with a binary search - they are the
+    id index. Accounts created later are appended after them and found through a
+    small in-memory dict until the next compaction. Balances are changed in place."""
+    MAGIC = b"BANKLDG1"
+    HEADER = struct.Struct("<8sHHHIII") # magic, version, id size, passcode size, sorted count, record count, deleted count
+    HEADER_SIZE = 32
+    BALANCE = struct.Struct("<q") # one balance in cents
+    DELETED = 255 # type code of a deleted record
+    
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "r+b")
+        self._map = mmap.mmap(self._file.fileno(), 0)
+        (magic, version, self.id_size, self.passcode_size,
+         self.sorted_count, self.count, self.deleted) = self.HEADER.unpack_from(self._map, 0)
+        if magic != self.MAGIC or version != 1:
+            raise ValueError(f"{path} is not a binary ledger")
+        self.record = struct.Struct(f"<{self.id_size}s{self.passcode_size}sBqq")
+        self.funds_at = self.id_size + self.passcode_size + 1 # byte position of the balances inside a record
+        self._dirty_pages = set() # pages changed since the last flush - only these are written back
+        self._changed = None # record numbers changed while a compacted copy is being written (None - not tracking)
+        self._pages_lock = threading.Lock() # flush runs without the account locks, so the sets need their own
+        self._tail = {} # account_id -> record number for records after the sorted part
+        for index in range(self.sorted_count, self.count):
+            account_id = self.read(index)[0]
+            if self._type(index) != self.DELETED:
+                self._tail[account_id] = index
+    
+    @classmethod
+    def write(cls, path, rows, id_size=16, passcode_size=8):
+        """Atomically write a new ledger file from (account_id, passcode, type, funds, mobile) rows"""
+        rows = sorted(rows, key=lambda row: row[0].encode()) # sorted by the same bytes the binary search compares
+        passcode_size = max([passcode_size] + [len(row[1].encode()) for row in rows])
+        record = struct.Struct(f"<{id_size}s{passcode_size}sBqq")
+        temp_file = path + ".tmp"
+        with open(temp_file, "wb") as file:
+            header = cls.HEADER.pack(cls.MAGIC, 1, id_size, passcode_size, len(rows), len(rows), 0)
+            file.write(header.ljust(cls.HEADER_SIZE, b"\0"))
+            for account_id, passcode, account_type, funds, mobile_balance in rows:
+                if len(account_id.encode()) > id_size:
+                    raise ValueError(f"Account id too long for the binary ledger: {account_id}")
+                file.write(record.pack(account_id.encode(), passcode.encode(), 1 if account_type == "Personal" else 0,
+                                       funds, mobile_balance or 0))
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, path)
+    
+    def _offset(self, index):
+        return self.HEADER_SIZE + index * self.record.size
+    
+    def _type(self, index):
+        return self._map[self._offset(index) + self.id_size + self.passcode_size]
+    
+    def find(self, account_id):
+        """Return the record number of a live account, or None"""
+        key = account_id.encode()
+        if len(key) > self.id_size:
+            return None
+        key = key.ljust(self.id_size, b"\0")
+        low, high = 0, self.sorted_count
+        data, size = self._map, self.record.size
+        while low < high: # binary search over the sorted records
+            middle = (low + high) // 2
+            start = self.HEADER_SIZE + middle * size
+            found = data[start:start + self.id_size]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return middle if self._type(middle) != self.DELETED else self._tail.get(account_id)
+        return self._tail.get(account_id)
+    
+    def read(self, index):
+        """Return (account_id, passcode, type, funds, mobile) for one record"""
+        account_id, passcode, type_code, funds, mobile_balance = self.record.unpack_from(self._map, self._offset(index))
+        return (account_id.rstrip(b"\0").decode(), passcode.rstrip(b"\0").decode(),
+                ColumnarAccounts.TYPE_NAMES[type_code] if type_code != self.DELETED else None, funds, mobile_balance)
+    
+    def get_balance(self, index, which):
+        """which is 0 for funds and 1 for mobile balance"""
+        return self.BALANCE.unpack_from(self._map, self._offset(index) + self.funds_at + 8 * which)[0]
+    
+    def set_balance(self, index, which, cents):
+        start = self._offset(index) + self.funds_at + 8 * which
+        self.BALANCE.pack_into(self._map, start, cents)
+        self._touch(start, 8)
+    
+    def _touch(self, start, size):
+        """Remember the pages a change wrote to (and the record, while a compaction is tracking changes)"""
+        with self._pages_lock:
+            self._dirty_pages.add(start // mmap.PAGESIZE)
+            self._dirty_pages.add((start + size - 1) // mmap.PAGESIZE) # a field can cross a page boundary
+            if self._changed is not None and start >= self.HEADER_SIZE:
+                self._changed.add((start - self.HEADER_SIZE) // self.record.size)
+    
+    def set_passcode(self, index, passcode):
+        data = passcode.encode()
+        if len(data) > self.passcode_size:
+            raise ValueError("Passcode too long for the binary ledger")
+        start = self._offset(index) + self.id_size
+        self._map[start:start + self.passcode_size] = data.ljust(self.passcode_size, b"\0")
+        self._touch(start, self.passcode_size)
+    
+    def append(self, account_id, passcode, account_type, funds, mobile_balance):
+        """Add a record after the sorted part and return its record number"""
+        if len(account_id.encode()) > self.id_size:
+            raise ValueError("Account id too long for the binary ledger")
+        index = self.count
+        end = self._offset(index + 1)
+        if end > len(self._map): # growing the file by doubling so appends stay cheap
+            self._map.flush()
+            self._file.truncate(max(end, len(self._map) * 2))
+            self._map = mmap.mmap(self._file.fileno(), 0) # the old map is left for readers that still hold it
+        self.record.pack_into(self._map, self._offset(index), account_id.encode(), passcode.encode(),
+                              1 if account_type == "Personal" else 0, funds, mobile_balance or 0)
+        self._touch(self._offset(index), self.record.size)
+        self.count += 1
+        self._write_header()
+        self._tail[account_id] = index
+        return index
+    
+    def delete(self, index):
+        self._map[self._offset(index) + self.id_size + self.passcode_size] = self.DELETED
+        self._touch(self._offset(index) + self.id_size + self.passcode_size, 1)
+        self._tail.pop(self.read(index)[0], None)
+        self.deleted += 1
+        self._write_header()
+    
+    def _write_header(self):
+        self.HEADER.pack_into(self._map, 0, self.MAGIC, 1, self.id_size, self.passcode_size,
+                              self.sorted_count, self.count, self.deleted)
+        self._touch(0, self.HEADER_SIZE)
+    
+    def rows(self):
+        """Yield (account_id, passcode, type, funds, mobile) for every live record"""
+        for index in range(self.count):
+            row = self.read(index)
+            if row[2] is not None:
+                yield row
+    
+    def flush(self):
+        """Push in-place changes to disk - only the pages that were written to"""
+        with self._pages_lock:
+            pages, self._dirty_pages = sorted(self._dirty_pages), set()
+        if len(pages) > 256: # many scattered pages - one call for the whole map is cheaper
+            self._map.flush()
+            return
+        size = len(self._map)
+        for page in pages:
+            start = page * mmap.PAGESIZE
+            if start < size:
+                self._map.flush(start, min(mmap.PAGESIZE, size - start))
+    
+    def close(self):
+        self._map.flush()
+        self._file.close() # the map itself is closed once nothing refers to it
+
+class _BinaryView:
+    """Mixin that reads and writes account fields in a BinaryLedger record"""
+    def _index(self):
+        if self._record is None:
+            raise AccountNotFoundError("Account not found")
+        store = self._store
+        if self._generation != store.generation: # the file was compacted, so the record moved
+            self._record = store.ledger.find(self._account_id)
+            self._generation = store.generation
+        return self._record
+    
+    @property
+    def account_id(self):
+        return self._account_id
+    
+    @property
+    def passcode(self):
+        return self._store.ledger.read(self._index())[1]
+    
+    @passcode.setter
+    def passcode(self, value):
+        if len(value.encode()) > self._store.ledger.passcode_size: # e.g. a hash replacing a 4 digit passcode
+            self._store.compact(passcode_size=len(value.encode()))
+        self._store.ledger.set_passcode(self._index(), value)
+    
+    @property
+    def account_type(self):
+        return "Personal" if isinstance(self, PersonalAccount) else "Business"
+    
+    @property
+    def cents(self):
+        return self._store.ledger.get_balance(self._index(), 0)
+    
+    @cents.setter
+    def cents(self, value):
+        self._store.ledger.set_balance(self._index(), 0, value)
+        if self._store.index is not None:
+            self._store.index.set_balance(self._account_id, "funds", value)
+
+class BinaryPersonalAccount(_BinaryView, PersonalAccount):
+    """Personal account view over a binary ledger record"""
+    @property
+    def mobile_cents(self):
+        return self._store.ledger.get_balance(self._index(), 1)
+    
+    @mobile_cents.setter
+    def mobile_cents(self, value):
+        self._store.ledger.set_balance(self._index(), 1, value)
+        if self._store.index is not None:
+            self._store.index.set_balance(self._account_id, "mobile_balance", value)
+
+class BinaryBusinessAccount(_BinaryView, BusinessAccount):
+    """Business account view over a binary ledger record"""
+    pass
+
+class BinaryAccounts(MutableMapping):
+    """Dictionary-like account store backed by a memory-mapped BinaryLedger"""
+    def __init__(self, path):
+        if not os.path.exists(path):
+            BinaryLedger.write(path, [])
+        self.path = path
+        self.ledger = BinaryLedger(path)
+        self.generation = 0 # goes up on every compaction so views know to look their record up again
+        self._views = weakref.WeakValueDictionary() # account_id -> live view
+        self.index = None
+    
+    def __getitem__(self, account_id):
+        view = self._views.get(account_id)
+        if view is not None:
+            return view
+        index = self.ledger.find(account_id)
+        if index is None:
+            raise KeyError(account_id)
+        view_class = BinaryPersonalAccount if self.ledger.read(index)[2] == "Personal" else BinaryBusinessAccount
+        view = view_class.__new__(view_class) # no __init__, the data lives in the file
+        view._store, view._account_id, view._record, view._generation = self, account_id, index, self.generation
+        self._views[account_id] = view
+        return view
+    
+    def __setitem__(self, account_id, account):
+        index = self.ledger.find(account_id)
+        if index is not None: # replacing an account means deleting the old record
+            self.ledger.delete(index)
+            self._views.pop(account_id, None)
+        if len(account.passcode.encode()) > self.ledger.passcode_size:
+            self.compact(passcode_size=len(account.passcode.encode()))
+        self.ledger.append(account_id, account.passcode, account.account_type, account.cents,
+                           getattr(account, "mobile_cents", 0))
+    
+    def __delitem__(self, account_id):
+        index = self.ledger.find(account_id)
+        if index is None:
+            raise KeyError(account_id)
+        self.ledger.delete(index)
+        view = self._views.pop(account_id, None)
+        if view is not None: # the record is gone, so is the account behind the view
+            view._record = None
+    
+    def __contains__(self, account_id):
+        return self.ledger.find(account_id) is not None
+    
+    def __iter__(self):
+        return iter([row[0] for row in self.ledger.rows()])
+    
+    def __len__(self):
+        return self.ledger.count - self.ledger.deleted
+    
+    def compaction_due(self):
+        """True once appended or deleted records pile up enough to rewrite the file sorted"""
+        ledger = self.ledger
+        return (ledger.count - ledger.sorted_count) + ledger.deleted > max(1024, ledger.sorted_count // 8)
+    
+    # A compaction in three steps, so the account locks are not held while the file is written:
+    # copy the rows (locked), write the sorted copy (unlocked), then swap it in and carry over
+    # the records that changed in between (locked again, memory only).
+    def begin_compaction(self):
+        """Copy the live rows and start tracking changes - call with every account lock held"""
+        ledger = self.ledger
+        with ledger._pages_lock:
+            ledger._changed = set()
+        return ledger, list(ledger.rows())
+    
+    def write_compaction(self, ledger, rows):
+        """Write the sorted copy next to the ledger - no locks needed"""
+        BinaryLedger.write(self.path + ".compact", rows, ledger.id_size, ledger.passcode_size)
+    
+    def finish_compaction(self, ledger):
+        """Swap the sorted copy in, with the changes made while it was written - call with every lock held
+
+        Returns False (and drops the copy) if the ledger was replaced meanwhile,
+        e.g. compacted for a longer passcode."""
+        temp_file = self.path + ".compact"
+        with ledger._pages_lock:
+            changed, ledger._changed = ledger._changed, None
+        if self.ledger is not ledger:
+            os.remove(temp_file)
+            return False
+        os.replace(temp_file, self.path)
+        new = BinaryLedger(self.path)
+        for account_id in {ledger.read(index)[0] for index in changed}:
+            current, index = ledger.find(account_id), new.find(account_id)
+            row = ledger.read(current) if current is not None else None
+            if index is not None and (row is None or new.read(index)[2] != row[2]): # deleted (or replaced by another type)
+                new.delete(index)
+                index = None
+            if row is None:
+                continue
+            if index is None:
+                new.append(*row)
+            else:
+                new.set_passcode(index, row[1])
+                new.set_balance(index, 0, row[3])
+                new.set_balance(index, 1, row[4])
+        ledger.close()
+        self.ledger = new
+        self.generation += 1
+        return True
+    
+    def compact(self, passcode_size=None):
+        """Rewrite the file with every live record sorted by id (optionally with wider passcode fields)"""
+        rows = list(self.ledger.rows())
+        BinaryLedger.write(self.path, rows, self.ledger.id_size, max(passcode_size or 0, self.ledger.passcode_size))
+        self.ledger.close()
+        self.ledger = BinaryLedger(self.path)
+        self.generation += 1
+    
+    def close(self):
+        self.ledger.close()
+
+def convert_text_to_binary(text_file, binary_file):
+    """Convert an accounts.txt style file to the binary ledger format"""
+    rows = []
+    with open(text_file, "r") as file:
+        for line in file:
+            fields = BankingSystem._parse_fields(line)
+            if fields is not None:
+                rows.append(fields)
+    rows = list({row[0]: row for row in rows}.values()) # a later line for the same id wins, like in load_accounts
+    BinaryLedger.write(binary_file, rows)
+    return len(rows)
+
+def convert_binary_to_text(binary_file, text_file):
+    """Convert a binary ledger back to the accounts.txt text format"""
+    ledger = BinaryLedger(binary_file)
+    try:
+        count = 0
+        with open(text_file, "w") as file:
+            for row in ledger.rows():
+                file.write(BankingSystem._format_fields(*row))
+                count += 1
+    finally:
+        ledger.close()
+    return count
+
+# Account Id Allocation
+class IdAllocator:
+    """Hands out unique fixed-width account ids in constant time
+
+    The n-th id is lo + (multiplier * n + offset) % size, and because the multiplier
+    shares no factor with size this visits every id in the range exactly once in a
+    scrambled order - so there are no random collisions to retry. The counter is
+    saved in a small state file so a restart carries on where it stopped."""
+    def __init__(self, state_file, width=5):
+        self.state_file = state_file
+        self.width = width
+        self.low = 10 ** (width - 1) # e.g. 10000 for 5 digit ids
+        self.size = 9 * self.low # how many ids of this width exist
+        self.counter = 0
+        self.multiplier = self._pick_multiplier()
+        self.offset = None
+        self._load()
+        if self.offset is None:
+            import random # only a new ledger needs it
+            self.offset = random.randrange(self.size) # a random starting point for each new ledger
+    
+    def _pick_multiplier(self):
+        multiplier = int(self.size * 0.6180339887) | 1 # the golden ratio spreads consecutive ids far apart
+        while math.gcd(multiplier, self.size) != 1:
+            multiplier += 2
+        return multiplier
+    
+    def _load(self):
+        try:
+            with open(self.state_file, "r") as file:
+                width, counter, multiplier, offset = (int(value) for value in file.read().split(","))
+        except (OSError, ValueError): # no state yet (or a damaged file) - start a fresh sequence
+            return
+        if width == self.width and math.gcd(multiplier, self.size) == 1:
+            self.counter, self.multiplier, self.offset = counter, multiplier, offset
+    
+    def save(self):
+        """Write the allocator state (atomically, like the snapshot file)"""
+        temp_file = self.state_file + ".tmp"
+        with open(temp_file, "w") as file:
+            file.write(f"{self.width},{self.counter},{self.multiplier},{self.offset}")
+        os.replace(temp_file, self.state_file)
+    
+    def allocate(self, taken):
+        """Return the next id that is not in taken (ids from older files are simply skipped)"""
+        while self.counter < self.size:
+            number = self.low + (self.multiplier * self.counter + self.offset) % self.size
+            self.counter += 1
+            account_id = str(number)
+            if account_id not in taken: # each id comes up only once, so this skips at most the pre-existing ids
+                return account_id
+        raise BankingError(f"No {self.width} digit account ids left")
+
+# Passcode Hashing
+class PasscodeHasher:
+    """Salted PBKDF2-SHA256 passcode hashes stored as "pbkdf2_sha256$iterations$salt$hash"
+
+    iterations is the work factor - higher is slower for attackers and for us."""
+    PREFIX = "pbkdf2_sha256"
+    
+    def __init__(self, iterations=200_000):
+        self.iterations = iterations
+    
+    def hash(self, passcode):
+        import hashlib # pbkdf2_hmac is the slow salted hash used for passcodes
+        import secrets # cryptographically secure random salts
+        salt = secrets.token_bytes(16) # a new salt per passcode so equal passcodes get different hashes
+        digest = hashlib.pbkdf2_hmac("sha256", passcode.encode(), salt, self.iterations)
+        return f"{self.PREFIX}${self.iterations}${salt.hex()}${digest.hex()}"
+    
+    @classmethod
+    def is_hashed(cls, stored):
+        return stored.startswith(cls.PREFIX + "$")
+    
+    def verify(self, passcode, stored):
+        """Check a passcode against a stored hash (or a not yet migrated plaintext passcode)"""
+        import hashlib
+        import hmac # compare_digest compares secrets in constant time
+        if not self.is_hashed(stored):
+            return hmac.compare_digest(passcode.encode(), stored.encode())
+        try:
+            _, iterations, salt, digest = stored.split("$")
+            expected = bytes.fromhex(digest)
+            actual = hashlib.pbkdf2_hmac("sha256", passcode.encode(), bytes.fromhex(salt), int(iterations))
+        except ValueError: # a damaged hash never matches
+            return False
+        return hmac.compare_digest(actual, expected)
+    
+    def needs_rehash(self, stored):
+        """True for plaintext passcodes and hashes made with a different work factor"""
+        return not stored.startswith(f"{self.PREFIX}${self.iterations}$")
+
+class ExpiringCache:
+    """Small thread-safe LRU cache whose entries also expire after ttl seconds"""
+    def __init__(self, maxsize=10000, ttl=300):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._items = OrderedDict() # key -> (expires_at, value), oldest first
+        self._lock = threading.Lock()
+    
+    def get(self, key, default=None):
+        with self._lock:
+            item = self._items.get(key)
+            if item is None:
+                return default
+            if item[0] < time.monotonic(): # expired
+                del self._items[key]
+                return default
+            self._items.move_to_end(key) # recently used entries are evicted last
+            return item[1]
+    
+    def put(self, key, value):
+        with self._lock:
+            self._items[key] = (time.monotonic() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.maxsize:
+                self._items.popitem(last=False) # dropping the least recently used entry
+    
+    def pop(self, key, default=None):
+        with self._lock:
+            item = self._items.pop(key, None)
+        return default if item is None else item[1]
+    
+    def __len__(self):
+        return len(self._items)
+
+# Transaction History
+class TransactionHistory:
+    """Append-only history of balance changes with an index per account
+
+    Each line of the history file is "time,account_id,kind,cents,balance,other".
+    For every account the index keeps the byte offsets and times of its own
+    lines in two arrays (times only go up, so they are sorted). A statement
+    bisects the times for its date range and reads just the lines on the
+    requested page - the cost depends on the page size, not on how much
+    history this or any other account has.
+
+    record only buffers the lines (it is called while account locks are
+    held, so the lines follow the order of the balance changes);
+    write_pending writes them once the locks are released."""
+    def __init__(self, filename, fsync="never"):
+        self.filename = filename
+        self.index_file = filename + ".idx" # the index as it was at the last close, so only newer lines are scanned
+        self.fsync = fsync
+        self._offsets = {} # account_id -> array of byte offsets of its lines
+        self._times = {} # account_id -> array of the matching times
+        self._last_time = 0.0
+        self._pending = bytearray() # recorded lines not written to the file yet
+        self._lock = threading.Lock()
+        self._size = self._load_index()
+        self._scan_tail()
+        self._file = open(filename, "ab")
+        self._reader = None
+    
+    def _load_index(self):
+        """Load the saved index and return the file size it covers (0 if there is none)"""
+        try:
+            with open(self.index_file, "rb") as file:
+                size, last_time = file.readline().split(b",")
+                if int(size) > os.path.getsize(self.filename): # the history was replaced - rebuild
+                    return 0
+                for line in iter(file.readline, b""):
+                    account_id, count = line.decode().rstrip("\n").rsplit(",", 1)
+                    offsets, times = array("q"), array("d")
+                    offsets.fromfile(file, int(count))
+                    times.fromfile(file, int(count))
+                    self._offsets[account_id], self._times[account_id] = offsets, times
+                self._last_time = float(last_time)
+                return int(size)
+        except (OSError, ValueError, EOFError): # missing or damaged index - rebuild it from the history
+            self._offsets, self._times = {}, {}
+            return 0
+    
+    def _scan_tail(self):
+        """Index the lines written after the saved index, dropping a torn last line"""
+        if not os.path.exists(self.filename):
+            return
+        with open(self.filename, "r+b") as file:
+            file.seek(self._size)
+            offset = self._size
+            for line in file:
+                if not line.endswith(b"\n"): # cut short by a crash - removed so the next line starts cleanly
+                    file.truncate(offset)
+                    break
+                when, account_id, _ = line.split(b",", 2)
+                self._add(account_id.decode(), offset, float(when))
+                offset += len(line)
+            self._size = offset
+    
+    def _add(self, account_id, offset, when):
+        offsets = self._offsets.get(account_id)
+        if offsets is None:
+            offsets = self._offsets[account_id] = array("q")
+            self._times[account_id] = array("d")
+        offsets.append(offset)
+        self._times[account_id].append(when)
+        self._last_time = when
+    
+    def record(self, entries):
+        """Buffer (account_id, kind, cents, balance_cents, other) entries with the current time - no file I/O"""
+        with self._lock:
+            when = max(time.time(), self._last_time) # never goes back, even if the clock does
+            for account_id, kind, cents, balance, other in entries:
+                line = f"{when:.6f},{account_id},{kind},{cents},{balance},{other}\n".encode()
+                self._add(account_id, self._size + len(self._pending), when)
+                self._pending += line
+    
+    def write_pending(self):
+        """Append the buffered entries to the history file"""
+        with self._lock:
+            self._write_pending()
+    
+    def _write_pending(self):
+        if not self._pending:
+            return
+        self._file.write(self._pending)
+        self._file.flush() # in the OS cache, so statements can read it straight away
+        if self.fsync == "always":
+            os.fsync(self._file.fileno())
+        self._size += len(self._pending)
+        self._pending = bytearray()
+    
+    def count(self, account_id, start=None, end=None):
+        """Number of entries for an account with start <= time < end"""
+        return len(range(*self._range(account_id, start, end)))
+    
+    def _range(self, account_id, start, end):
+        times = self._times.get(account_id, ())
+        low = bisect.bisect_left(times, _timestamp(start)) if start is not None else 0
+        high = bisect.bisect_left(times, _timestamp(end)) if end is not None else len(times)
+        return low, max(low, high)
+    
+    def statement(self, account_id, start=None, end=None, page=1, page_size=50):
+        """Return one page (oldest first) of an account's entries with start <= time < end
+
+        start and end are datetimes, dates or Unix timestamps. The result is a
+        dict with the entries, the page number, the number of pages and the
+        total number of entries in the range."""
+        if page < 1 or page_size < 1:
+            raise ValueError("page and page_size must be at least 1")
+        with self._lock:
+            self._write_pending() # the offsets of buffered entries point past the end of the file
+            low, high = self._range(account_id, start, end)
+            first = low + (page - 1) * page_size
+            offsets = self._offsets[account_id][first:min(high, first + page_size)] if first < high else ()
+            if offsets and self._reader is None:
+                self._reader = open(self.filename, "rb")
+            lines = []
+            for offset in offsets:
+                self._reader.seek(offset)
+                lines.append(self._reader.readline().decode())
+        entries = []
+        for line in lines:
+            when, _, kind, cents, balance, other = line.rstrip("\n").split(",", 5)
+            entries.append({"time": float(when), "kind": kind, "amount": int(cents) / 100,
+                            "balance": int(balance) / 100, "other": other})
+        total = high - low
+        return {"entries": entries, "page": page, "pages": -(-total // page_size), "total": total}
+    
+    def flush(self):
+        with self._lock:
+            self._write_pending()
+            os.fsync(self._file.fileno())
+    
+    def close(self):
+        """Close the files and save the index so the next start does not scan the history"""
+        with self._lock:
+            self._write_pending()
+            self._file.close()
+            if self._reader is not None:
+                self._reader.close()
+                self._reader = None
+            temp_file = self.index_file + ".tmp"
+            with open(temp_file, "wb") as file:
+                file.write(f"{self._size},{self._last_time!r}\n".encode())
+                for account_id, offsets in self._offsets.items():
+                    file.write(f"{account_id},{len(offsets)}\n".encode())
+                    offsets.tofile(file)
+                    self._times[account_id].tofile(file)
+            os.replace(temp_file, self.index_file)
+
+def _timestamp(value):
+    """Unix time for a number, datetime or date (dates count from local midnight)"""
+    if isinstance(value, (int, float)):
+        return float(value)
+    return time.mktime(value.timetuple()) + getattr(value, "microsecond", 0) / 1e6
+
+def _fsync_directory(path):
+    """fsync the directory holding path, so a rename inside it survives a power cut"""
+    try:
+        fd = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    except OSError: # e.g. Windows, where directories cannot be opened - rename there is already durable
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+def _numpy():
+    """NumPy if it is installed, otherwise None - it is only used to speed up the bulk operations"""
+    try:
+        import numpy
+    except ImportError:
+        return None
+    return numpy
+
+# Secondary Indexes
+class _SortedList:
+    """Sorted list split into buckets of a few hundred keys, with the last key of every bucket in its own list
+
+    Finding a key is two binary searches and adding or removing one only
+    shifts the keys of one small bucket, so both stay fast at millions of keys."""
+    LOAD = 512 # a bucket is split once it holds twice this many keys
+
+    def __init__(self, keys=()):
+        keys = sorted(keys)
+        self._buckets = [keys[start:start + self.LOAD] for start in range(0, len(keys), self.LOAD)]
+        self._maxes = [bucket[-1] for bucket in self._buckets]
+        self._len = len(keys)
+
+    def __len__(self):
+        return self._len
+
+    def add(self, key):
+        self._len += 1
+        if not self._buckets:
+            self._buckets, self._maxes = [[key]], [key]
+            return
+        number = min(bisect.bisect_left(self._maxes, key), len(self._maxes) - 1) # past the end goes in the last bucket
+        bucket = self._buckets[number]
+        bisect.insort(bucket, key)
+        self._maxes[number] = bucket[-1]
+        if len(bucket) > 2 * self.LOAD:
+            self._buckets.insert(number + 1, bucket[self.LOAD:])
+            del bucket[self.LOAD:]
+            self._maxes.insert(number, bucket[-1])
+
+    def remove(self, key):
+        number = bisect.bisect_left(self._maxes, key)
+        bucket = self._buckets[number]
+        del bucket[bisect.bisect_left(bucket, key)]
+        self._len -= 1
+        if bucket:
+            self._maxes[number] = bucket[-1]
+        else:
+            del self._buckets[number], self._maxes[number]
+
+    def ascending(self, low):
+        """Yield the keys >= low, smallest first"""
+        number = bisect.bisect_left(self._maxes, low)
+        if number < len(self._buckets):
+            bucket = self._buckets[number]
+            yield from bucket[bisect.bisect_left(bucket, low):]
+            for bucket in self._buckets[number + 1:]:
+                yield from bucket
+
+    def descending(self, high):
+        """Yield the keys < high, largest first"""
+        number = bisect.bisect_left(self._maxes, high)
+        if number < len(self._buckets):
+            bucket = self._buckets[number]
+            yield from reversed(bucket[:bisect.bisect_left(bucket, high)])
+        for bucket in reversed(self._buckets[:number]):
+            yield from reversed(bucket)
+
+class AccountIndex:
+    """Secondary indexes over the accounts, kept up to date on every balance change
+
+    For each account type the ids are kept sorted by balance, and personal
+    accounts also by mobile balance, as (cents, account_id) keys. Range and
+    top-k queries start with a binary search and then only read the keys they
+    return. Business accounts have no mobile balance and are not in that index."""
+    FIELDS = ("funds", "mobile_balance")
+
+    def __init__(self):
+        self._entries = {} # account_id -> [account_type, funds cents, mobile cents]
+        self._sorted = {(field, account_type): _SortedList() for field in self.FIELDS
+                        for account_type in ColumnarAccounts.TYPE_NAMES}
+        self._lock = threading.Lock() # balance setters of different accounts run in different threads
+
+    def build(self, rows):
+        """Index (account_id, account_type, funds, mobile_balance) rows in cents, replacing the current contents"""
+        entries = {account_id: [account_type, funds, mobile_balance or 0] for account_id, account_type, funds, mobile_balance in rows}
+        with self._lock:
+            self._entries = entries
+            for field, account_type in self._sorted: # sorting each list once is much faster than adding keys one by one
+                position = 1 if field == "funds" else 2
+                self._sorted[field, account_type] = _SortedList(
+                    (entry[position], account_id) for account_id, entry in entries.items()
+                    if entry[0] == account_type and (field == "funds" or account_type == "Personal"))
+
+    def add(self, account_id, account_type, funds, mobile_balance=0):
+        with self._lock:
+            if account_id in self._entries:
+                self._discard(account_id)
+            self._entries[account_id] = [account_type, funds, mobile_balance or 0]
+            self._sorted["funds", account_type].add((funds, account_id))
+            if account_type == "Personal":
+                self._sorted["mobile_balance", account_type].add((mobile_balance or 0, account_id))
+
+    def remove(self, account_id):
+        with self._lock:
+            if account_id in self._entries:
+                self._discard(account_id)
+
+    def _discard(self, account_id):
+        account_type, funds, mobile_balance = self._entries.pop(account_id)
+        self._sorted["funds", account_type].remove((funds, account_id))
+        if account_type == "Personal":
+            self._sorted["mobile_balance", account_type].remove((mobile_balance, account_id))
+
+    def set_balance(self, account_id, field, cents):
+        """Move an account to its new place in the funds or mobile_balance index (ids not indexed yet are ignored)"""
+        with self._lock:
+            entry = self._entries.get(account_id)
+            if entry is None:
+                return
+            position = 1 if field == "funds" else 2
+            if entry[position] == cents:
+                return
+            if field == "funds" or entry[0] == "Personal":
+                keys = self._sorted[field, entry[0]]
+                keys.remove((entry[position], account_id))
+                keys.add((cents, account_id))
+            entry[position] = cents
+
+    def _lists(self, field, account_type):
+        if field not in self.FIELDS:
+            raise BankingError(f"Unknown balance field: {field}")
+        if account_type is not None and account_type not in ColumnarAccounts.TYPE_NAMES:
+            raise BankingError(f"Unknown account type: {account_type}")
+        return [keys for (key_field, key_type), keys in self._sorted.items()
+                if key_field == field and account_type in (None, key_type)]
+
+    def range(self, field="funds", account_type=None, low=None, high=None, limit=None):
+        """Return (account_id, cents) with low <= cents < high (None - no bound), lowest first"""
+        import heapq # only needed for queries
+        with self._lock:
+            streams = [keys.ascending((low, "") if low is not None else (-math.inf,)) for keys in self._lists(field, account_type)]
+            result = []
+            for cents, account_id in heapq.merge(*streams): # each type is already sorted, so merging keeps the order
+                if (high is not None and cents >= high) or (limit is not None and len(result) >= limit):
+                    break
+                result.append((account_id, cents))
+        return result
+
+    def top(self, count, field="funds", account_type=None):
+        """Return the count (account_id, cents) with the highest balance, highest first"""
+        import heapq
+        import itertools
+        with self._lock:
+            streams = [keys.descending((math.inf,)) for keys in self._lists(field, account_type)]
+            return [(account_id, cents) for cents, account_id in itertools.islice(heapq.merge(*streams, reverse=True), count)]
+
+    def __len__(self):
+        return len(self._entries)
 
 # Banking System Class
-class BankingSystem: # 
+class BankingSystem: #
     """Main banking system that manages accounts and file operations"""
-    def __init__(self, filename="accounts.txt"): # initializing the banking system with a file name to store accounts
+    SNAPSHOT_HEADER_SIZE = 64 # "#snapshot,<generation>,<records>,<crc32>" padded with spaces, so it can be rewritten in place
+
+    def __init__(self, filename="accounts.txt", storage="snapshot", fsync="always", checkpoint_every=10000,
+                 group_commit=False, commit_window=0.005, commit_batch=1000, lazy=False, columnar=False,
+                 id_width=5, passcode_iterations=None, cache_size=10000, cache_ttl=300,
+                 max_login_failures=5, lockout_seconds=60, history=False, indexes=False): # initializing the banking system with a file name to store accounts
+        # snapshot - rewrite the whole file on every save, journal - append one record per change,
+        # binary - fixed-width records in a memory-mapped file that are changed in place,
+        # fixed - the text format with every line padded to the same width so changed accounts are overwritten in place
+        if storage not in ("snapshot", "journal", "binary", "fixed"):
+            raise ValueError(f"Unknown storage mode: {storage}")
+        if fsync not in ("always", "never"): # always - fsync after every journal append, never - leave flushing to the operating system
+            raise ValueError(f"Unknown fsync policy: {fsync}")
         self.filename = filename
-        self.accounts = {}
-        self.load_accounts() # loading accounts from file storage
+        self.storage = storage
+        self.fsync = fsync
+        self.checkpoint_every = checkpoint_every # number of journal records before the log is folded into the snapshot file
+        self.journal_file = filename + ".log" # the write-ahead log lives next to the snapshot file
+        self.journal_records = 0
+        self.snapshot_generation = 0 # goes up by one with every checksummed snapshot written (see recover_snapshot)
+        # Group commit - saves are queued and written together once per time window or batch size
+        self.group_commit = group_commit
+        self.commit_window = commit_window # seconds to wait for more changes before flushing
+        self.commit_batch = commit_batch # flush early once this many records are waiting
+        self.commit_groups = 0 # number of flushes done so far
+        self._pending = [] # list of (records, future) waiting for the next flush
+        self._pending_count = 0
+        self._commit_cond = threading.Condition()
+        self._flusher = None
+        self._closed = False
+        self._io_lock = threading.RLock() # serializes writers to the files, always taken before any account lock
+        self._store_lock = threading.Lock() # guards adding and removing accounts in the store
+        self.lazy = lazy # lazy - only index the file at startup and build accounts on first use
+        self.index_file = filename + ".idx" # sidecar file with the saved offset index
+        self.holds = {} # txid -> (kind, account_id, cents) for prepared two-phase transfers (see prepare_debit)
+        self.holds_file = filename + ".holds" # prepared holds at the time of the last snapshot
+        if lazy + columnar + (storage in ("binary", "fixed")) > 1:
+            raise ValueError("lazy, columnar, binary and fixed modes cannot be combined")
+        if storage == "fixed" and group_commit: # every save is already a few small writes
+            raise ValueError("group commit is not used with fixed storage")
+        if lazy and indexes: # building the indexes would read every account at startup
+            raise ValueError("indexes cannot be combined with lazy mode")
+        self._slots = {} # fixed storage: account_id -> byte offset of its line
+        self._free_slots = [] # offsets of lines left blank by deleted accounts
+        self._slot_width = 0 # length of every line in the fixed-width file
+        self._slot_end = 0
+        self._slot_file = None
+        self.columnar = columnar # columnar - keep balances in packed arrays instead of one object per account
+        self.accounts = ColumnarAccounts(self) if columnar else {}
+        self.id_allocator = IdAllocator(filename + ".ids", id_width) # id_width - number of digits in new account ids
+        # Passcodes - with passcode_iterations set, passcodes are stored as salted slow hashes. Logins that were
+        # verified recently are cached so repeat logins skip the hash, and repeated failures lock the account id out.
+        self.hasher = PasscodeHasher(passcode_iterations) if passcode_iterations else None
+        self._cache_key = None # cache keys are HMACs with this random key, so plaintext passcodes are never kept
+        if self.hasher is not None:
+            import secrets
+            self._cache_key = secrets.token_bytes(32)
+        self.verified = ExpiringCache(cache_size, cache_ttl) # recently verified credentials
+        self.sessions = ExpiringCache(cache_size, cache_ttl) # session token -> account_id
+        self.max_login_failures = max_login_failures
+        self.lockout_seconds = lockout_seconds
+        # account_id -> (failed attempts, time.monotonic() they are forgotten) - a plain dict, not a cache, so
+        # failures on other ids can never evict a lockout. Only existing accounts get an entry.
+        self.failures = {}
+        self._failures_lock = threading.Lock()
+        # history - keep every balance change in "<filename>.history" for statements
+        self.history = TransactionHistory(filename + ".history") if history else None # written with each save, fsynced at checkpoints
+        # indexes - keep accounts sorted by balance per type for query_accounts and top_accounts
+        self.index = AccountIndex() if indexes else None
+        self.load_accounts() # loading accounts from file storage (and indexing them)
+        if self.hasher is not None and not lazy and storage != "binary": # lazy stores are migrated on first login
+            self.migrate_passcodes()
+    
+    @staticmethod
+    def _parse_fields(line):
+        """Split one line of the accounts file into (account_id, passcode, account_type, funds, mobile_balance)
+        with both balances in cents"""
+        if line.startswith("#"): # the snapshot header is not an account
+            return None
+        data = line.strip().split(",")
+        if len(data) < 4: # lenth of data should be at least 4 (account_id, passcode, account_type, funds)
+            return None
+        
+        account_id, passcode, account_type, funds = data[:4] # unpacking the data
+        funds = parse_cents(funds) # converting funds to exact cents in particular for currency handling
+        
+        # Handle mobile balance for personal accounts
+        if len(data) > 4 and account_type == "Personal":
+            mobile_balance = parse_cents(data[4]) # if there is a mobile balance it is converted to cents too
+        else:
+            mobile_balance = (0) # default mobile balance for business accounts
+        return account_id, passcode, account_type, funds, mobile_balance
+    
+    def _parse_account(self, line):
+        """Build an account object from one line of the accounts file"""
+        fields = self._parse_fields(line)
+        if fields is None:
+            return None
+        account_id, passcode, account_type, funds, mobile_balance = fields
+        if account_type == "Personal":
+            account = PersonalAccount(account_id, passcode)
+            account.mobile_cents = mobile_balance
+        else:
+            account = BusinessAccount(account_id, passcode)
+        account.cents = funds
+        account.dirty = False # same as the file
+        return account
+    
+    @staticmethod
+    def _format_fields(account_id, passcode, account_type, funds, mobile_balance=None):
+        """Turn account fields (balances in cents) into one line of the accounts file"""
+        if account_type == "Personal":
+            return f"{account_id},{passcode},{account_type},{format_cents(funds)},{format_cents(mobile_balance)}\n"
+            # writing personal account details and mobile balance
+        return f"{account_id},{passcode},{account_type},{format_cents(funds)}\n"
     
+    def _format_account(self, account):
+        """Turn an account object into one line of the accounts file"""
+        return self._format_fields(account.account_id, account.passcode, account.account_type,
+                                   account.cents, getattr(account, "mobile_cents", None))
+    
+    @instrumented("load_accounts")
     def load_accounts(self): 
         """Load accounts from file storage""" 
-        if not os.path.exists(self.filename): # check if the file exists
+        self._load_holds()
+        if self.storage == "binary": # nothing is parsed, records are read from the mapped file when used
+            if isinstance(self.accounts, BinaryAccounts):
+                self.accounts.close()
+            self.accounts = BinaryAccounts(self.filename)
+            if self.index is not None:
+                self.rebuild_index()
             return
+        if self.storage != "fixed": # fixed files are changed in place, so they carry no checksum
+            self.recover_snapshot()
+        if self.lazy:
+            self.accounts = LazyAccounts(self, self._load_index(defer=True))
+        elif os.path.exists(self.filename): # check if the file exists
+            with open(self.filename, "r") as file:
+                for line in file: # iterating through each line in the file
+                    try:
+                        if self.columnar: # columns are filled directly without building account objects
+                            fields = self._parse_fields(line)
+                            if fields is not None:
+                                self.accounts.add(*fields)
+                            continue
+                        account = self._parse_account(line)
+                        if account is None:
+                            continue 
+                        self.accounts[account.account_id] = account
+                    except (ValueError, IndexError) as e: # catching errors such as value error (if funds is not a number) or index error (if data is not enough)
+                        print(f"Error loading account data: {e}")
+                        METRICS.inc("banking_load_errors_total")
+                        continue
+        self.replay_journal() # changes made after the last checkpoint are only in the log
+        if self.storage == "fixed":
+            self._load_slots()
+        if self.index is not None: # the loaded accounts are new objects the old index knows nothing about
+            self.rebuild_index()
+    
+    def _file_stamp(self):
+        """Size and modification time of the snapshot file, used to tell if the sidecar index is current"""
+        stat = os.stat(self.filename)
+        return f"{stat.st_size},{stat.st_mtime_ns}"
+    
+    def _load_index(self, defer=False):
+        """Return the account_id -> byte offset index, from the sidecar file if it is current
+
+        With defer set a current sidecar is not read and None is returned -
+        LazyAccounts loads it when it first needs it."""
+        if not os.path.exists(self.filename):
+            return {}
+        try:
+            with open(self.index_file, "r") as file:
+                if self._index_width(file.readline()) is not None:
+                    if defer:
+                        return None
+                    offsets = {}
+                    for line in file:
+                        account_id, _, offset = line.rpartition(",")
+                        offsets[account_id] = int(offset)
+                    return offsets
+        except (OSError, ValueError): # missing or damaged sidecar - just rebuild it
+            pass
         
-        with open(self.filename, "r") as file:
-            for line in file: # iterating through each line in the file
-                try:
-                    data = line.strip().split(",")
-                    if len(data) < 4: # lenth of data should be at least 4 (account_id, passcode, account_type, funds)
-                        continue 
-                    
-                    account_id, passcode, account_type, funds = data[:4] # unpacking the data
-                    funds = float(funds) # converting funds to float in particular for currency handling
-                    
-                    # Handle mobile balance for personal accounts
-                    if len(data) > 4 and account_type == "Personal":
-                        mobile_balance = float(data[4]) # if there is a mobile balance it is converted to float
+        offsets = {}
+        offset = 0
+        with open(self.filename, "rb") as file: # binary mode so offsets are exact byte positions
+            for line in file:
+                comma = line.find(b",")
+                if comma > 0 and not line.startswith(b"#"): # only the id is read here, the rest of the line is parsed on first access
+                    offsets[line[:comma].decode()] = offset
+                offset += len(line)
+        self._write_index(offsets)
+        return offsets
+    
+    def _write_index(self, offsets):
+        """Save the offset index next to the snapshot so the next startup can skip the scan
+
+        The lines are sorted by id and padded to one width (kept in the header
+        after the file stamp), so _index_lookup can binary search the file."""
+        lines = [f"{account_id},{offset}" for account_id, offset in sorted(offsets.items())]
+        width = max(map(len, lines), default=0) + 1 # + the newline
+        # written to a temp file and renamed, so a reader holding the shared ledger lock never sees half of it
+        # (the temp name is per process and thread because two readers may rebuild the index at once)
+        temp_file = f"{self.index_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        try:
+            with open(temp_file, "w") as file:
+                file.write(f"{self._file_stamp()},{width}\n")
+                file.writelines(line.ljust(width - 1) + "\n" for line in lines)
+            os.replace(temp_file, self.index_file)
+        except OSError as e: # the sidecar is only an optimization
+            print(f"Could not write account index: {e}")
+            if os.path.exists(temp_file):
+                os.remove(temp_file)
+
+    def _index_width(self, header):
+        """Line width from a sidecar header, or None if it was not written for the snapshot as it is now"""
+        stamp, _, width = header.strip().rpartition(",")
+        if stamp != self._file_stamp() or not width.isdigit(): # stale, or the older unsorted format
+            return None
+        return int(width)
+
+    def _index_lookup(self, account_id):
+        """Byte offset of one account from a binary search of the sorted sidecar, without loading it
+
+        Returns None if the account is not there and False if the sidecar
+        is missing or no longer matches the snapshot."""
+        key = account_id.encode()
+        try:
+            file = open(self.index_file, "rb")
+        except OSError:
+            return False
+        with file:
+            header = file.readline()
+            width = self._index_width(header.decode())
+            if width is None:
+                return False
+            start = len(header)
+            count = (os.fstat(file.fileno()).st_size - start) // width
+            if count == 0:
+                return None
+            with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as data:
+                low, high = 0, count
+                while low < high: # str and UTF-8 bytes sort the same way, so comparing bytes is fine
+                    middle = (low + high) // 2
+                    position = start + middle * width
+                    found, _, offset = data[position:position + width].rstrip().rpartition(b",")
+                    if found < key:
+                        low = middle + 1
+                    elif found > key:
+                        high = middle
+                    else:
+                        return int(offset)
+        return None
+    
+    def _load_slots(self):
+        """Find the line of every account in the fixed-width file, rewriting the file once if it is not fixed-width yet"""
+        self._slots, self._free_slots, self._slot_end, self._slot_width = {}, [], 0, 0
+        widths = set()
+        duplicates = False
+        if os.path.exists(self.filename):
+            with open(self.filename, "rb") as file:
+                for line in file:
+                    widths.add(len(line) if line.endswith(b"\n") else -1)
+                    account_id = line.split(b",", 1)[0].strip().decode()
+                    if account_id.startswith("#"): # a snapshot header - the file is rewritten without it
+                        widths.add(-1)
+                    elif not account_id:
+                        self._free_slots.append(self._slot_end)
                     else:
-                        mobile_balance = (0) # default mobile balance for business accounts
-                    
-                    if account_type == "Personal":
-                        account = PersonalAccount(account_id, passcode, funds)
-                        account.mobile_balance = mobile_balance
+                        duplicates = duplicates or account_id in self._slots
+                        self._slots[account_id] = self._slot_end
+                    self._slot_end += len(line)
+        if len(widths) == 1 and -1 not in widths and not duplicates and not self.journal_records:
+            self._slot_width = widths.pop()
+        elif widths or self.accounts: # e.g. an accounts.txt (or log) from another storage mode
+            self.checkpoint()
+    
+    def _slot_fd(self):
+        if self._slot_file is None:
+            self._slot_file = open(self.filename, "r+b")
+        return self._slot_file.fileno()
+    
+    def _write_in_place(self, accounts):
+        """Overwrite the lines of the dirty accounts among the given ones - new accounts get a free or new line"""
+        with self._io_lock:
+            with account_locks(*accounts): # the lines are read while no transfer is half done
+                lines = []
+                for account in accounts:
+                    if account.dirty:
+                        lines.append((account.account_id, self._format_account(account).encode()))
+                        account.dirty = False
+            if not lines:
+                return
+            width = self._slot_width
+            if any(len(line) > width for _, line in lines): # a line outgrew the width (or there is no file yet)
+                self.checkpoint() # rewrites every line with a wider width
+                return
+            fd = self._slot_fd()
+            for account_id, line in lines:
+                offset = self._slots.get(account_id)
+                if offset is None:
+                    if self._free_slots:
+                        offset = self._free_slots.pop()
                     else:
-                        account = BusinessAccount(account_id, passcode, funds)
-                    
-                    self.accounts[account_id] = account
-                except (ValueError, IndexError) as e: # catching errors such as value error (if funds is not a number) or index error (if data is not enough)
-                    print(f"Error loading account data: {e}")
-                    continue
-    
-    def save_accounts(self): # 
-        """Save accounts to file storage"""
-        with open(self.filename, "w") as file: # opening the file in write mode
-            for account in self.accounts.values(): # iterating through each account in the accounts dictionary
-                if isinstance(account, PersonalAccount):
-                    file.write(f"{account.account_id},{account.passcode},{account.account_type},{account.funds},{account.mobile_balance}\n")
-                    # writing personal account details and mobile balance
+                        offset, self._slot_end = self._slot_end, self._slot_end + width
+                    self._slots[account_id] = offset
+                os.pwrite(fd, line[:-1].ljust(width - 1) + b"\n", offset) # one write per line, the rest of the file is untouched
+            if self.fsync == "always":
+                os.fsync(fd)
+            METRICS.inc("banking_bytes_written_total", len(lines) * width, file="fixed")
+    
+    def _blank_slot(self, account_id):
+        """Blank out a deleted account's line so it can be reused"""
+        with self._io_lock:
+            offset = self._slots.pop(account_id, None)
+            if offset is None:
+                return
+            fd = self._slot_fd()
+            os.pwrite(fd, b" " * (self._slot_width - 1) + b"\n", offset)
+            if self.fsync == "always":
+                os.fsync(fd)
+            self._free_slots.append(offset)
+    
+    def replay_journal(self):
+        """Apply the write-ahead log on top of the loaded snapshot
+
+        A G record frames the records of one save (like both sides of a
+        transfer): they are applied only if all of them made it to disk.
+        A torn tail from a crash mid-append is ignored and cut off, so the
+        next append does not start in the middle of a line."""
+        self.journal_records = 0
+        if not os.path.exists(self.journal_file):
+            return
+        with open(self.journal_file, "rb") as file: # binary so we know the byte position of the last whole record
+            good = 0 # end of the last complete record or group
+            while True:
+                raw = file.readline()
+                if not raw.endswith(b"\n"): # end of the log, or a torn last record
+                    break
+                if raw.startswith(b"G,"): # G,<records>,<crc32> - a group that is applied all or nothing
+                    try:
+                        _, count, checksum = raw.decode().strip().split(",")
+                        group = [file.readline().replace(b"\r\n", b"\n") for _ in range(int(count))]
+                    except ValueError:
+                        break
+                    if not all(line.endswith(b"\n") for line in group) or f"{zlib.crc32(b''.join(group)):08x}" != checksum:
+                        break # the crash cut the group short, so none of it happened
+                    self.journal_records += 1
                 else:
-                    file.write(f"{account.account_id},{account.passcode},{account.account_type},{account.funds}\n")
+                    group = [raw]
+                for line in group:
+                    try:
+                        self._replay_record(line.decode())
+                        self.journal_records += 1
+                    except (ValueError, IndexError) as e:
+                        print(f"Error replaying journal record: {e}")
+                        METRICS.inc("banking_load_errors_total")
+                good = file.tell()
+            torn = file.seek(0, os.SEEK_END) > good
+        if torn:
+            try:
+                with open(self.journal_file, "r+b") as file:
+                    file.truncate(good)
+            except OSError as e: # a read-only log still replays, it just keeps its torn tail
+                print(f"Could not trim the journal: {e}")
     
-    def create_account(self, account_type):
-        """Create a new bank account"""
-        account_id = str(random.randint(10000, 99999)) # the account can contain 5 digit numbers beteween 10000 and 99999 
-        passcode = str(random.randint(1000, 9999)) # str used instead of int because there could be leading zeros and integers in python do not preserve leading zeros so the accountid or passcode will have lesser digits then 5 and 4 respectively
+    def _replay_record(self, line):
+        """Apply one journal record"""
+        kind, _, record = line.rstrip("\r\n").partition(",")
+        if kind == "S": # S - full state of one account (replaying it twice gives the same result)
+            account = self._parse_account(record)
+            if account is not None:
+                self.accounts[account.account_id] = account
+        elif kind == "D": # D - account deleted
+            self.accounts.pop(record.strip(), None)
+        elif kind == "H": # H - a two-phase transfer hold was prepared, with the account state after it
+            txid, hold_kind, cents, account_line = record.split(",", 3)
+            account = self._parse_account(account_line)
+            self.accounts[account.account_id] = account
+            self.holds[txid] = (hold_kind, account.account_id, int(cents))
+        elif kind == "R": # R - a hold was committed or aborted, with the account state if it changed
+            txid, _, account_line = record.partition(",")
+            if account_line.strip():
+                account = self._parse_account(account_line)
+                self.accounts[account.account_id] = account
+            self.holds.pop(txid, None)
+    
+    def _load_holds(self):
+        """Read the holds that were open at the last snapshot (the journal adds any later ones)"""
+        self.holds = {}
+        if not os.path.exists(self.holds_file):
+            return
+        with open(self.holds_file, "r") as file:
+            for line in file:
+                try:
+                    txid, kind, account_id, cents = line.strip().split(",")
+                    self.holds[txid] = (kind, account_id, int(cents))
+                except ValueError as e:
+                    print(f"Error loading transfer hold: {e}")
+    
+    def _write_holds(self, holds):
+        """Atomically save the open holds next to the snapshot"""
+        if not holds:
+            if os.path.exists(self.holds_file):
+                os.remove(self.holds_file)
+            return
+        temp_file = self.holds_file + ".tmp"
+        with open(temp_file, "w") as file:
+            file.writelines(f"{txid},{kind},{account_id},{cents}\n" for txid, (kind, account_id, cents) in holds.items())
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(temp_file, self.holds_file)
+        _fsync_directory(self.holds_file)
+    
+    @instrumented("save_accounts")
+    def save_accounts(self, *changed): # 
+        """Save accounts to file storage
+
+        In journal mode the changed accounts are appended to the log, otherwise
+        (or when no accounts are given) the whole snapshot is rewritten. With
+        group commit on, a Future is returned that completes once the change is
+        on disk. In fixed mode only dirty accounts are written, each to its own line."""
+        if self.history is not None: # the entries the saved operations recorded under their locks
+            self.history.write_pending()
+        if self.storage == "fixed":
+            if not changed: # every account whose balance changed since it was last written
+                changed = [account for account in list(self.accounts.values()) if account.dirty]
+            return self._write_in_place(changed)
+        if self.storage == "journal" and changed:
+            with self._io_lock: # records have to reach the log in the same order their balances were read
+                with account_locks(*changed): # reading the accounts while no transfer is half done
+                    records = ["S," + self._format_account(account) for account in changed]
+                if len(records) > 1: # framed, so replay applies the whole change or none of it
+                    records.insert(0, f"G,{len(records)},{zlib.crc32(''.join(records).encode()):08x}\n")
+                return self._commit(records)
+        return self._commit(None) # None means a full snapshot
+    
+    def _commit(self, records):
+        """Persist records now, or queue them for the next group commit"""
+        if not self.group_commit:
+            with self._io_lock: # one writer at a time - account locks are not held here
+                if records is None:
+                    self.checkpoint()
+                else:
+                    self._append_journal(records)
+            return None
         
-        if account_type.lower() == "personal": # 
-            account = PersonalAccount(account_id, passcode)
+        from concurrent.futures import Future # a Future is how callers wait for their group of changes to be committed
+        future = Future()
+        with self._commit_cond:
+            if self._closed:
+                raise BankingError("Banking system is closed")
+            was_empty = not self._pending
+            self._pending.append((records, future))
+            self._pending_count += len(records) if records else 1
+            if self._flusher is None: # starting the flusher thread the first time it is needed
+                self._flusher = threading.Thread(target=self._commit_loop, name="bank-group-commit", daemon=True)
+                self._flusher.start()
+            if was_empty or self._pending_count >= self.commit_batch: # only waking the flusher when it has something new to decide
+                self._commit_cond.notify()
+        return future
+    
+    def _commit_loop(self):
+        """Background thread that writes each group of queued changes with one flush"""
+        while True:
+            with self._commit_cond:
+                while not self._pending and not self._closed:
+                    self._commit_cond.wait()
+                if not self._pending: # closed and nothing left to write
+                    return
+                deadline = time.monotonic() + self.commit_window
+                while self._pending_count < self.commit_batch and not self._closed: # collecting more changes until the window ends
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._commit_cond.wait(remaining)
+                batch, self._pending, self._pending_count = self._pending, [], 0
+            self._flush_group(batch)
+    
+    def _flush_group(self, batch):
+        """Write one group of changes and complete every waiting Future"""
+        try:
+            records = [record for group, _ in batch if group for record in group]
+            if (self.storage == "snapshot" or any(group is None for group, _ in batch)
+                    or self.journal_records + len(records) >= self.checkpoint_every):
+                with self._io_lock: # no new record can be read while the snapshot is taken
+                    with self._commit_cond: # anything queued meanwhile is older than the snapshot, so it is covered too
+                        batch += self._pending
+                        self._pending, self._pending_count = [], 0
+                    self.checkpoint() # one snapshot covers every change in the group
+            else:
+                self._write_journal(records)
+            self.commit_groups += 1
+        except Exception as e: # every caller in the group gets the same error
+            for _, future in batch:
+                future.set_exception(e)
         else:
-            account = BusinessAccount(account_id, passcode)
-        
-        self.accounts[account_id] = account
-        self.save_accounts()
-        return account
+            for _, future in batch:
+                future.set_result(True) # True - committed
+    
+    def flush(self):
+        """Block until every queued change has been committed"""
+        if self.group_commit and self._flusher is not None:
+            self._commit([]).result()
+    
+    def close(self):
+        """Commit anything still queued, stop the flusher thread and close open files"""
+        with self._commit_cond:
+            self._closed = True
+            self._commit_cond.notify()
+        if self._flusher is not None:
+            self._flusher.join()
+        if isinstance(self.accounts, (LazyAccounts, BinaryAccounts)):
+            self.accounts.close()
+        if self._slot_file is not None:
+            self._slot_file.close()
+            self._slot_file = None
+        if self.history is not None:
+            self.history.close()
+    
+    def _append_journal(self, records):
+        """Append records to the write-ahead log and fold it in when it gets long"""
+        self._write_journal(records)
+        if self.journal_records >= self.checkpoint_every:
+            self.checkpoint()
+    
+    @instrumented("journal_write") # the real I/O time, also when saves are grouped
+    def _write_journal(self, records):
+        """Append records to the write-ahead log"""
+        data = "".join(records)
+        with open(self.journal_file, "a") as file: # append mode so earlier records are never touched
+            file.write(data)
+            file.flush()
+            if self.fsync == "always":
+                os.fsync(file.fileno()) # making sure the record is on disk before we report success
+        self.journal_records += len(records)
+        METRICS.inc("banking_bytes_written_total", len(data), file="journal")
+    
+    def checkpoint(self):
+        """Write a full snapshot of every account and empty the log"""
+        if self.history is not None: # the history is made durable here rather than on every operation
+            self.history.flush()
+        if self.storage == "binary": # balances were already changed in place, they only need flushing
+            with self._io_lock:
+                with self._store_lock, all_account_locks(): # only while the holds (and rows to compact) are copied
+                    holds = dict(self.holds)
+                    compaction = self.accounts.begin_compaction() if self.accounts.compaction_due() else None
+                self._write_holds(holds)
+                if compaction is not None:
+                    self.accounts.write_compaction(*compaction)
+                    with self._store_lock, all_account_locks():
+                        self.accounts.finish_compaction(compaction[0])
+                    _fsync_directory(self.filename)
+                self.accounts.ledger.flush() # pages changed while the locks were free are flushed too
+            return
+        with self._io_lock:
+            with all_account_locks(): # the lines are collected while every balance is consistent
+                if isinstance(self.accounts, (LazyAccounts, ColumnarAccounts)):
+                    lines = list(self.accounts.snapshot_lines()) # written straight from the store without building account objects
+                else:
+                    lines = [(account.account_id, self._format_account(account)) for account in list(self.accounts.values())]
+                    if self.storage == "fixed":
+                        for account in self.accounts.values():
+                            account.dirty = False
+                holds = dict(self.holds)
+            self._write_holds(holds) # before the snapshot, so a crash in between only leaves holds the log repeats
+            self._write_snapshot(lines) # file I/O happens after the account locks are released
+    
+    @instrumented("snapshot_write")
+    def _write_snapshot(self, lines):
+        """Atomically replace the snapshot file with the given (account_id, line) pairs
+
+        Apart from fixed storage the file starts with a header holding the
+        generation, the number of records and a CRC32 of every byte after it.
+        The previous generation is kept as "<filename>.prev"."""
+        temp_file = self.filename + ".tmp" # writing to a temporary file first so a crash never leaves half a ledger
+        checksummed = self.storage != "fixed" # fixed lines are overwritten in place later, which would break a checksum
+        generation = self.snapshot_generation + 1
+        offsets = {}
+        offset = 0
+        checksum = 0
+        if self.storage == "fixed": # room to grow so most balance changes still fit in the line
+            width = max([len(line.encode()) for _, line in lines] + [48]) + 16
+        with open(temp_file, "wb") as file: # opening the file in write mode
+            if checksummed:
+                file.write(self._snapshot_header()) # a placeholder until the checksum is known
+                offset = self.SNAPSHOT_HEADER_SIZE
+            for account_id, line in lines: # iterating through each account
+                data = line.encode()
+                if self.storage == "fixed":
+                    data = data[:-1].ljust(width - 1) + b"\n"
+                file.write(data)
+                if checksummed:
+                    checksum = zlib.crc32(data, checksum)
+                offsets[account_id] = offset # remembering where each line starts for the lazy index
+                offset += len(data)
+            if checksummed: # written last, so a file cut short by a crash never has a matching header
+                file.seek(0)
+                file.write(self._snapshot_header(generation, len(lines), checksum))
+            file.flush()
+            os.fsync(file.fileno())
+        if checksummed and os.path.exists(self.filename): # kept in case the new file is damaged later
+            os.replace(self.filename, self.filename + ".prev")
+        os.replace(temp_file, self.filename) # rename is atomic so readers see either the old or the new snapshot
+        _fsync_directory(self.filename) # the renames themselves are on disk before the log is removed
+        self.snapshot_generation = generation
+        METRICS.inc("banking_bytes_written_total", offset, file="snapshot")
+        METRICS.set_gauge("banking_snapshot_bytes", offset) # size of the latest snapshot
+        if isinstance(self.accounts, LazyAccounts):
+            self.accounts.reindex(offsets)
+            self._write_index(offsets)
+        if self.storage == "fixed":
+            if self._slot_file is not None: # still open on the replaced file
+                self._slot_file.close()
+                self._slot_file = None
+            self._slots, self._free_slots, self._slot_end = offsets, [], offset
+            self._slot_width = width
+        if os.path.exists(self.journal_file): # everything in the log is now part of the snapshot
+            os.remove(self.journal_file)
+        self.journal_records = 0
+
+    def _snapshot_header(self, generation=None, records=0, checksum=0):
+        """The fixed-width first line of a checksummed snapshot (without a generation - a placeholder that never verifies)"""
+        if generation is None:
+            text = "#incomplete"
+        else:
+            text = f"#snapshot,{generation},{records},{checksum:08x}"
+        return (text.ljust(self.SNAPSHOT_HEADER_SIZE - 1) + "\n").encode()
+
+    @staticmethod
+    def _read_snapshot_header(path):
+        """Return (generation, records, checksum, header size) of a snapshot file
+
+        A file without a header (an older or hand-written ledger) gives
+        generation 0, a missing file or a damaged header gives None."""
+        try:
+            with open(path, "rb") as file:
+                line = file.readline(BankingSystem.SNAPSHOT_HEADER_SIZE)
+        except OSError:
+            return None
+        if not line.startswith(b"#"):
+            return 0, None, None, 0
+        try:
+            tag, generation, records, checksum = line.decode().split(",")
+            if tag != "#snapshot" or not line.endswith(b"\n"):
+                return None
+            return int(generation), int(records), int(checksum, 16), len(line)
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _verify_snapshot(path, header):
+        """Check the record count and CRC32 of a snapshot file against its header"""
+        _, records, expected, start = header
+        checksum = lines = 0
+        try:
+            with open(path, "rb") as file:
+                file.seek(start)
+                for chunk in iter(lambda: file.read(1 << 20), b""): # 1 MB at a time, never the whole file in memory
+                    checksum = zlib.crc32(chunk, checksum)
+                    lines += chunk.count(b"\n")
+        except OSError:
+            return False
+        return checksum == expected and lines == records
+
+    def _index_is_current(self):
+        """True if the lazy sidecar index was written for the snapshot file as it is now"""
+        try:
+            with open(self.index_file, "r") as file:
+                return self._index_width(file.readline()) is not None
+        except OSError:
+            return False
+
+    def recover_snapshot(self):
+        """Make the snapshot file the newest snapshot that passes its checksum
+
+        The candidates are the snapshot file, the previous generation in
+        "<filename>.prev" and a temporary file a crash left completely written
+        but not yet renamed. They are checked newest first and the search stops
+        at the first good one, so a normal start checks one file and reads
+        nothing older. A file without a header is an older or hand-written
+        ledger and is used as it is. Raises BankingError if snapshots exist but
+        none of them is intact."""
+        temp_file, previous_file = self.filename + ".tmp", self.filename + ".prev"
+        headers = {path: self._read_snapshot_header(path) for path in (self.filename, temp_file, previous_file)}
+        generations = [header[0] for header in headers.values() if header is not None]
+        self.snapshot_generation = max(generations + [0]) # the next snapshot is always the newest one
+        chosen = None
+        if headers[self.filename] is not None and headers[self.filename][0] == 0:
+            chosen = self.filename # no header, nothing to check
+        else:
+            candidates = [(header[0], path == self.filename, path) for path, header in headers.items()
+                          if header is not None and header[0] > 0]
+            for _, _, path in sorted(candidates, reverse=True): # newest first, the snapshot file first on a tie
+                if path == self.filename and self.lazy and self._index_is_current():
+                    chosen = path # the sidecar is only written for a file that was written or checked whole
+                    break
+                if self._verify_snapshot(path, headers[path]):
+                    chosen = path
+                    break
+                print(f"Snapshot {path} failed its checksum")
+                METRICS.inc("banking_load_errors_total")
+        if chosen is None and (os.path.exists(self.filename) or os.path.exists(previous_file)):
+            raise BankingError(f"No intact snapshot of {self.filename} found")
+        if chosen is not None and chosen != self.filename:
+            if os.path.exists(self.filename): # kept aside for inspection, never loaded
+                os.replace(self.filename, self.filename + ".corrupt")
+            os.replace(chosen, self.filename)
+            _fsync_directory(self.filename)
+            print(f"Recovered {self.filename} from {chosen}")
+            METRICS.inc("banking_snapshot_recoveries_total")
+        if os.path.exists(temp_file): # cut short, or older than the snapshot that was chosen
+            os.remove(temp_file)
+
+    # Two-phase transfer holds - used by ShardedBank when the two accounts live in different shards.
+    # Phase one (prepare) takes the money out of the sender, or checks the recipient exists, and records a hold.
+    # Phase two commits (credit the recipient) or aborts (refund the sender). Each step is one journal record
+    # holding both the hold and the account state, so a crash can never keep one without the other.
+    def prepare_debit(self, txid, account_id, amount):
+        """Take amount from an account and hold it under txid"""
+        return self._prepare(txid, "debit", account_id, amount)
+    
+    def prepare_credit(self, txid, account_id, amount):
+        """Check the account can receive amount and remember the pending credit under txid"""
+        return self._prepare(txid, "credit", account_id, amount)
+    
+    def _prepare(self, txid, kind, account_id, amount):
+        if txid in self.holds: # the coordinator retried - already prepared
+            return True
+        account = self.accounts.get(account_id)
+        if account is None:
+            raise AccountNotFoundError(f"Account {account_id} not found")
+        cents = to_cents(amount)
+        if cents <= 0:
+            raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
+        with self._io_lock:
+            with account.lock:
+                if kind == "debit":
+                    if cents > account.cents:
+                        raise InsufficientFundsError("Insufficient funds for transfer")
+                    account.cents -= cents
+                self.holds[txid] = (kind, account_id, cents)
+                record = f"H,{txid},{kind},{cents},{self._format_account(account)}"
+                if kind == "debit" and self.history is not None:
+                    self.history.record([(account_id, "transfer_out", cents, account.cents, txid)])
+            future = self._persist_records([record])
+        if self.history is not None: # written now that the account lock is released
+            self.history.write_pending()
+        if future is not None:
+            future.result() # the vote only counts once the hold is on disk
+        return True
+    
+    def commit_hold(self, txid):
+        """Finish a prepared transfer - the recipient gets the money"""
+        return self._resolve(txid, commit=True)
+    
+    def abort_hold(self, txid):
+        """Cancel a prepared transfer - the sender gets the money back"""
+        return self._resolve(txid, commit=False)
+    
+    def _resolve(self, txid, commit):
+        hold = self.holds.get(txid)
+        if hold is None: # already resolved (or never prepared) - nothing to do
+            return False
+        kind, account_id, cents = hold
+        account = self.accounts.get(account_id)
+        with self._io_lock:
+            changed = (kind == "credit") == commit # credit on commit, refund on abort
+            if changed:
+                if account is None:
+                    raise AccountNotFoundError(f"Account {account_id} not found")
+                with account.lock:
+                    account.cents += cents
+                    line = self._format_account(account)
+                    if self.history is not None: # the other side is in another shard, so the txid is recorded
+                        kind_name = "transfer_in" if commit else "refund"
+                        self.history.record([(account_id, kind_name, cents, account.cents, txid)])
+            del self.holds[txid]
+            future = self._persist_records([f"R,{txid},{line if changed else chr(10)}"])
+        if self.history is not None:
+            self.history.write_pending()
+        if future is not None:
+            future.result()
+        return True
+    
+    def _persist_records(self, records):
+        """Write journal records, or a full snapshot (with the holds file) in the other storage modes"""
+        return self._commit(records if self.storage == "journal" else None)
+    
+    def create_account(self, account_type):
+        """Create a new bank account"""
+        return self.create_accounts(1, account_type)[0]
+    
+    def create_accounts(self, count, account_type):
+        """Create several accounts of one type and save them with a single write"""
+        import random
+        accounts = []
+        with self._store_lock:
+            for _ in range(count):
+                account_id = self.id_allocator.allocate(self.accounts) # always unique, no random guessing
+                passcode = str(random.randint(1000, 9999)) # str used instead of int because there could be leading zeros and integers in python do not preserve leading zeros so the accountid or passcode will have lesser digits then 5 and 4 respectively
+                
+                stored = self.hasher.hash(passcode) if self.hasher else passcode # only the hash is kept when hashing is on
+                if account_type.lower() == "personal": # 
+                    account = PersonalAccount(account_id, stored)
+                else:
+                    account = BusinessAccount(account_id, stored)
+                
+                self.accounts[account_id] = account
+                account = self.accounts[account_id] # a columnar store keeps its own copy so we hand back its view
+                self._index_account(account)
+                account.initial_passcode = passcode # shown to the user once, never saved
+                accounts.append(account)
+            self.id_allocator.save()
+        self.save_accounts(*accounts)
+        return accounts
 
+    @instrumented("login")
     def login(self, account_id, passcode):
+        """Return the account if the passcode is right, otherwise raise AuthenticationError"""
+        failures = self._login_failures(account_id)
+        if failures >= self.max_login_failures: # too many wrong attempts - not even checking the passcode
+            raise AuthenticationError("Too many failed login attempts, please try again later")
         account = self.accounts.get(account_id)
-        if not account or account.passcode != passcode: # for incorrect account number or passcode
+        if not account or not self._check_passcode(account, passcode): # for incorrect account number or passcode
+            if account: # made-up ids are not counted, otherwise they would fill the table
+                self._login_failed(account_id)
             raise AuthenticationError("Invalid credentials") 
+        if failures:
+            with self._failures_lock:
+                self.failures.pop(account_id, None)
         return account
-        
+    
+    def _login_failures(self, account_id):
+        """Failed logins of an account in the current lockout window"""
+        with self._failures_lock:
+            failures, expires = self.failures.get(account_id, (0, 0))
+            if expires < time.monotonic(): # the window is over
+                self.failures.pop(account_id, None)
+                return 0
+            return failures
+    
+    def _login_failed(self, account_id):
+        with self._failures_lock:
+            failures, expires = self.failures.get(account_id, (0, 0))
+            if expires < time.monotonic():
+                failures = 0
+            self.failures[account_id] = (failures + 1, time.monotonic() + self.lockout_seconds)
+    
+    def _check_passcode(self, account, passcode):
+        """Compare a passcode with the stored one, using the verified cache to skip the slow hash"""
+        import hmac
+        stored = account.passcode
+        if self.hasher is None:
+            return hmac.compare_digest(stored.encode(), passcode.encode())
+        key = hmac.new(self._cache_key, f"{account.account_id}\0{passcode}\0{stored}".encode(), "sha256").digest()
+        if self.verified.get(key): # verified recently with this exact stored hash
+            return True
+        if not self.hasher.verify(passcode, stored):
+            return False
+        if self.hasher.needs_rehash(stored): # plaintext from an old file or an old work factor - upgrading it now
+            account.passcode = self.hasher.hash(passcode)
+            self.save_accounts(account)
+            key = hmac.new(self._cache_key, f"{account.account_id}\0{passcode}\0{account.passcode}".encode(),
+                           "sha256").digest()
+        self.verified.put(key, True)
+        return True
+    
+    def start_session(self, account_id, passcode):
+        """Log in and return a random session token that can be used instead of the passcode"""
+        import secrets
+        account = self.login(account_id, passcode)
+        token = secrets.token_urlsafe(24)
+        self.sessions.put(token, account.account_id)
+        return token
+    
+    def resume_session(self, token):
+        """Return the account for a session token that has not expired"""
+        account_id = self.sessions.get(token)
+        account = self.accounts.get(account_id) if account_id is not None else None
+        if account is None:
+            raise AuthenticationError("Session expired, please login again")
+        return account
+    
+    def migrate_passcodes(self):
+        """Hash every plaintext passcode in the store and save the changed accounts"""
+        migrated = []
+        for account in list(self.accounts.values()):
+            if not PasscodeHasher.is_hashed(account.passcode):
+                account.passcode = self.hasher.hash(account.passcode)
+                migrated.append(account)
+        if migrated:
+            self.save_accounts(*migrated)
+        return len(migrated)
 
     def delete_account(self, account_id):
-        if account_id not in self.accounts:
-            raise AccountNotFoundError("Account not found")
-        del self.accounts[account_id]
-        self.save_accounts() # saving account after deletion 
+        with self._store_lock:
+            if account_id not in self.accounts:
+                raise AccountNotFoundError("Account not found")
+            del self.accounts[account_id]
+            if self.index is not None:
+                self.index.remove(account_id)
+        with self._failures_lock:
+            self.failures.pop(account_id, None)
+        if self.storage == "journal":
+            with self._io_lock:
+                return self._commit([f"D,{account_id}\n"]) # only recording the deletion
+        if self.storage == "fixed":
+            return self._blank_slot(account_id)
+        return self.save_accounts() # saving account after deletion 
     
     def account_exists(self, account_id):
         """Check if an account exists"""
         return account_id in self.accounts # returns true or flase
 
+    def apply_operation(self, op, account_id, amount, recipient_id=None):
+        """Apply one deposit/withdraw/transfer/topup and return the changed accounts and message"""
+        account = self.accounts.get(account_id)
+        if account is None:
+            raise AccountNotFoundError(f"Account {account_id} not found")
+        if amount is None or amount == "":
+            raise InvalidAmountError("Amount is missing")
+        
+        op = op.strip().lower().replace("-", "_")
+        if op in ("deposit", "withdraw"):
+            changed = (account,)
+        elif op == "transfer":
+            recipient = self.accounts.get(recipient_id) # a missing recipient is caught by Account.transfer
+            changed = (account, recipient)
+        elif op in ("topup", "top_up", "mobile_topup"):
+            if not isinstance(account, PersonalAccount):
+                raise BankingError("Mobile top-up only available for personal accounts")
+            op = "topup"
+            changed = (account,)
+        else:
+            raise BankingError(f"Unknown operation: {op}")
+        
+        with account_locks(*[changed_account for changed_account in changed if changed_account is not None]):
+            # the locks are held until the history is recorded so its balances follow the order of the changes
+            # (it is only buffered here - the file is written by the next save, after the locks are released)
+            if op == "deposit":
+                message = account.deposit(amount)
+            elif op == "withdraw":
+                message = account.withdraw(amount)
+            elif op == "transfer":
+                message = account.transfer(amount, recipient)
+            else:
+                message = account.top_up_mobile(amount)
+            if self.history is not None:
+                self._record_history(op, account, to_cents(amount), recipient_id)
+        return changed, message
+    
+    def _record_history(self, op, account, cents, recipient_id=None):
+        """Add the history entries for an operation that just succeeded"""
+        if op == "transfer":
+            recipient = self.accounts[recipient_id]
+            self.history.record([(account.account_id, "transfer_out", cents, account.cents, recipient_id),
+                                 (recipient_id, "transfer_in", cents, recipient.cents, account.account_id)])
+        else:
+            self.history.record([(account.account_id, op, cents, account.cents, "")])
+    
+    def statement(self, account_id, start=None, end=None, page=1, page_size=50):
+        """One page of an account's transaction history (see TransactionHistory.statement)"""
+        if self.history is None:
+            raise BankingError("Transaction history is not enabled")
+        if account_id not in self.accounts:
+            raise AccountNotFoundError(f"Account {account_id} not found")
+        return self.history.statement(account_id, start, end, page, page_size)
+    
+    def rebuild_index(self):
+        """Index every account from scratch (done by load_accounts when indexes are on)"""
+        with all_account_locks(): # no balance can change while the rows are collected
+            if isinstance(self.accounts, ColumnarAccounts): # straight from the arrays, no views are built
+                store = self.accounts
+                rows = [(store.account_id(row), store.TYPE_NAMES[store._types[row]], store._funds[row], store._mobile[row])
+                        for row in store._live_rows()]
+                store.index = self.index
+            elif isinstance(self.accounts, BinaryAccounts):
+                rows = [(account_id, account_type, funds, mobile_balance)
+                        for account_id, _, account_type, funds, mobile_balance in self.accounts.ledger.rows()]
+                self.accounts.index = self.index
+            else:
+                rows = []
+                for account in self.accounts.values():
+                    account.index = self.index # plain account objects report their own balance changes
+                    rows.append((account.account_id, account.account_type, account.cents, getattr(account, "mobile_cents", 0)))
+            self.index.build(rows)
+    
+    def _index_account(self, account):
+        """Add a new account to the secondary indexes"""
+        if self.index is None:
+            return
+        if not isinstance(account, (_ColumnarView, _BinaryView)):
+            account.index = self.index
+        self.index.add(account.account_id, account.account_type, account.cents, getattr(account, "mobile_cents", 0))
+    
+    def _require_index(self):
+        if self.index is None:
+            raise BankingError("Secondary indexes are not enabled")
+        return self.index
+    
+    def query_accounts(self, account_type=None, min_balance=None, max_balance=None, field="funds", limit=None):
+        """Return (account_id, balance) pairs with min_balance <= balance < max_balance, lowest balance first
+
+        field is "funds" or "mobile_balance", balances are in dollars and a
+        bound of None means no bound. The cost grows with the number of
+        accounts returned, not with the size of the ledger."""
+        index = self._require_index()
+        low = to_cents(min_balance) if min_balance is not None else None
+        high = to_cents(max_balance) if max_balance is not None else None
+        return [(account_id, cents / 100) for account_id, cents in index.range(field, account_type, low, high, limit)]
+    
+    def top_accounts(self, count, field="funds", account_type=None):
+        """Return the count (account_id, balance) pairs with the highest balance, highest first"""
+        return [(account_id, cents / 100) for account_id, cents in self._require_index().top(count, field, account_type)]
+    
+    def apply_batch(self, records, report=None, checkpoint_every=10000):
+        """Apply a stream of operations and persist only at checkpoints
+
+        records is a path to a CSV/JSONL file or any iterable of dicts with
+        op, account_id, amount and (for transfers) recipient. If report is a
+        file object one CSV result row is written per record. Returns a dict
+        with the applied and failed counts."""
+        if isinstance(records, str):
+            records = read_batch_file(records)
+        if report is not None:
+            report.write("record,status,message\n")
+        
+        applied = failed = 0
+        touched = {} # accounts changed since the last checkpoint (keyed by id so each is saved once)
+        try:
+            for number, record in enumerate(records, 1): # only one record is held in memory at a time
+                try:
+                    changed, message = self.apply_operation(*_batch_fields(record))
+                    for account in changed:
+                        touched[account.account_id] = account
+                    applied += 1
+                    status = "ok"
+                except BankingError as e: # a bad record is reported and the batch carries on
+                    failed += 1
+                    status, message = "error", str(e)
+                if report is not None:
+                    report.write(f"{number},{status},{message.replace(',', ';')}\n")
+                if checkpoint_every and number % checkpoint_every == 0:
+                    self._save_batch(touched)
+        finally: # even if reading the file fails, what was applied so far is saved
+            self._save_batch(touched)
+        return {"applied": applied, "failed": failed}
+    
+    def _save_batch(self, touched):
+        """Persist the accounts changed by a batch and forget them"""
+        if not touched:
+            return
+        future = self.save_accounts(*touched.values())
+        if future is not None: # with group commit we still wait so a checkpoint really is on disk
+            future.result()
+        touched.clear()
+    
+    # Bulk operations - interest, fees and totals for every account in one pass over balance columns.
+    # With NumPy installed the passes are vectorized, otherwise they are plain loops over the same arrays.
+    # Columnar stores are updated in place; other stores are copied into columns and only the changed
+    # accounts are written back. Either way the ledger is saved once at the end.
+    def _bulk_columns(self, account_type, numpy):
+        """Return (funds, mobile, types, rows, accounts) for a bulk pass
+
+        funds and mobile are array("q") columns in cents and types holds the
+        type codes. rows are the positions of the accounts of account_type
+        (None - every account), as a NumPy index array when numpy is given.
+        accounts maps a position to its account object, or is None when the
+        columns are the columnar store itself."""
+        if account_type is not None and account_type not in ColumnarAccounts.TYPE_NAMES:
+            raise BankingError(f"Unknown account type: {account_type}")
+        code = ColumnarAccounts.TYPE_NAMES.index(account_type) if account_type else None
+        if isinstance(self.accounts, ColumnarAccounts):
+            store, accounts = self.accounts, None
+            funds, mobile, types = store._funds, store._mobile, store._types
+        else:
+            accounts = list(self.accounts.values())
+            funds = array("q", [account.cents for account in accounts])
+            mobile = array("q", [getattr(account, "mobile_cents", 0) for account in accounts])
+            types = bytearray(isinstance(account, PersonalAccount) for account in accounts)
+        if numpy is None:
+            live = self.accounts._live_rows() if accounts is None else range(len(accounts))
+            rows = [row for row in live if code is None or types[row] == code]
+        else:
+            selected = numpy.ones(len(funds), dtype=bool)
+            if accounts is None: # rows of deleted accounts are skipped
+                selected &= numpy.frombuffer(store._numeric_ids, dtype=numpy.int64) != store.FREE
+            if code is not None:
+                selected &= numpy.frombuffer(types, dtype=numpy.uint8) == code
+            rows = numpy.flatnonzero(selected)
+        return funds, mobile, types, rows, accounts
+    
+    def _finish_bulk(self, kind, funds, rows, amounts, accounts):
+        """Write changed balances back to the account objects and record the history - returns the changed accounts"""
+        if accounts is None and self.history is None and self.index is None: # columns were changed in place and nothing else is needed
+            return []
+        rows = rows.tolist() if hasattr(rows, "tolist") else rows # plain ints, not NumPy scalars
+        amounts = amounts.tolist() if hasattr(amounts, "tolist") else amounts
+        changed = []
+        if accounts is not None:
+            for row in rows:
+                accounts[row].cents = funds[row] # the setter also moves the account in the index
+                changed.append(accounts[row])
+        elif self.index is not None: # the arrays were changed directly, so the index is told here
+            for row in rows:
+                self.index.set_balance(self.accounts.account_id(row), "funds", funds[row])
+        if self.history is not None and rows:
+            ids = [self.accounts.account_id(row) for row in rows] if accounts is None else [a.account_id for a in changed]
+            self.history.record([(account_id, kind, amount, funds[row], "")
+                                 for account_id, row, amount in zip(ids, rows, amounts)])
+        return changed
+    
+    def _save_bulk(self, changed):
+        if self.storage == "fixed":
+            future = self.save_accounts(*changed) if changed else None # only the changed lines
+        else:
+            future = self.save_accounts() # one snapshot / checkpoint instead of a log record per account
+        if future is not None:
+            future.result()
+    
+    @instrumented("post_interest")
+    def post_interest(self, rate, account_type=None):
+        """Add rate * balance (rounded to the cent) to every account, or every account of one type
+
+        Returns a dict with the number of accounts credited and the total paid."""
+        rate = float(rate)
+        if not rate >= 0: # also catches NaN
+            raise InvalidAmountError("Interest rate must not be negative")
+        if rate == float("inf"):
+            raise InvalidAmountError("Interest rate is too large")
+        numpy = _numpy()
+        with self._io_lock, all_account_locks(): # no other change can land in the middle of the pass
+            funds, _, _, rows, accounts = self._bulk_columns(account_type, numpy)
+            # every delta is worked out and checked before any balance changes, so a pass is all or nothing
+            if numpy is not None:
+                column = numpy.frombuffer(funds, dtype=numpy.int64) # shares memory with the array, no copy
+                deltas = numpy.rint(column[rows] * rate) # still floats - an int64 cast would wrap silently
+                if (deltas >= MAX_CENTS - column[rows]).any(): # compared as floats, so it errs on the safe side
+                    del column
+                    raise InvalidAmountError("Balance would be too large")
+                deltas = deltas.astype(numpy.int64)
+                column[rows] += deltas
+                del column # the array cannot grow while NumPy still looks at its memory
+                credited = deltas != 0
+                rows, deltas = rows[credited], deltas[credited]
+                total = int(deltas.sum())
+            else:
+                credited, deltas = [], []
+                for row in rows:
+                    delta = round(funds[row] * rate) # same rounding as numpy.rint (half to even)
+                    if delta:
+                        if funds[row] + delta > MAX_CENTS: # would not fit in the 64-bit column
+                            raise InvalidAmountError("Balance would be too large")
+                        credited.append(row)
+                        deltas.append(delta)
+                for row, delta in zip(credited, deltas):
+                    funds[row] += delta
+                rows, total = credited, sum(deltas)
+            changed = self._finish_bulk("interest", funds, rows, deltas, accounts)
+        self._save_bulk(changed)
+        return {"accounts": len(deltas), "total": total / 100}
+    
+    @instrumented("charge_fee")
+    def charge_fee(self, amount, account_type=None):
+        """Take a fixed fee from every account (or every account of one type) that can pay it
+
+        Like Account.withdraw an account is never overdrawn - accounts with less
+        than the fee are left unchanged and listed under "skipped"."""
+        cents = to_cents(amount)
+        if cents <= 0:
+            raise InvalidAmountError("Amount must be positive and have at most 2 decimal places")
+        numpy = _numpy()
+        with self._io_lock, all_account_locks():
+            funds, _, _, rows, accounts = self._bulk_columns(account_type, numpy)
+            if numpy is not None:
+                column = numpy.frombuffer(funds, dtype=numpy.int64)
+                can_pay = column[rows] >= cents
+                charged, skipped = rows[can_pay], rows[~can_pay].tolist()
+                column[charged] -= cents
+                del column
+            else:
+                charged, skipped = [], []
+                for row in rows:
+                    if funds[row] >= cents:
+                        funds[row] -= cents
+                        charged.append(row)
+                    else:
+                        skipped.append(row)
+            changed = self._finish_bulk("fee", funds, charged, [cents] * len(charged), accounts)
+            if accounts is None:
+                skipped = [self.accounts.account_id(row) for row in skipped]
+            else:
+                skipped = [accounts[row].account_id for row in skipped]
+        self._save_bulk(changed)
+        return {"accounts": len(charged), "total": len(charged) * cents / 100, "skipped": skipped}
+    
+    @instrumented("totals")
+    def totals(self):
+        """Return the number of accounts, funds and mobile balances (in dollars) per type and overall"""
+        numpy = _numpy()
+        with all_account_locks(): # a consistent picture, no transfer half done
+            funds, mobile, types, rows, _ = self._bulk_columns(None, numpy)
+            result = {}
+            for code, account_type in enumerate(ColumnarAccounts.TYPE_NAMES):
+                if numpy is not None:
+                    selected = rows[numpy.frombuffer(types, dtype=numpy.uint8)[rows] == code]
+                    result[account_type] = (len(selected), int(numpy.frombuffer(funds, dtype=numpy.int64)[selected].sum()),
+                                            int(numpy.frombuffer(mobile, dtype=numpy.int64)[selected].sum()))
+                else:
+                    selected = [row for row in rows if types[row] == code]
+                    result[account_type] = (len(selected), sum(funds[row] for row in selected),
+                                            sum(mobile[row] for row in selected))
+        result["total"] = tuple(map(sum, zip(*result.values())))
+        return {name: {"accounts": count, "funds": funds_total / 100, "mobile": mobile_total / 100}
+                for name, (count, funds_total, mobile_total) in result.items()}
+
+def read_batch_file(path):
+    """Yield operation records one at a time from a .jsonl or .csv file
+
+    JSONL lines are yielded as they are - apply_batch decodes each one
+    itself, so one malformed line only fails that record."""
+    with open(path, "r", newline="") as file:
+        if path.endswith((".jsonl", ".json")):
+            for line in file:
+                if line.strip():
+                    yield line
+        else:
+            import csv
+            yield from csv.DictReader(file) # header row: op,account_id,amount,recipient
+
+def _id_field(value):
+    """An account id from a JSON field as a string (None if it is missing), raising BankingError if it is not an id"""
+    if isinstance(value, int) and not isinstance(value, bool): # JSON numbers are fine as ids
+        return str(value)
+    if value is not None and not isinstance(value, str):
+        raise BankingError(f"Malformed account id: {value!r}")
+    return value
+
+def _batch_fields(record):
+    """Check one batch record and return its (op, account_id, amount, recipient), raising BankingError if it is malformed"""
+    if isinstance(record, str): # an undecoded JSONL line
+        import json # only needed for batch files so it is imported here
+        try:
+            record = json.loads(record)
+        except ValueError as e:
+            raise BankingError(f"Malformed record: {e}")
+    if not isinstance(record, dict):
+        raise BankingError("Malformed record: expected an object with op, account_id and amount")
+    op = record.get("op")
+    if not isinstance(op, str) or not op.strip():
+        raise BankingError("Operation is missing")
+    ids = [_id_field(record.get("account_id")), _id_field(record.get("recipient"))]
+    if not ids[0]:
+        raise AccountNotFoundError("Account id is missing")
+    return op, ids[0], record.get("amount"), ids[1]
+
+# Sharded Ledger
+# One BankingSystem is limited to one Python process (and the GIL). ShardedBank splits the accounts over
+# several worker processes by a hash of the account id - each worker owns its own shard file - and routes
+# every call to the right one. A transfer between two shards uses two-phase commit: both shards prepare
+# (the sender's money is held, the recipient is checked), the decision is written to the coordinator log,
+# then both shards commit or abort. Money is never created or lost, even if a process dies half way.
+def shard_for(account_id, shards):
+    """The shard an account id belongs to (stable across runs, unlike hash())"""
+    return zlib.crc32(account_id.encode()) % shards
+
+def _shard_create(bank, account_id, account_type):
+    """Create an account with an id chosen by the router, returning its passcode (None if the id is taken)"""
+    import random
+    with bank._store_lock:
+        if account_id in bank.accounts:
+            return None
+        passcode = str(random.randint(1000, 9999))
+        stored = bank.hasher.hash(passcode) if bank.hasher else passcode
+        account_class = PersonalAccount if account_type.lower() == "personal" else BusinessAccount
+        bank.accounts[account_id] = account_class(account_id, stored)
+        account = bank.accounts[account_id]
+        bank._index_account(account)
+    _wait(bank.save_accounts(account))
+    return passcode
+
+def _shard_operation(bank, op, account_id, amount, recipient_id=None):
+    changed, message = bank.apply_operation(op, account_id, amount, recipient_id)
+    _wait(bank.save_accounts(*changed))
+    return message
+
+def _shard_batch(bank, records):
+    """Apply a list of (op, account_id, amount, recipient) in this shard, saving once, and return the results"""
+    results, touched = [], {}
+    for op, account_id, amount, recipient_id in records:
+        try:
+            changed, message = bank.apply_operation(op, account_id, amount, recipient_id)
+            for account in changed:
+                touched[account.account_id] = account
+            results.append((True, message))
+        except BankingError as e:
+            results.append((False, str(e)))
+    bank._save_batch(touched)
+    return results
+
+def _shard_balance(bank, account_id):
+    account = bank.accounts.get(account_id)
+    if account is None:
+        raise AccountNotFoundError(f"Account {account_id} not found")
+    return account.cents, getattr(account, "mobile_cents", None)
+
+def _shard_total(bank):
+    """All money in the shard in cents - balances, mobile balances and money held by prepared transfers"""
+    total = sum(account.cents + getattr(account, "mobile_cents", 0) for account in bank.accounts.values())
+    return total + sum(cents for kind, _, cents in bank.holds.values() if kind == "debit")
+
+def _wait(future):
+    if future is not None: # group commit - the reply is only sent once the change is on disk
+        future.result()
+
+_SHARD_CALLS = {
+    "create": _shard_create,
+    "operation": _shard_operation,
+    "batch": _shard_batch,
+    "balance": _shard_balance,
+    "login": lambda bank, account_id, passcode: bank.login(account_id, passcode).account_type,
+    "prepare_debit": BankingSystem.prepare_debit,
+    "prepare_credit": BankingSystem.prepare_credit,
+    "commit_hold": BankingSystem.commit_hold,
+    "abort_hold": BankingSystem.abort_hold,
+    "holds": lambda bank: dict(bank.holds),
+    "total": _shard_total,
+    "count": lambda bank: len(bank.accounts),
+}
+
+def _shard_worker(connection, filename, options):
+    """Worker process main loop - owns one shard and answers (call, args) messages until closed"""
+    bank = BankingSystem(filename, **options)
+    try:
+        while True:
+            try:
+                call, args = connection.recv()
+            except EOFError: # the router went away
+                break
+            if call == "close":
+                break
+            try:
+                connection.send((True, _SHARD_CALLS[call](bank, *args)))
+            except BankingError as e: # sent back by class name so the router can raise the same error
+                connection.send((False, (type(e).__name__, str(e))))
+    finally:
+        bank.close()
+        connection.close()
+
+class ShardedBank:
+    """Routes banking calls to worker processes that each own one shard of the accounts
+
+    Shard i is stored in "<filename>.shard<i>" (journal storage by default),
+    new ids come from one allocator in "<filename>.ids" and cross-shard
+    transfer decisions are logged in "<filename>.2pc". The number of shards
+    must stay the same for a ledger since it decides where each id lives."""
+    def __init__(self, filename="accounts.txt", shards=None, id_width=8, **options):
+        import multiprocessing # only needed in sharded mode
+        self.filename = filename
+        self.shards = shards or os.cpu_count() or 1
+        options.setdefault("storage", "journal")
+        options["id_width"] = id_width
+        context = multiprocessing.get_context("spawn") # a fresh interpreter - forking a process with threads is unsafe
+        self._connections, self._processes = [], []
+        for number in range(self.shards):
+            router_end, worker_end = context.Pipe()
+            process = context.Process(target=_shard_worker, args=(worker_end, f"{filename}.shard{number}", options),
+                                      daemon=True)
+            process.start()
+            worker_end.close()
+            self._connections.append(router_end)
+            self._processes.append(process)
+        self._locks = [threading.Lock() for _ in range(self.shards)] # one request at a time per pipe
+        self.id_allocator = IdAllocator(filename + ".ids", id_width)
+        self._id_lock = threading.Lock()
+        self.decision_file = filename + ".2pc"
+        self._decision_lock = threading.Lock()
+        import secrets
+        self._txid_prefix = secrets.token_hex(4) # transaction ids stay unique across restarts
+        self._txid_counter = 0
+        self.recover()
+    
+    def _call(self, shard, call, *args):
+        """Send one call to a shard and return its result, raising the error it raised"""
+        with self._locks[shard]:
+            self._connections[shard].send((call, args))
+            ok, result = self._connections[shard].recv()
+        return result if ok else self._raise(result)
+    
+    def _call_all(self, calls):
+        """Send {shard: (call, args)} to several shards at once, then collect the results - the shards work in parallel"""
+        for shard in sorted(calls):
+            self._locks[shard].acquire()
+        try:
+            for shard, (call, args) in calls.items():
+                self._connections[shard].send((call, args))
+            replies = {shard: self._connections[shard].recv() for shard in calls}
+        finally:
+            for shard in calls:
+                self._locks[shard].release()
+        return {shard: result if ok else self._raise(result) for shard, (ok, result) in replies.items()}
+    
+    @staticmethod
+    def _raise(error):
+        name, message = error
+        error_class = globals().get(name)
+        if not (isinstance(error_class, type) and issubclass(error_class, BankingError)):
+            error_class = BankingError
+        raise error_class(message)
+    
+    def shard_for(self, account_id):
+        return shard_for(account_id, self.shards)
+    
+    def create_account(self, account_type):
+        """Create an account in the shard its new id hashes to and return (account_id, passcode)"""
+        with self._id_lock:
+            while True:
+                account_id = self.id_allocator.allocate(())
+                passcode = self._call(self.shard_for(account_id), "create", account_id, account_type)
+                if passcode is not None: # None - an older account already has this id
+                    break
+            self.id_allocator.save()
+        return account_id, passcode
+    
+    def login(self, account_id, passcode):
+        """Check a passcode and return the account type"""
+        return self._call(self.shard_for(account_id), "login", account_id, passcode)
+    
+    def balance(self, account_id):
+        """Return (funds, mobile_balance) in dollars - mobile_balance is None for business accounts"""
+        cents, mobile_cents = self._call(self.shard_for(account_id), "balance", account_id)
+        return cents / 100, None if mobile_cents is None else mobile_cents / 100
+    
+    def deposit(self, account_id, amount):
+        return self._call(self.shard_for(account_id), "operation", "deposit", account_id, amount)
+    
+    def withdraw(self, account_id, amount):
+        return self._call(self.shard_for(account_id), "operation", "withdraw", account_id, amount)
+    
+    def top_up_mobile(self, account_id, amount):
+        return self._call(self.shard_for(account_id), "operation", "topup", account_id, amount)
+    
+    def transfer(self, account_id, amount, recipient_id):
+        """Move money between two accounts, with two-phase commit when they are in different shards"""
+        sender_shard, recipient_shard = self.shard_for(account_id), self.shard_for(str(recipient_id))
+        if sender_shard == recipient_shard: # both in one shard - an ordinary local transfer
+            return self._call(sender_shard, "operation", "transfer", account_id, amount, recipient_id)
+        if amount is None or amount == "":
+            raise InvalidAmountError("Amount is missing")
+        cents = to_cents(amount) # checked here so a bad amount never starts a transaction
+        
+        txid = self._new_txid()
+        self._log_decision("B", txid, sender_shard, recipient_shard) # B - begun, no decision yet
+        try:
+            self._call_all({sender_shard: ("prepare_debit", (txid, account_id, amount)),
+                            recipient_shard: ("prepare_credit", (txid, recipient_id, amount))})
+        except BankingError:
+            self._finish(txid, sender_shard, recipient_shard, commit=False)
+            raise
+        self._finish(txid, sender_shard, recipient_shard, commit=True)
+        return f"Transferred ${format_cents(cents)} to account {recipient_id}"
+    
+    def _finish(self, txid, sender_shard, recipient_shard, commit):
+        # the decision is durable before either shard acts on it, so recovery always reaches the same outcome
+        self._log_decision("C" if commit else "A", txid, sender_shard, recipient_shard)
+        call = "commit_hold" if commit else "abort_hold"
+        self._call_all({sender_shard: (call, (txid,)), recipient_shard: (call, (txid,))})
+        self._log_decision("E", txid, sender_shard, recipient_shard) # E - both shards are done
+    
+    def _new_txid(self):
+        with self._decision_lock:
+            self._txid_counter += 1
+            return f"{self._txid_prefix}-{self._txid_counter}"
+    
+    def _log_decision(self, kind, txid, *shards):
+        """Append a line to the coordinator log and fsync it"""
+        with self._decision_lock, open(self.decision_file, "a") as file:
+            file.write(f"{kind},{txid},{','.join(map(str, shards))}\n")
+            file.flush()
+            os.fsync(file.fileno())
+    
+    def recover(self):
+        """Finish the cross-shard transfers a crash left half done
+
+        A transfer with a commit decision is committed again (commits are
+        idempotent); one with no decision is aborted. Holds the coordinator
+        never logged are aborted as well."""
+        decisions = {}
+        if os.path.exists(self.decision_file):
+            with open(self.decision_file, "r") as file:
+                for line in file:
+                    if not line.endswith("\n"): # torn last line from a crash
+                        break
+                    kind, txid, *shards = line.strip().split(",")
+                    if kind == "E":
+                        decisions.pop(txid, None)
+                    else:
+                        decisions[txid] = kind
+        holds = self._call_all({shard: ("holds", ()) for shard in range(self.shards)})
+        for shard, shard_holds in holds.items():
+            for txid in shard_holds:
+                decisions.setdefault(txid, "A")
+        for txid, kind in decisions.items():
+            call = "commit_hold" if kind == "C" else "abort_hold"
+            self._call_all({shard: (call, (txid,)) for shard in range(self.shards)})
+        with self._decision_lock, open(self.decision_file, "w") as file: # everything is resolved - start a new log
+            file.flush()
+            os.fsync(file.fileno())
+    
+    def apply_batch(self, records):
+        """Apply a list of (op, account_id, amount, recipient) records and return a list of (ok, message)
+
+        Records for different shards run in parallel, one batch per shard
+        saved once. Cross-shard transfers run afterwards with two-phase commit."""
+        results = [None] * len(records)
+        batches, positions, cross = {}, {}, []
+        for number, (op, account_id, amount, recipient_id) in enumerate(records):
+            shard = self.shard_for(account_id)
+            if op == "transfer" and self.shard_for(str(recipient_id)) != shard:
+                cross.append(number)
+                continue
+            batches.setdefault(shard, []).append((op, account_id, amount, recipient_id))
+            positions.setdefault(shard, []).append(number)
+        replies = self._call_all({shard: ("batch", (batch,)) for shard, batch in batches.items()})
+        for shard, shard_results in replies.items():
+            for number, result in zip(positions[shard], shard_results):
+                results[number] = result
+        for number in cross:
+            op, account_id, amount, recipient_id = records[number]
+            try:
+                results[number] = (True, self.transfer(account_id, amount, recipient_id))
+            except BankingError as e:
+                results[number] = (False, str(e))
+        return results
+    
+    def total_cents(self):
+        """All the money in every shard, including money held by unfinished transfers"""
+        return sum(self._call_all({shard: ("total", ()) for shard in range(self.shards)}).values())
+    
+    def count(self):
+        return sum(self._call_all({shard: ("count", ()) for shard in range(self.shards)}).values())
+    
+    def close(self):
+        """Stop the workers (each one closes its shard, flushing any group commit)"""
+        for shard, connection in enumerate(self._connections):
+            with self._locks[shard]:
+                try:
+                    connection.send(("close", ()))
+                except OSError:
+                    pass
+        for process in self._processes:
+            process.join()
+        for connection in self._connections:
+            connection.close()
+    
+    def __enter__(self):
+        return self
+    
+    def __exit__(self, *exc):
+        self.close()
+
+# Network Server
+class BankServer:
+    """asyncio server that exposes the banking operations as line-delimited JSON
+
+    Each request is one JSON object per line, e.g.
+    {"op": "login", "account_id": "12345", "passcode": "1234"} or
+    {"op": "transfer", "amount": 10, "recipient": "54321"}, and each gets one
+    JSON reply line with "ok" and either "message" or "error". The login is
+    remembered per connection. Logging in and saving run in a worker thread
+    so the event loop never waits on the passcode hash or on file I/O."""
+    def __init__(self, bank, executor=None):
+        self.bank = bank
+        self.executor = executor # None - asyncio's default thread pool
+        self.connections = 0
+    
+    async def start(self, host="127.0.0.1", port=0, path=None, backlog=4096):
+        """Start listening on TCP (or a Unix socket when path is given) and return the asyncio server"""
+        import asyncio # only needed in server mode
+        # a big backlog so bursts of new connections are queued instead of retried by the client a second later
+        if path is not None:
+            return await asyncio.start_unix_server(self.handle_client, path=path, backlog=backlog)
+        return await asyncio.start_server(self.handle_client, host, port, backlog=backlog)
+    
+    async def handle_client(self, reader, writer):
+        """Serve one connection until the client disconnects"""
+        import json
+        self.connections += 1
+        session = {"account": None} # the account this connection is logged in to
+        try:
+            while True:
+                line = await self.read_line(reader)
+                if line == b"":
+                    break
+                try:
+                    if line is None:
+                        raise BankingError("Request is too long")
+                    request = json.loads(line)
+                    reply = {"ok": True, "message": await self.handle_request(session, request)}
+                except BankingError as e:
+                    reply = {"ok": False, "error": str(e)}
+                except (ValueError, AttributeError): # not JSON or not a JSON object
+                    reply = {"ok": False, "error": "Invalid request"}
+                except Exception as e: # a bug in one request should not take the whole connection down
+                    print(f"Request failed: {e!r}", file=sys.stderr)
+                    reply = {"ok": False, "error": "Request failed"}
+                writer.write((json.dumps(reply) + "\n").encode())
+                await writer.drain() # waiting if the client is reading slowly
+        except ConnectionError:
+            pass
+        finally:
+            self.connections -= 1
+            writer.close()
+    
+    async def read_line(self, reader):
+        """Read one request line (b"" at the end), or None if it is longer than the reader's limit
+
+        A line that is too long is skipped up to its newline, so the next request is read from where it starts."""
+        import asyncio
+        too_long = False
+        while True:
+            try:
+                line = await reader.readuntil(b"\n")
+            except asyncio.IncompleteReadError as e: # the client closed without a final newline
+                return b"" if too_long else e.partial
+            except asyncio.LimitOverrunError as e:
+                await reader.readexactly(e.consumed) # throwing away what was read of it, then looking for the end again
+                too_long = True
+                continue
+            return None if too_long else line
+    
+    async def handle_request(self, session, request):
+        """Run one request and return its message, raising BankingError on failure"""
+        op = str(request.get("op", "")).lower()
+        if op == "login": # the passcode hash is slow and a rehash saves the account
+            account = await self.run(self.bank.login, str(_id_field(request.get("account_id"))),
+                                     str(request.get("passcode")))
+            session["account"] = account
+            return f"Login successful! Welcome, {account.account_type} account holder."
+        account = session["account"]
+        if account is None:
+            raise AuthenticationError("Please login first")
+        if op == "logout":
+            session["account"] = None
+            return "Logged out successfully"
+        if op == "details":
+            return account.get_account_details()
+        changed, message = self.bank.apply_operation(op, account.account_id, request.get("amount"),
+                                                     _id_field(request.get("recipient"))) # e.g. 54321 as a JSON number
+        await self.save(*changed)
+        return message
+    
+    async def run(self, function, *args):
+        """Run a blocking bank call in a worker thread and return its result"""
+        import asyncio
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self.executor, functools.partial(function, *args))
+    
+    async def save(self, *changed):
+        """Save the changed accounts in a worker thread and wait for them to be committed"""
+        import asyncio
+        future = await self.run(self.bank.save_accounts, *changed)
+        if future is not None: # group commit - waiting for our group without blocking the loop
+            await asyncio.wrap_future(future)
+
 # Main Application
 def main():
     """Main application entry point"""
@@ -192,6 +3270,7 @@ def main():
             process_login(bank)
         elif choice == "3":
             print("Thank you for using our banking service!")
+            bank.close() # making sure nothing queued is lost
             break
         else: # for error handeling
             print("Invalid choice. Please try again.")
@@ -215,7 +3294,7 @@ def process_create_account(bank):
     
     print("\nAccount created successfully!")
     print(f"Account Number: {account.account_id}")
-    print(f"Temporary Passcode: {account.passcode}")
+    print(f"Temporary Passcode: {account.initial_passcode}")
     print("Please change your passcode after first login.")
 
 def process_login(bank):
@@ -272,8 +3351,9 @@ def process_deposit(account, bank): # Actuallu taking in user inputs and handeli
     """Handle deposit operation"""
     try:
         amount = float(input("Enter amount to deposit: "))
-        print(account.deposit(amount))
-        bank.save_accounts()
+        changed, message = bank.apply_operation("deposit", account.account_id, amount) # also records the history
+        print(message)
+        bank.save_accounts(*changed)
     except ValueError:
         print("Invalid amount entered")
 
@@ -281,8 +3361,9 @@ def process_withdraw(account, bank):
     """Handle withdrawal operation"""
     try:
         amount = float(input("Enter amount to withdraw: "))
-        print(account.withdraw(amount))
-        bank.save_accounts()
+        changed, message = bank.apply_operation("withdraw", account.account_id, amount)
+        print(message)
+        bank.save_accounts(*changed)
     except ValueError: # for if input not number or is negative or 0
         print("Invalid amount entered")
 
@@ -295,9 +3376,9 @@ def process_transfer(account, bank):
     # else..
     try:
         amount = float(input("Enter amount to transfer: "))
-        recipient = bank.accounts[recipient_id]
-        print(account.transfer(amount, recipient))
-        bank.save_accounts()
+        changed, message = bank.apply_operation("transfer", account.account_id, amount, recipient_id)
+        print(message)
+        bank.save_accounts(*changed)
     except ValueError:
         print("Invalid amount entered")
 
@@ -305,10 +3386,154 @@ def process_mobile_topup(account, bank):
     """Handle mobile top-up operation"""
     try:
         amount = float(input("Enter top-up amount: "))
-        print(account.top_up_mobile(amount))
-        bank.save_accounts()
+        changed, message = bank.apply_operation("topup", account.account_id, amount)
+        print(message)
+        bank.save_accounts(*changed)
     except ValueError:
         print("Invalid amount entered")
 
+# Account Commands
+# balance, deposit, transfer and stats are made for scripts and health checks that start the module thousands
+# of times a day: simple arguments are read without argparse and only the accounts a command touches are loaded.
+ACCOUNT_COMMANDS = { # command -> its positional arguments
+    "balance": ("account_id",),
+    "deposit": ("account_id", "amount"),
+    "transfer": ("account_id", "amount", "recipient"),
+    "stats": (),
+}
+STORAGE_MODES = ("snapshot", "journal", "binary", "fixed")
+
+@contextmanager
+def ledger_lock(filename, exclusive=True):
+    """Advisory lock on "<filename>.lock" so command line runs on one ledger take turns (skipped where fcntl is missing)"""
+    try:
+        import fcntl
+    except ImportError: # Windows
+        yield
+        return
+    with open(filename + ".lock", "a") as file: # closing the file releases the lock
+        fcntl.flock(file.fileno(), fcntl.LOCK_EX if exclusive else fcntl.LOCK_SH)
+        yield
+
+def run_account_command(ledger, storage, command, *values):
+    """Run balance, deposit, transfer or stats on a ledger file, print the result and return the exit code
+
+    Text ledgers are opened lazily, so balance, deposit and transfer only
+    parse the accounts they name (journal storage then appends one record,
+    snapshot storage still rewrites the file). stats reads the balance columns.
+    Commands that change balances hold the ledger lock exclusively, the
+    others share it. Errors are printed to stderr with exit code 1."""
+    options = {"storage": storage}
+    if storage in ("snapshot", "journal"):
+        options["columnar" if command == "stats" else "lazy"] = True
+    with ledger_lock(ledger, exclusive=command in ("deposit", "transfer")):
+        bank = None
+        try:
+            bank = BankingSystem(ledger, **options)
+            if command == "balance":
+                account = bank.accounts.get(values[0])
+                if account is None:
+                    raise AccountNotFoundError(f"Account {values[0]} not found")
+                print(account.get_account_details())
+            elif command == "stats":
+                for name, total in bank.totals().items():
+                    print(f"{name}: {total['accounts']} accounts, funds ${total['funds']:.2f}, "
+                          f"mobile ${total['mobile']:.2f}")
+            else:
+                changed, message = bank.apply_operation(command, *values)
+                _wait(bank.save_accounts(*changed))
+                print(message)
+        except BankingError as e:
+            print(f"Error: {e}", file=sys.stderr)
+            return 1
+        finally:
+            if bank is not None:
+                bank.close()
+    return 0
+
+def _parse_account_command(argv):
+    """Read "[--ledger FILE] [--storage MODE] command arguments..." without argparse
+
+    Returns the run_account_command arguments, or None for anything else
+    (other commands, help, mistakes) so argparse handles it as usual."""
+    options = {"--ledger": "accounts.txt", "--storage": "snapshot"}
+    while len(argv) > 1 and argv[0] in options:
+        options[argv[0]] = argv[1]
+        argv = argv[2:]
+    if not argv or argv[0] not in ACCOUNT_COMMANDS or options["--storage"] not in STORAGE_MODES:
+        return None
+    values = argv[1:]
+    if len(values) != len(ACCOUNT_COMMANDS[argv[0]]) or any(value.startswith("-") for value in values):
+        return None
+    return (options["--ledger"], options["--storage"], argv[0], *values)
+
+def cli(argv):
+    """Command line entry point - with no arguments the interactive menu runs"""
+    if not argv:
+        main()
+        return 0
+    command = _parse_account_command(argv)
+    if command is not None: # the fast path, without loading argparse
+        return run_account_command(*command)
+    import argparse # only loaded when subcommands are used
+    parser = argparse.ArgumentParser(prog="ChhimiZangmo_02240116_A3.py")
+    parser.add_argument("--ledger", default="accounts.txt", help="accounts file to use")
+    parser.add_argument("--storage", default="snapshot", choices=STORAGE_MODES)
+    commands = parser.add_subparsers(dest="command", required=True)
+    account_help = {"balance": "print one account's balance", "deposit": "deposit into one account",
+                    "transfer": "transfer between two accounts", "stats": "print account counts and total balances"}
+    for name, arguments in ACCOUNT_COMMANDS.items():
+        account_parser = commands.add_parser(name, help=account_help[name])
+        for argument in arguments:
+            account_parser.add_argument(argument)
+    apply_parser = commands.add_parser("apply", help="apply a CSV or JSONL file of operations")
+    apply_parser.add_argument("file")
+    apply_parser.add_argument("--report", help="write a per-record result report to this file")
+    apply_parser.add_argument("--checkpoint-every", type=int, default=10000)
+    serve_parser = commands.add_parser("serve", help="serve line-delimited JSON requests over TCP or a Unix socket")
+    serve_parser.add_argument("--host", default="127.0.0.1")
+    serve_parser.add_argument("--port", type=int, default=8765)
+    serve_parser.add_argument("--unix", help="listen on this Unix socket path instead of TCP")
+    convert_parser = commands.add_parser("convert", help="convert between the text and binary ledger formats")
+    convert_parser.add_argument("source")
+    convert_parser.add_argument("target")
+    convert_parser.add_argument("--to", choices=("binary", "text"), default="binary")
+    args = parser.parse_args(argv)
+    
+    if args.command in ACCOUNT_COMMANDS:
+        return run_account_command(args.ledger, args.storage, args.command,
+                                   *[getattr(args, argument) for argument in ACCOUNT_COMMANDS[args.command]])
+    if args.command == "convert": # works on files directly, no BankingSystem needed
+        if args.to == "binary":
+            count = convert_text_to_binary(args.source, args.target)
+        else:
+            count = convert_binary_to_text(args.source, args.target)
+        print(f"Converted {count} accounts")
+        return 0
+    
+    bank = BankingSystem(args.ledger, storage=args.storage)
+    if args.command == "apply":
+        report = open(args.report, "w") if args.report else None
+        try:
+            result = bank.apply_batch(args.file, report=report, checkpoint_every=args.checkpoint_every)
+        finally:
+            if report is not None:
+                report.close()
+        print(f"Applied {result['applied']} operations, {result['failed']} failed")
+    elif args.command == "serve":
+        import asyncio
+        
+        async def serve():
+            server = await BankServer(bank).start(args.host, args.port, args.unix)
+            print(f"Serving on {args.unix or f'{args.host}:{args.port}'}")
+            async with server:
+                await server.serve_forever()
+        try:
+            asyncio.run(serve())
+        except KeyboardInterrupt:
+            print("Server stopped")
+    bank.close()
+    return 0
+
 if __name__ == "__main__":
-    main()
\ No newline at end of file
+    sys.exit(cli(sys.argv[1:]))
\ No newline at end of file
@@ -0,0 +1,227 @@
+# Benchmarks for the banking system hot paths
+# Run: python ChhimiZangmo_02240116_A3_bench.py --sizes 1000,10000,100000 --output results.json
+# Each (storage mode, ledger size) pair runs in its own process so peak memory (RSS) is measured separately.
+# The ledger files are generated (and converted for binary mode) by the parent, so a child's RSS is only the bank.
+import argparse # reads the command line options
+import json # results are written as JSON so two runs (e.g. two commits) can be compared
+import os
+import random
+import resource # gives the peak memory (max RSS) of a process on Linux / macOS
+import subprocess # used to start one fresh Python process per benchmark run
+import shutil # copies a generated ledger without reading it into memory
+import sys
+import time
+
+from ChhimiZangmo_02240116_A3 import (BankingSystem, BankingError, PersonalAccount, convert_text_to_binary,
+                                      format_cents, _wait)
+
+# storage mode name -> keyword arguments for BankingSystem
+MODES = {
+    "snapshot": {},
+    "journal": {"storage": "journal", "fsync": "never"},
+    "journal-group": {"storage": "journal", "fsync": "always", "group_commit": True},
+    "lazy": {"storage": "journal", "fsync": "never", "lazy": True},
+    "columnar": {"storage": "journal", "fsync": "never", "columnar": True},
+    "binary": {"storage": "binary"},
+    "fixed": {"storage": "fixed"},
+}
+
+def generate_ledger(path, size, seed=1):
+    """Write a synthetic accounts file with size accounts (about half personal, half business)"""
+    rng = random.Random(seed)
+    with open(path, "w") as file:
+        for number in range(size):
+            account_id = str(10_000_000 + number) # 8 digit ids so 10M accounts fit
+            funds = rng.randint(0, 10_000_000) # in cents
+            if number % 2:
+                file.write(f"{account_id},{rng.randint(1000, 9999)},Personal,{format_cents(funds)},"
+                           f"{format_cents(rng.randint(0, 5000))}\n")
+            else:
+                file.write(f"{account_id},{rng.randint(1000, 9999)},Business,{format_cents(funds)}\n")
+
+def percentile(samples, fraction):
+    """Return the given percentile (0.5 = p50) of a list of latencies"""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(fraction * len(ordered)))]
+
+def summarize(latencies, elapsed):
+    """ops/sec and p50/p99 latency in microseconds"""
+    return {
+        "ops": len(latencies),
+        "ops_per_sec": round(len(latencies) / elapsed, 1) if elapsed else None,
+        "p50_us": round(percentile(latencies, 0.50) * 1e6, 1) if latencies else None,
+        "p99_us": round(percentile(latencies, 0.99) * 1e6, 1) if latencies else None,
+    }
+
+def timed(operation, count, max_seconds):
+    """Call operation(i) up to count times (or until the time budget is used) and summarize the latencies"""
+    latencies = []
+    start = time.perf_counter()
+    for number in range(count):
+        before = time.perf_counter()
+        operation(number)
+        latencies.append(time.perf_counter() - before)
+        if before - start > max_seconds:
+            break
+    return summarize(latencies, time.perf_counter() - start)
+
+def remove_files(path):
+    for name in (path, path + ".log", path + ".idx", path + ".ids", path + ".tmp", path + ".prev", path + ".lock"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def ledger_path(mode, size, workdir):
+    return os.path.join(workdir, f"bench_{mode}_{size}.{'bin' if mode == 'binary' else 'txt'}")
+
+def prepare_ledger(mode, size, workdir):
+    """Create the ledger file one run uses (done in the parent process, outside the measured one)"""
+    text_file = os.path.join(workdir, f"bench_{size}.txt")
+    if not os.path.exists(text_file): # generated ledgers are reused between modes
+        generate_ledger(text_file, size)
+    path = ledger_path(mode, size, workdir)
+    remove_files(path)
+    if mode == "binary":
+        convert_text_to_binary(text_file, path)
+    else:
+        shutil.copyfile(text_file, path)
+
+def run_single(mode, size, ops, max_seconds, workdir):
+    """Benchmark one storage mode at one ledger size and return a result dict (the ledger must be prepared)"""
+    rng = random.Random(size)
+    def random_id(): # ids are 10_000_000 + row, so no list of every id is needed
+        return str(10_000_000 + rng.randrange(size))
+    path = ledger_path(mode, size, workdir)
+
+    result = {"mode": mode, "size": size}
+    start = time.perf_counter()
+    bank = BankingSystem(path, id_width=8, **MODES[mode])
+    result["startup_s"] = round(time.perf_counter() - start, 4) # load_accounts (or index build / mmap)
+
+    passcodes = {}
+    def login(number):
+        account_id = random_id()
+        if account_id not in passcodes:
+            passcodes[account_id] = bank.accounts[account_id].passcode
+        bank.login(account_id, passcodes[account_id])
+    result["login"] = timed(login, ops, max_seconds)
+
+    def mixed(number):
+        # 40% deposit, 30% withdraw, 20% transfer, 10% top-up, each followed by a save like the interactive menu
+        account = bank.accounts[random_id()]
+        choice = rng.random()
+        try:
+            if choice < 0.4:
+                account.deposit(rng.randint(1, 500))
+                changed = (account,)
+            elif choice < 0.7:
+                account.withdraw(rng.randint(1, 500))
+                changed = (account,)
+            elif choice < 0.9:
+                recipient = bank.accounts[random_id()]
+                account.transfer(rng.randint(1, 500), recipient)
+                changed = (account, recipient)
+            else:
+                if not isinstance(account, PersonalAccount):
+                    return
+                account.top_up_mobile(rng.randint(1, 50))
+                changed = (account,)
+        except BankingError: # e.g. insufficient funds - still counted, like a real failed request
+            return
+        _wait(bank.save_accounts(*changed)) # with group commit the operation only counts once it is on disk
+    result["mixed_ops"] = timed(mixed, ops, max_seconds)
+
+    def transfer(number):
+        sender, recipient = bank.accounts[random_id()], bank.accounts[random_id()]
+        try:
+            sender.transfer(1, recipient)
+        except BankingError:
+            pass
+    result["transfer_in_memory"] = timed(transfer, ops, max_seconds) # Account.transfer without persistence
+
+    result["create_account"] = timed(lambda number: bank.create_account("Personal"), min(ops, 1000), max_seconds)
+
+    start = time.perf_counter()
+    bank.save_accounts() # full snapshot / checkpoint
+    bank.flush()
+    result["full_save_s"] = round(time.perf_counter() - start, 4)
+    bank.close()
+
+    result["peak_rss_mb"] = round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1) # KiB on Linux
+    remove_files(path)
+    return result
+
+def git_commit():
+    """The current commit id, so results can be matched to the code they measured"""
+    try:
+        return subprocess.run(["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+def compare(baseline, current, threshold=0.10):
+    """Print the metrics that got worse by more than threshold compared to a baseline result file"""
+    old = {(run["mode"], run["size"]): run for run in baseline["runs"]}
+    regressions = 0
+    for run in current["runs"]:
+        before = old.get((run["mode"], run["size"]))
+        if before is None:
+            continue
+        checks = [("startup_s", run["startup_s"], before["startup_s"], False),
+                  ("peak_rss_mb", run["peak_rss_mb"], before["peak_rss_mb"], False)]
+        for name in ("login", "mixed_ops", "transfer_in_memory", "create_account"):
+            checks.append((f"{name}.ops_per_sec", run[name]["ops_per_sec"], before[name]["ops_per_sec"], True))
+            checks.append((f"{name}.p99_us", run[name]["p99_us"], before[name]["p99_us"], False))
+        for name, now, then, higher_is_better in checks:
+            if not now or not then:
+                continue
+            change = (now - then) / then
+            if (change < -threshold) if higher_is_better else (change > threshold):
+                regressions += 1
+                print(f"REGRESSION {run['mode']} size={run['size']} {name}: {then} -> {now} ({change:+.0%})")
+    print(f"{regressions} regressions found")
+    return regressions
+
+def main(argv):
+    parser = argparse.ArgumentParser(description="Benchmark BankingSystem hot paths across ledger sizes")
+    parser.add_argument("--sizes", default="1000,10000,100000",
+                        help="comma separated ledger sizes, e.g. 1000,10000,100000,1000000,10000000")
+    parser.add_argument("--modes", default=",".join(MODES), help="comma separated storage modes")
+    parser.add_argument("--ops", type=int, default=2000, help="operations per measurement")
+    parser.add_argument("--max-seconds", type=float, default=10, help="time budget per measurement")
+    parser.add_argument("--workdir", default="bench_data", help="where generated ledgers are kept")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--compare", help="baseline JSON results to check for regressions")
+    parser.add_argument("--single", nargs=2, metavar=("MODE", "SIZE"), help=argparse.SUPPRESS) # used by the child processes
+    args = parser.parse_args(argv)
+    os.makedirs(args.workdir, exist_ok=True)
+
+    if args.single: # a child process - the parent already prepared the ledger
+        mode, size = args.single
+        print(json.dumps(run_single(mode, int(size), args.ops, args.max_seconds, args.workdir)))
+        return 0
+
+    runs = []
+    for size in (int(size) for size in args.sizes.split(",")):
+        for mode in args.modes.split(","):
+            prepare_ledger(mode, size, args.workdir)
+            command = [sys.executable, os.path.abspath(__file__), "--single", mode, str(size), "--ops", str(args.ops),
+                       "--max-seconds", str(args.max_seconds), "--workdir", args.workdir]
+            output = subprocess.run(command, capture_output=True, text=True, check=True).stdout
+            run = json.loads(output.strip().splitlines()[-1])
+            runs.append(run)
+            print(f"{mode:>13} {size:>9}  startup {run['startup_s']:>8}s  mixed {run['mixed_ops']['ops_per_sec']:>10} ops/s"
+                  f"  p99 {run['mixed_ops']['p99_us']:>10}us  rss {run['peak_rss_mb']:>8}MB")
+
+    results = {"commit": git_commit(), "python": sys.version.split()[0], "time": time.time(), "runs": runs}
+    if args.output:
+        with open(args.output, "w") as file:
+            json.dump(results, file, indent=2)
+    if args.compare:
+        with open(args.compare) as file:
+            return 1 if compare(json.load(file), results) else 0
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main(sys.argv[1:]))
@@ -1,10 +1,34 @@
  # unittest is a module that lets us do writing and running tests
 import unittest # Has functions such as assertEqual ( it is used to check if two values are equal ), assertRaises (it is used to check if an error is raised), etc.
 import os # 
+import random
+import threading
+import asyncio
+import json
+import io
+from contextlib import redirect_stdout, redirect_stderr
 from ChhimiZangmo_02240116_A3 import (Account, PersonalAccount, BusinessAccount, #imports classes from assignment Part A
-                                      BankingSystem, InsufficientFundsError, 
+                                      BankingSystem, BankingError, InsufficientFundsError, 
                                       InvalidAmountError, AccountNotFoundError,
-                                      AuthenticationError)
+                                      AuthenticationError, BankServer, cli,
+                                      to_cents, parse_cents, format_cents,
+                                      convert_text_to_binary, convert_binary_to_text, METRICS,
+                                      ShardedBank, account_locks)
+def remove_ledger_files(filename):
+    """Remove a test ledger and the sidecar files BankingSystem keeps next to it"""
+    for name in (filename, filename + ".log", filename + ".idx", filename + ".ids", filename + ".tmp",
+                 filename + ".holds", filename + ".2pc", filename + ".history", filename + ".history.idx",
+                 filename + ".prev", filename + ".corrupt", filename + ".lock", filename + ".compact"):
+        if os.path.exists(name):
+            os.remove(name)
+
+def write_four_accounts(filename):
+    """Start a ledger over with the four accounts the bulk and index tests share"""
+    remove_ledger_files(filename)
+    with open(filename, "w") as file:
+        file.write("10001,1111,Personal,100.00,5.00\n10002,2222,Business,1000.00\n"
+                   "10003,3333,Business,2.00\n10004,4444,Personal,0.50,0.00\n")
+
 class TestBankAccount(unittest.TestCase): # TestCase is a class that is used to create test cases in unittest module
     """Test cases for base Account functionality"""
     
@@ -22,8 +46,7 @@ class TestBankAccount(unittest.TestCase): # TestCase is a class that is used to
         """ TearDown is a method that cleans up after each test for clean up
         - if it is not used, the test file will remain after the tests are run 
         and it will cause problems for the next test run """
-        if os.path.exists(self.test_file):
-            os.remove(self.test_file) 
+        remove_ledger_files(self.test_file) 
     
     def test_account_creation(self): 
         """Test account creation assigns correct properties"""
@@ -104,8 +127,7 @@ class TestBankingSystem(unittest.TestCase):
         self.account = self.bank.create_account("Personal") # Testing with a Personal account
     
     def tearDown(self):
-        if os.path.exists(self.test_file):
-            os.remove(self.test_file) # removing the test file after the tests are done
+        remove_ledger_files(self.test_file) # removing the test file (and its sidecar files) after the tests are done
     
     def test_file_persistence(self):
         """Test accounts are saved/loaded correctly"""
@@ -149,8 +171,7 @@ class TestEdgeCases(unittest.TestCase): #
         self.account.deposit(1000)
     
     def tearDown(self):
-        if os.path.exists(self.test_file):
-            os.remove(self.test_file)
+        remove_ledger_files(self.test_file)
     
     def test_large_values(self):
         """Test handling of large amounts"""
@@ -184,5 +205,1206 @@ class TestEdgeCases(unittest.TestCase): #
         acc2_reloaded = bank2.login(acc2.account_id, acc2.passcode) # logging in to the second instance again
         self.assertEqual(acc2_reloaded.funds, 1500)# testing if the funds are updated correctly in the second instance after saving and loading
 
+class TestJournal(unittest.TestCase):
+    """Test the append-only journal storage mode"""
+    
+    def setUp(self):
+        self.test_file = "test_journal.txt"
+        remove_ledger_files(self.test_file)
+        self.bank = BankingSystem(self.test_file, storage="journal", fsync="never")
+        self.account = self.bank.create_account("Personal")
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_changes_are_appended_and_replayed(self):
+        """Test each change is one log record and a new instance replays them"""
+        self.account.deposit(250)
+        self.bank.save_accounts(self.account)
+        self.assertFalse(os.path.exists(self.test_file)) # nothing has been checkpointed yet
+        with open(self.test_file + ".log") as file:
+            self.assertEqual(len(file.readlines()), 2) # one record for create, one for deposit
+        
+        new_bank = BankingSystem(self.test_file, storage="journal")
+        self.assertEqual(new_bank.login(self.account.account_id, self.account.passcode).funds, 250)
+    
+    def test_checkpoint_folds_log_into_snapshot(self):
+        """Test checkpoint writes the snapshot and removes the log"""
+        self.bank.checkpoint_every = 3
+        business = self.bank.create_account("Business")
+        business.deposit(10)
+        self.bank.save_accounts(business) # third record triggers the checkpoint
+        self.assertFalse(os.path.exists(self.test_file + ".log"))
+        self.assertEqual(BankingSystem(self.test_file).accounts[business.account_id].funds, 10)
+    
+    def test_delete_and_torn_record(self):
+        """Test deletions replay and a half written last record is ignored"""
+        self.bank.delete_account(self.account.account_id)
+        with open(self.test_file + ".log", "a") as file:
+            file.write("S,12345,1111,Business,5") # no newline - as if we crashed mid write
+        new_bank = BankingSystem(self.test_file, storage="journal")
+        self.assertFalse(new_bank.account_exists(self.account.account_id))
+        self.assertFalse(new_bank.account_exists("12345"))
+
+    def test_torn_transfer_is_not_half_applied(self):
+        """Test a transfer whose second record was torn by a crash is dropped as a whole"""
+        business = self.bank.create_account("Business")
+        self.account.deposit(100)
+        self.bank.save_accounts(self.account)
+        self.account.transfer(40, business)
+        self.bank.save_accounts(self.account, business) # both sides in one save
+        with open(self.test_file + ".log", "rb+") as file:
+            file.truncate(os.path.getsize(self.test_file + ".log") - 5) # cutting into the recipient's record
+
+        new_bank = BankingSystem(self.test_file, storage="journal")
+        self.assertEqual(new_bank.accounts[self.account.account_id].funds, 100)
+        self.assertEqual(new_bank.accounts[business.account_id].funds, 0)
+        new_bank.accounts[business.account_id].deposit(1) # appended after the torn tail was cut off
+        new_bank.save_accounts(new_bank.accounts[business.account_id])
+        self.assertEqual(BankingSystem(self.test_file, storage="journal").accounts[business.account_id].funds, 1)
+
+class TestGroupCommit(unittest.TestCase):
+    """Test batched persistence with group commit"""
+    
+    def setUp(self):
+        self.test_file = "test_group.txt"
+        remove_ledger_files(self.test_file)
+        self.bank = BankingSystem(self.test_file, storage="journal", fsync="never",
+                                  group_commit=True, commit_window=0.05)
+    
+    def tearDown(self):
+        self.bank.close()
+        remove_ledger_files(self.test_file)
+    
+    def test_many_saves_share_one_flush(self):
+        """Test saves inside one window are committed together"""
+        account = self.bank.create_account("Business")
+        futures = []
+        for _ in range(100):
+            account.deposit(1)
+            futures.append(self.bank.save_accounts(account))
+        self.assertTrue(all(future.result(timeout=5) for future in futures)) # every caller gets the committed acknowledgement
+        self.assertLess(self.bank.commit_groups, 5) # far fewer flushes than operations
+        
+        new_bank = BankingSystem(self.test_file, storage="journal")
+        self.assertEqual(new_bank.accounts[account.account_id].funds, 100)
+    
+    def test_close_commits_queued_changes(self):
+        """Test close drains the queue before returning"""
+        account = self.bank.create_account("Personal")
+        account.deposit(20)
+        future = self.bank.save_accounts(account)
+        self.bank.close()
+        self.assertTrue(future.done())
+        self.assertEqual(BankingSystem(self.test_file, storage="journal").accounts[account.account_id].funds, 20)
+
+class TestBatchIngestion(unittest.TestCase):
+    """Test applying batch files of operations"""
+    
+    def setUp(self):
+        self.test_file = "test_batch.txt"
+        self.files = [self.test_file, "test_batch.csv", "test_batch.jsonl", "test_batch_report.csv"]
+        self.cleanup()
+        self.bank = BankingSystem(self.test_file)
+        self.personal = self.bank.create_account("Personal")
+        self.business = self.bank.create_account("Business")
+    
+    def tearDown(self):
+        self.cleanup()
+    
+    def cleanup(self):
+        remove_ledger_files(self.test_file)
+        for name in self.files[1:]:
+            if os.path.exists(name):
+                os.remove(name)
+    
+    def test_csv_batch_with_report(self):
+        """Test a CSV batch applies good rows and reports bad ones"""
+        with open("test_batch.csv", "w") as file:
+            file.write("op,account_id,amount,recipient\n")
+            file.write(f"deposit,{self.personal.account_id},100,\n")
+            file.write(f"transfer,{self.personal.account_id},40,{self.business.account_id}\n")
+            file.write(f"topup,{self.personal.account_id},10,\n")
+            file.write(f"withdraw,{self.business.account_id},500,\n") # more than the balance
+            file.write("deposit,00000,5,\n") # account does not exist
+        with open("test_batch_report.csv", "w") as report:
+            result = self.bank.apply_batch("test_batch.csv", report=report)
+        self.assertEqual(result, {"applied": 3, "failed": 2})
+        
+        reloaded = BankingSystem(self.test_file) # persisted once at the end
+        self.assertEqual(reloaded.accounts[self.personal.account_id].funds, 50)
+        self.assertEqual(reloaded.accounts[self.personal.account_id].mobile_balance, 10)
+        self.assertEqual(reloaded.accounts[self.business.account_id].funds, 40)
+        with open("test_batch_report.csv") as report:
+            lines = report.read().splitlines()
+        self.assertEqual(len(lines), 6) # header plus one row per record
+        self.assertTrue(lines[4].startswith("4,error,Insufficient funds"))
+    
+    def test_jsonl_batch_from_cli(self):
+        """Test the apply subcommand with a JSONL file"""
+        with open("test_batch.jsonl", "w") as file:
+            file.write(f'{{"op": "deposit", "account_id": "{self.business.account_id}", "amount": 12.5}}\n')
+            file.write(f'{{"op": "withdraw", "account_id": "{self.business.account_id}", "amount": 2.5}}\n')
+        self.assertEqual(cli(["--ledger", self.test_file, "apply", "test_batch.jsonl"]), 0)
+        self.assertEqual(BankingSystem(self.test_file).accounts[self.business.account_id].funds, 10)
+
+    def test_malformed_jsonl_records(self):
+        """Test malformed lines are reported as errors and the good records are still saved"""
+        account_id = self.business.account_id
+        with open("test_batch.jsonl", "w") as file:
+            file.write(f'{{"op": "deposit", "account_id": "{account_id}", "amount": 5}}\n')
+            file.write('{"op": "deposit", "account_id": \n') # cut off half way
+            file.write(f'{{"op": null, "account_id": "{account_id}", "amount": 1}}\n')
+            file.write(f'["deposit", "{account_id}", 1]\n')
+            file.write('{"op": "deposit", "amount": 1}\n')
+            file.write(f'{{"op": "deposit", "account_id": {account_id}, "amount": 2}}\n') # a number is fine as an id
+        for options in ({}, {"columnar": True}):
+            with self.subTest(**options):
+                bank = BankingSystem(self.test_file, **options)
+                with open("test_batch_report.csv", "w") as report:
+                    self.assertEqual(bank.apply_batch("test_batch.jsonl", report=report), {"applied": 2, "failed": 4})
+                with open("test_batch_report.csv") as report:
+                    statuses = [line.split(",")[1] for line in report.read().splitlines()[1:]]
+                self.assertEqual(statuses, ["ok", "error", "error", "error", "error", "ok"])
+                self.assertEqual(BankingSystem(self.test_file).accounts[account_id].funds, 7)
+                bank.accounts[account_id].funds = 0 # back to the start for the next store
+                bank.save_accounts()
+
+class TestLazyLoading(unittest.TestCase):
+    """Test the lazy loader that indexes the file and builds accounts on first use"""
+    
+    def setUp(self):
+        self.test_file = "test_lazy.txt"
+        remove_ledger_files(self.test_file)
+        bank = BankingSystem(self.test_file)
+        self.accounts = [bank.create_account("Personal" if i % 2 else "Business") for i in range(20)]
+        self.accounts[3].deposit(75)
+        bank.save_accounts()
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_accounts_materialize_on_access(self):
+        """Test startup only builds the index and login builds the account"""
+        bank = BankingSystem(self.test_file, lazy=True)
+        self.assertEqual(len(bank.accounts), 20)
+        self.assertEqual(len(bank.accounts._loaded), 0) # nothing parsed yet
+        self.assertTrue(bank.account_exists(self.accounts[0].account_id))
+        
+        account = bank.login(self.accounts[3].account_id, self.accounts[3].passcode)
+        self.assertEqual(account.funds, 75)
+        self.assertEqual(len(bank.accounts._loaded), 1)
+        self.assertIs(bank.accounts[account.account_id], account) # the same object is returned afterwards
+        bank.close()
+    
+    def test_sidecar_index_and_save(self):
+        """Test the sidecar index is reused and saving keeps untouched accounts"""
+        bank = BankingSystem(self.test_file, lazy=True)
+        self.assertTrue(os.path.exists(self.test_file + ".idx"))
+        account = bank.accounts[self.accounts[5].account_id]
+        account.deposit(30)
+        bank.delete_account(self.accounts[0].account_id)
+        new_account = bank.create_account("Business")
+        bank.close()
+        
+        reloaded = BankingSystem(self.test_file, lazy=True) # index comes from the rewritten sidecar
+        self.assertEqual(len(reloaded.accounts), 20)
+        self.assertEqual(reloaded.accounts[account.account_id].funds, 30)
+        self.assertEqual(reloaded.accounts[self.accounts[3].account_id].funds, 75)
+        self.assertIn(new_account.account_id, reloaded.accounts)
+        self.assertNotIn(self.accounts[0].account_id, reloaded.accounts)
+        reloaded.close()
+
+class TestColumnarStore(unittest.TestCase):
+    """Test the array-backed account store"""
+    
+    def setUp(self):
+        self.test_file = "test_columnar.txt"
+        if os.path.exists(self.test_file):
+            os.remove(self.test_file)
+        self.bank = BankingSystem(self.test_file, columnar=True)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_operations_through_views(self):
+        """Test the normal Account methods work on columnar views"""
+        personal = self.bank.create_account("Personal")
+        business = self.bank.create_account("Business")
+        personal.deposit(300)
+        personal.transfer(100, business)
+        personal.top_up_mobile(50)
+        business.withdraw(25)
+        self.assertEqual(self.bank.accounts[personal.account_id].funds, 150) # the change is in the columns
+        self.assertEqual(self.bank.accounts[personal.account_id].mobile_balance, 50)
+        self.assertIs(self.bank.login(business.account_id, business.passcode), business) # same view while it is in use
+        self.assertIn("Balance: $75.00", business.get_account_details())
+        self.bank.save_accounts()
+        
+        reloaded = BankingSystem(self.test_file, columnar=True)
+        self.assertEqual(reloaded.accounts[personal.account_id].mobile_balance, 50)
+        self.assertEqual(reloaded.accounts[business.account_id].funds, 75)
+        self.assertEqual(BankingSystem(self.test_file).accounts[personal.account_id].funds, 150) # same file format as before
+    
+    def test_no_objects_kept_per_account(self):
+        """Test views are released and deleted rows are reused"""
+        ids = [self.bank.create_account("Business").account_id for _ in range(10)]
+        self.assertEqual(len(self.bank.accounts._views), 0) # nothing holds the views, so none are kept
+        self.bank.delete_account(ids[0])
+        self.bank.create_account("Personal")
+        self.assertEqual(len(self.bank.accounts._funds), 10) # the freed row was reused
+        self.assertEqual(len(self.bank.accounts), 10)
+        
+        self.bank.accounts["007"] = BusinessAccount("007", "1234", 5) # ids that are not plain numbers still work
+        self.assertEqual(self.bank.accounts["007"].funds, 5)
+        self.assertNotIn("7", self.bank.accounts)
+        self.assertIn("007", list(self.bank.accounts))
+        self.bank.accounts["\u0667"] = BusinessAccount("\u0667", "1234", 6) # an Arabic-Indic 7 is not the number 7 either
+        self.assertEqual(self.bank.accounts["\u0667"].funds, 6)
+        self.assertNotIn("7", self.bank.accounts)
+
+    def test_deleted_view_does_not_follow_reused_row(self):
+        """Test a view held past its account's deletion fails instead of reaching the row's next owner"""
+        old = self.bank.create_account("Business")
+        self.bank.delete_account(old.account_id)
+        new = self.bank.create_account("Business") # reuses the freed row
+        new.deposit(100)
+        with self.assertRaises(AccountNotFoundError):
+            old.funds
+        with self.assertRaises(AccountNotFoundError):
+            old.withdraw(50)
+        self.assertEqual(new.funds, 100)
+
+class TestConcurrency(unittest.TestCase):
+    """Stress test transfers and deposits from many threads"""
+    
+    def setUp(self):
+        self.test_file = "test_concurrency.txt"
+        remove_ledger_files(self.test_file)
+        self.bank = BankingSystem(self.test_file, storage="journal", fsync="never")
+        self.accounts = [self.bank.create_account("Business") for _ in range(10)]
+        for account in self.accounts:
+            account.deposit(1000)
+        self.bank.save_accounts()
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_no_lost_updates_under_contention(self):
+        """Test money is conserved and the saved ledger matches memory"""
+        deposits = [0] * 8 # each thread counts its own deposits
+        
+        def worker(number):
+            rng = random.Random(number)
+            for _ in range(500):
+                sender, recipient = rng.sample(self.accounts, 2)
+                try:
+                    sender.transfer(rng.randint(1, 50), recipient)
+                except InsufficientFundsError:
+                    pass
+                if rng.random() < 0.2:
+                    recipient.deposit(1)
+                    deposits[number] += 1
+                self.bank.save_accounts(sender, recipient)
+        
+        threads = [threading.Thread(target=worker, args=(number,)) for number in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join(timeout=60)
+            self.assertFalse(thread.is_alive()) # a deadlock would leave threads running
+        
+        self.assertEqual(sum(account.funds for account in self.accounts), 10 * 1000 + sum(deposits))
+        self.assertTrue(all(account.funds >= 0 for account in self.accounts))
+        reloaded = BankingSystem(self.test_file, storage="journal") # the log ends with the latest state of every account
+        for account in self.accounts:
+            self.assertEqual(reloaded.accounts[account.account_id].funds, account.funds)
+
+class TestBankServer(unittest.IsolatedAsyncioTestCase):
+    """Test the asyncio JSON server with in-process clients"""
+    
+    async def asyncSetUp(self):
+        self.test_file = "test_server.txt"
+        remove_ledger_files(self.test_file)
+        self.bank = BankingSystem(self.test_file, storage="journal", fsync="never", group_commit=True)
+        self.business = self.bank.create_account("Business")
+        self.server = await BankServer(self.bank).start()
+        self.port = self.server.sockets[0].getsockname()[1]
+    
+    async def asyncTearDown(self):
+        self.server.close()
+        await self.server.wait_closed()
+        self.bank.close()
+        remove_ledger_files(self.test_file)
+    
+    async def call(self, reader, writer, **request):
+        writer.write((json.dumps(request) + "\n").encode())
+        return json.loads(await reader.readline())
+    
+    async def test_session_operations(self):
+        """Test login, operations and errors over one connection"""
+        account = self.bank.create_account("Personal")
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        reply = await self.call(reader, writer, op="deposit", amount=5)
+        self.assertFalse(reply["ok"]) # not logged in yet
+        reply = await self.call(reader, writer, op="login", account_id=account.account_id, passcode=account.passcode)
+        self.assertTrue(reply["ok"])
+        self.assertEqual((await self.call(reader, writer, op="deposit", amount=100))["message"],
+                         "Deposited $100.00. New balance: $100.00")
+        await self.call(reader, writer, op="topup", amount=20)
+        await self.call(reader, writer, op="transfer", amount=30, recipient=self.business.account_id)
+        reply = await self.call(reader, writer, op="withdraw", amount=1000)
+        self.assertEqual(reply["error"], "Insufficient funds for withdrawal")
+        self.assertIn("Mobile Balance: $20.00", (await self.call(reader, writer, op="details"))["message"])
+        writer.close()
+        await writer.wait_closed()
+        
+        reloaded = BankingSystem(self.test_file, storage="journal") # every reply came after its change was committed
+        self.assertEqual(reloaded.accounts[account.account_id].funds, 50)
+        self.assertEqual(reloaded.accounts[self.business.account_id].funds, 30)
+    
+    async def test_bad_requests_keep_the_connection(self):
+        """Test malformed recipients, overlong lines and unexpected errors get an error reply, not a dropped connection"""
+        account = self.bank.create_account("Personal")
+        account.deposit(100)
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        await self.call(reader, writer, op="login", account_id=account.account_id, passcode=account.passcode)
+        reply = await self.call(reader, writer, op="transfer", amount=10, recipient=[self.business.account_id])
+        self.assertEqual(reply["error"], f"Malformed account id: ['{self.business.account_id}']")
+        reply = await self.call(reader, writer, op="transfer", amount=10, recipient=int(self.business.account_id))
+        self.assertTrue(reply["ok"]) # a JSON number works as an id
+        
+        reply = await self.call(reader, writer, op="deposit", amount=1, padding="x" * 100000) # over asyncio's 64 KiB line limit
+        self.assertEqual(reply["error"], "Request is too long")
+        
+        apply_operation = self.bank.apply_operation
+        self.bank.apply_operation = lambda *args: 1 / 0
+        with redirect_stderr(io.StringIO()):
+            reply = await self.call(reader, writer, op="deposit", amount=1)
+        self.assertEqual(reply["error"], "Request failed")
+        self.bank.apply_operation = apply_operation
+        
+        self.assertIn("Balance: $90.00", (await self.call(reader, writer, op="details"))["message"]) # still the same session
+        writer.close()
+        await writer.wait_closed()
+    
+    async def test_many_concurrent_clients(self):
+        """Test a hundred connections depositing at the same time"""
+        async def client():
+            reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+            await self.call(reader, writer, op="login", account_id=self.business.account_id,
+                            passcode=self.business.passcode)
+            for _ in range(5):
+                self.assertTrue((await self.call(reader, writer, op="deposit", amount=1))["ok"])
+            writer.close()
+            await writer.wait_closed()
+        
+        await asyncio.gather(*(client() for _ in range(100)))
+        self.assertEqual(self.business.funds, 500)
+        self.assertEqual(BankingSystem(self.test_file, storage="journal").accounts[self.business.account_id].funds, 500)
+
+    async def test_login_runs_off_the_event_loop(self):
+        """Test the (slow, possibly saving) login runs in a worker thread"""
+        threads = []
+        login = self.bank.login
+        self.bank.login = lambda *args: threads.append(threading.current_thread()) or login(*args)
+        reader, writer = await asyncio.open_connection("127.0.0.1", self.port)
+        reply = await self.call(reader, writer, op="login", account_id=self.business.account_id,
+                                passcode=self.business.passcode)
+        self.assertTrue(reply["ok"])
+        self.assertEqual(len(threads), 1)
+        self.assertIsNot(threads[0], threading.current_thread())
+        writer.close()
+        await writer.wait_closed()
+
+class TestMoney(unittest.TestCase):
+    """Test the integer cents money representation"""
+    
+    def setUp(self):
+        self.test_file = "test_money.txt"
+        if os.path.exists(self.test_file):
+            os.remove(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_conversions(self):
+        """Test amounts convert to cents exactly and bad ones are rejected"""
+        self.assertEqual(to_cents(1000.01), 100001)
+        self.assertEqual(to_cents("12.5"), 1250)
+        self.assertEqual(to_cents(7), 700)
+        self.assertEqual(parse_cents("0.30000000000000004"), 30) # old float balances are rounded to the cent
+        self.assertEqual(format_cents(5), "0.05")
+        for bad in (1.005, "1.234", "abc", float("nan")):
+            with self.assertRaises(InvalidAmountError):
+                to_cents(bad)
+    
+    def test_no_drift_over_many_operations(self):
+        """Test balances stay exact where float arithmetic would drift"""
+        account = PersonalAccount("10001", "1234")
+        for _ in range(10000):
+            account.deposit(0.1)
+        for _ in range(3000):
+            account.top_up_mobile(0.1)
+        self.assertEqual(account.cents, 70000)
+        self.assertEqual(account.funds, 700.0) # exactly - a float sum of 0.1 would not be
+        self.assertEqual(account.mobile_balance, 300.0)
+    
+    def test_file_format_is_exact(self):
+        """Test balances are written as exact 2 decimal numbers"""
+        bank = BankingSystem(self.test_file)
+        account = bank.create_account("Personal")
+        account.deposit(0.1)
+        account.deposit(0.2)
+        bank.save_accounts()
+        with open(self.test_file) as file:
+            self.assertTrue(file.read().strip().endswith(",Personal,0.30,0.00"))
+        self.assertEqual(BankingSystem(self.test_file).accounts[account.account_id].cents, 30)
+    
+    def test_amounts_fit_in_64_bit_balances(self):
+        """Test huge amounts are rejected before they reach the 64-bit balance columns"""
+        for bad in ("100000000000000000000", 10**17, 1e20):
+            with self.assertRaises(InvalidAmountError):
+                to_cents(bad)
+        bank = BankingSystem(self.test_file, columnar=True)
+        account = bank.create_account("Business")
+        account.deposit("90000000000000000") # close to the limit
+        with self.assertRaises(InvalidAmountError):
+            account.deposit("10000000000000000")
+        self.assertEqual(account.funds, 9e16)
+        with open(self.test_file + ".jsonl", "w") as file:
+            file.write(f'{{"op": "deposit", "account_id": "{account.account_id}", "amount": "100000000000000000000"}}\n')
+        self.addCleanup(os.remove, self.test_file + ".jsonl")
+        self.assertEqual(bank.apply_batch(self.test_file + ".jsonl"), {"applied": 0, "failed": 1})
+
+class TestIdAllocation(unittest.TestCase):
+    """Test unique account id allocation"""
+    
+    def setUp(self):
+        self.test_file = "test_ids.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_every_id_is_unique_until_the_range_is_full(self):
+        """Test all 900 three digit ids are handed out once and then creation fails"""
+        bank = BankingSystem(self.test_file, storage="journal", fsync="never", id_width=3)
+        accounts = bank.create_accounts(900, "Business")
+        ids = [account.account_id for account in accounts]
+        self.assertEqual(len(set(ids)), 900)
+        self.assertTrue(all(100 <= int(account_id) <= 999 for account_id in ids))
+        with open(self.test_file + ".log") as file:
+            self.assertEqual(len(file.readlines()), 901) # all created with one append (plus its group header)
+        with self.assertRaises(BankingError):
+            bank.create_account("Personal")
+    
+    def test_existing_ids_are_skipped_and_state_survives_restart(self):
+        """Test ids already in the ledger are never reused, also after a restart"""
+        bank = BankingSystem(self.test_file, id_width=3)
+        first = bank.create_accounts(100, "Personal")
+        with open(self.test_file) as file:
+            lines = [line for line in file if not line.startswith("#")] # older versions wrote no snapshot header
+        with open(self.test_file, "w") as file: # ids written by some older version of the program
+            file.writelines(lines)
+            for number in range(100, 1000, 2):
+                if str(number) not in bank.accounts:
+                    file.write(f"{number},1234,Business,5.00\n")
+        bank = BankingSystem(self.test_file, id_width=3)
+        old_ids = set(bank.accounts)
+        new_ids = {account.account_id for account in bank.create_accounts(900 - len(old_ids), "Personal")}
+        self.assertFalse(new_ids & old_ids)
+        self.assertEqual(len(bank.accounts), 900)
+        self.assertTrue(all(bank.accounts[account.account_id].account_type == "Personal" for account in first))
+
+class TestBinaryLedger(unittest.TestCase):
+    """Test the memory-mapped binary ledger"""
+    
+    def setUp(self):
+        self.test_file = "test_binary.bin"
+        self.text_file = "test_binary.txt"
+        for name in (self.test_file, self.text_file):
+            remove_ledger_files(name)
+    
+    def tearDown(self):
+        for name in (self.test_file, self.text_file):
+            remove_ledger_files(name)
+    
+    def test_balances_change_in_place(self):
+        """Test operations update the mapped records and survive a reopen"""
+        bank = BankingSystem(self.test_file, storage="binary")
+        personal, business = bank.create_account("Personal"), bank.create_account("Business")
+        personal.deposit(100.25)
+        personal.transfer(50, business)
+        personal.top_up_mobile(0.25)
+        size = os.path.getsize(self.test_file)
+        bank.save_accounts(personal, business)
+        self.assertEqual(os.path.getsize(self.test_file), size) # nothing was rewritten
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="binary")
+        account = bank.login(personal.account_id, personal.passcode)
+        self.assertIsInstance(account, PersonalAccount)
+        self.assertEqual((account.cents, account.mobile_cents), (5000, 25))
+        self.assertEqual(bank.accounts[business.account_id].funds, 50)
+        bank.delete_account(business.account_id)
+        self.assertFalse(bank.account_exists(business.account_id))
+        self.assertEqual(len(bank.accounts), 1)
+        bank.close()
+    
+    def test_compaction_keeps_live_accounts_working(self):
+        """Test views still point at the right record after the file is rewritten"""
+        bank = BankingSystem(self.test_file, storage="binary")
+        accounts = bank.create_accounts(50, "Business")
+        accounts[7].deposit(7)
+        bank.accounts.compact()
+        accounts[7].deposit(1) # the record moved, the view follows it
+        self.assertEqual(bank.accounts[accounts[7].account_id].cents, 800)
+        self.assertEqual(bank.accounts.ledger.sorted_count, 50)
+        bank.close()
+    
+    def test_checkpoint_compacts_outside_the_account_locks(self):
+        """Test changes made while the compacted copy is written are carried over to it"""
+        bank = BankingSystem(self.test_file, storage="binary")
+        accounts = bank.create_accounts(50, "Business")
+        accounts[5].deposit(5)
+        bank.accounts.compaction_due = lambda: True
+        write_compaction = bank.accounts.write_compaction
+        def write_and_change(ledger, rows):
+            write_compaction(ledger, rows)
+            def change(): # another thread - it would block if the checkpoint still held the account locks
+                with account_locks(accounts[5]): # what deposit does before it saves (saving waits for the checkpoint)
+                    accounts[5].cents += 100
+                with bank._store_lock:
+                    del bank.accounts[accounts[6].account_id]
+            thread = threading.Thread(target=change)
+            thread.start()
+            thread.join(5)
+            self.assertFalse(thread.is_alive())
+        bank.accounts.write_compaction = write_and_change
+        bank.checkpoint()
+        self.assertEqual(bank.accounts.generation, 1) # the compacted copy was swapped in
+        self.assertEqual(accounts[5].cents, 600)
+        self.assertFalse(bank.account_exists(accounts[6].account_id))
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="binary")
+        self.assertEqual(bank.accounts[accounts[5].account_id].cents, 600)
+        self.assertEqual(len(bank.accounts), 49)
+        bank.close()
+    
+    def test_conversion_round_trip(self):
+        """Test text -> binary -> text keeps every account"""
+        bank = BankingSystem(self.text_file)
+        personal = bank.create_account("Personal")
+        personal.deposit(12.34)
+        personal.top_up_mobile(2)
+        bank.create_account("Business").deposit(99)
+        bank.save_accounts()
+        self.assertEqual(convert_text_to_binary(self.text_file, self.test_file), 2)
+        with open(self.text_file) as file:
+            original = sorted(line for line in file if not line.startswith("#")) # without the snapshot header
+        self.assertEqual(convert_binary_to_text(self.test_file, self.text_file), 2)
+        with open(self.text_file) as file:
+            self.assertEqual(sorted(file.readlines()), original)
+
+class TestMetrics(unittest.TestCase):
+    """Test operation counters, latency histograms and the Prometheus dump"""
+    
+    def setUp(self):
+        self.test_file = "test_metrics.txt"
+        remove_ledger_files(self.test_file)
+        METRICS.reset()
+    
+    def tearDown(self):
+        METRICS.disable()
+        METRICS.reset()
+        remove_ledger_files(self.test_file)
+    
+    def test_disabled_by_default(self):
+        """Test nothing is recorded until metrics are enabled"""
+        bank = BankingSystem(self.test_file)
+        bank.create_account("Business").deposit(5)
+        self.assertEqual(METRICS.snapshot(), {"counters": {}, "gauges": {}, "histograms": {}})
+    
+    def test_operations_errors_and_bytes_are_counted(self):
+        """Test counters, histograms and gauges after a few operations"""
+        METRICS.enable()
+        bank = BankingSystem(self.test_file, storage="journal", fsync="never")
+        account = bank.create_account("Personal")
+        account.deposit(100)
+        account.top_up_mobile(10)
+        with self.assertRaises(InsufficientFundsError):
+            account.withdraw(500)
+        with self.assertRaises(AuthenticationError):
+            bank.login(account.account_id, "wrong")
+        bank.save_accounts()
+        
+        snapshot = METRICS.snapshot()
+        counters = snapshot["counters"]
+        self.assertEqual(counters['banking_operations_total{operation="deposit"}'], 1)
+        self.assertEqual(counters['banking_errors_total{error="InsufficientFundsError",operation="withdraw"}'], 1)
+        self.assertEqual(counters['banking_errors_total{error="AuthenticationError",operation="login"}'], 1)
+        self.assertGreater(counters['banking_bytes_written_total{file="journal"}'], 0)
+        self.assertEqual(snapshot["gauges"]["banking_snapshot_bytes"], os.path.getsize(self.test_file))
+        self.assertEqual(snapshot["histograms"]['banking_operation_seconds{operation="top_up_mobile"}']["count"], 1)
+        
+        text = METRICS.to_prometheus()
+        self.assertIn("# TYPE banking_operation_seconds histogram", text)
+        self.assertIn('banking_operation_seconds_bucket{operation="deposit",le="+Inf"} 1', text)
+        self.assertIn('banking_operations_total{operation="login"} 1', text)
+    
+    def test_nested_operations_are_not_counted_twice(self):
+        """Test a transfer counts as one transfer, not also as a withdraw and a deposit"""
+        METRICS.enable()
+        bank = BankingSystem(self.test_file, storage="journal", fsync="never")
+        sender, recipient = bank.create_account("Personal"), bank.create_account("Business")
+        sender.deposit(100)
+        sender.transfer(40, recipient)
+        with self.assertRaises(InsufficientFundsError):
+            sender.transfer(500, recipient)
+        counters = METRICS.snapshot()["counters"]
+        self.assertEqual(counters['banking_operations_total{operation="transfer"}'], 2)
+        self.assertEqual(counters['banking_operations_total{operation="deposit"}'], 1) # only the direct one
+        self.assertNotIn('banking_operations_total{operation="withdraw"}', counters)
+        self.assertEqual(counters['banking_errors_total{error="InsufficientFundsError",operation="transfer"}'], 1)
+        self.assertNotIn('banking_errors_total{error="InsufficientFundsError",operation="withdraw"}', counters)
+
+class TestHashedPasscodes(unittest.TestCase):
+    """Test hashed passcodes, the verified credential cache and login rate limiting"""
+    
+    def setUp(self):
+        self.test_file = "test_hashed.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_plaintext_rows_are_migrated_at_load(self):
+        """Test an old plaintext file is hashed on load and old passcodes still work"""
+        with open(self.test_file, "w") as file:
+            file.write("12345,4321,Personal,10.00,0.00\n")
+        bank = BankingSystem(self.test_file, passcode_iterations=1000)
+        with open(self.test_file) as file:
+            contents = file.read()
+        self.assertNotIn(",4321,", contents) # only the hash is stored now
+        self.assertIn("pbkdf2_sha256$1000$", contents)
+        self.assertEqual(bank.login("12345", "4321").funds, 10)
+        self.assertEqual(BankingSystem(self.test_file, passcode_iterations=1000).login("12345", "4321").funds, 10)
+
+    def test_fixed_storage_saves_hashed_passcodes(self):
+        """Test fixed storage writes migrated and rehashed passcodes, not only balance changes"""
+        with open(self.test_file, "w") as file:
+            file.write("12345,4321,Personal,10.00,0.00\n")
+        BankingSystem(self.test_file, storage="fixed", passcode_iterations=1000).close()
+        with open(self.test_file) as file:
+            self.assertIn("pbkdf2_sha256$1000$", file.read())
+        bank = BankingSystem(self.test_file, storage="fixed", passcode_iterations=2000) # a new work factor - rehashed on login
+        bank.login("12345", "4321")
+        bank.close()
+        with open(self.test_file) as file:
+            contents = file.read()
+        self.assertIn("pbkdf2_sha256$2000$", contents)
+        self.assertNotIn(",4321,", contents)
+    
+    def test_repeat_logins_skip_the_hash(self):
+        """Test the slow hash only runs for the first login"""
+        bank = BankingSystem(self.test_file, passcode_iterations=1000)
+        account = bank.create_account("Business")
+        self.assertTrue(account.passcode.startswith("pbkdf2_sha256$"))
+        calls = []
+        verify = bank.hasher.verify
+        bank.hasher.verify = lambda passcode, stored: calls.append(1) or verify(passcode, stored)
+        for _ in range(5):
+            self.assertIs(bank.login(account.account_id, account.initial_passcode), account)
+        self.assertEqual(len(calls), 1)
+        with self.assertRaises(AuthenticationError):
+            bank.login(account.account_id, "0000")
+        
+        token = bank.start_session(account.account_id, account.initial_passcode)
+        self.assertIs(bank.resume_session(token), account)
+        with self.assertRaises(AuthenticationError):
+            bank.resume_session("not-a-token")
+    
+    def test_repeated_failures_lock_the_account_out(self):
+        """Test the correct passcode is refused after too many wrong ones"""
+        bank = BankingSystem(self.test_file, max_login_failures=3)
+        account = bank.create_account("Personal")
+        for _ in range(3):
+            with self.assertRaises(AuthenticationError):
+                bank.login(account.account_id, "wrong")
+        with self.assertRaisesRegex(AuthenticationError, "Too many failed login attempts"):
+            bank.login(account.account_id, account.passcode)
+    
+    def test_lockout_is_not_evicted_by_other_ids(self):
+        """Test failures on other (or made-up) ids neither evict a lockout nor get stored themselves"""
+        bank = BankingSystem(self.test_file, max_login_failures=3, cache_size=2)
+        account = bank.create_account("Personal")
+        for _ in range(3):
+            with self.assertRaises(AuthenticationError):
+                bank.login(account.account_id, "wrong")
+        for other in [bank.create_account("Business") for _ in range(3)]: # more ids than cache_size
+            with self.assertRaises(AuthenticationError):
+                bank.login(other.account_id, "wrong")
+        for number in range(100):
+            with self.assertRaises(AuthenticationError):
+                bank.login(f"made-up-{number}", "wrong")
+        self.assertEqual(len(bank.failures), 4) # only the real accounts
+        with self.assertRaisesRegex(AuthenticationError, "Too many failed login attempts"):
+            bank.login(account.account_id, account.passcode)
+
+class TestShardedBank(unittest.TestCase):
+    """Test the multi-process sharded ledger and its cross-shard transfers"""
+    
+    def setUp(self):
+        self.test_file = "test_sharded.txt"
+        self.shard_files = [f"{self.test_file}.shard{number}" for number in range(3)]
+        self.cleanup()
+    
+    def tearDown(self):
+        self.cleanup()
+    
+    def cleanup(self):
+        for name in [self.test_file] + self.shard_files: # the coordinator log and one ledger per shard
+            remove_ledger_files(name)
+    
+    def test_cross_shard_transfers_keep_money_constant(self):
+        """Test transfers between shards commit or abort as a whole"""
+        with ShardedBank(self.test_file, shards=3) as bank:
+            ids = [bank.create_account("Personal")[0] for _ in range(12)]
+            shards = {bank.shard_for(account_id) for account_id in ids}
+            self.assertGreater(len(shards), 1)
+            results = bank.apply_batch([("deposit", account_id, 100, None) for account_id in ids])
+            self.assertTrue(all(ok for ok, _ in results))
+            sender = ids[0]
+            recipient = next(account_id for account_id in ids if bank.shard_for(account_id) != bank.shard_for(sender))
+            
+            self.assertIn("Transferred $40.00", bank.transfer(sender, 40, recipient))
+            self.assertEqual(bank.balance(sender), (60.0, 0.0))
+            self.assertEqual(bank.balance(recipient), (140.0, 0.0))
+            with self.assertRaises(InsufficientFundsError): # aborted - the sender keeps the money
+                bank.transfer(sender, 500, recipient)
+            with self.assertRaises(AccountNotFoundError): # the debit prepared on the other shard is refunded
+                bank.transfer(sender, 10, "99999999" if bank.shard_for("99999999") != bank.shard_for(sender) else "99999998")
+            self.assertEqual(bank.balance(sender), (60.0, 0.0))
+            
+            records = [("transfer", random.choice(ids), random.randint(1, 60), random.choice(ids)) for _ in range(100)]
+            bank.apply_batch(records)
+            self.assertEqual(bank.total_cents(), 1200 * 100)
+        
+        with ShardedBank(self.test_file, shards=3) as bank: # the shard files are loaded again
+            self.assertEqual(bank.count(), 12)
+            self.assertEqual(bank.total_cents(), 1200 * 100)
+    
+    def test_recovery_finishes_prepared_transfers(self):
+        """Test a coordinator crash after the commit decision is completed on restart"""
+        with ShardedBank(self.test_file, shards=3) as bank:
+            ids = [bank.create_account("Business")[0] for _ in range(12)]
+            sender = ids[0]
+            recipient = next(account_id for account_id in ids if bank.shard_for(account_id) != bank.shard_for(sender))
+            other = next(account_id for account_id in ids if bank.shard_for(account_id) != bank.shard_for(sender)
+                         and account_id != recipient)
+            bank.deposit(sender, 100)
+            sender_shard, recipient_shard = bank.shard_for(sender), bank.shard_for(recipient)
+            # both prepared and decided to commit, then the coordinator stops before telling the shards
+            bank._log_decision("C", "tx-commit", sender_shard, recipient_shard)
+            bank._call(sender_shard, "prepare_debit", "tx-commit", sender, 30)
+            bank._call(recipient_shard, "prepare_credit", "tx-commit", recipient, 30)
+            # prepared but never decided - this one has to be aborted
+            bank._call(sender_shard, "prepare_debit", "tx-open", sender, 50)
+            bank._call(bank.shard_for(other), "prepare_credit", "tx-open", other, 50)
+            self.assertEqual(bank.balance(sender), (20.0, None))
+        
+        with ShardedBank(self.test_file, shards=3) as bank:
+            self.assertEqual(bank.balance(sender), (70.0, None))
+            self.assertEqual(bank.balance(recipient), (30.0, None))
+            self.assertEqual(bank.balance(other), (0.0, None))
+            self.assertEqual(bank.total_cents(), 100 * 100)
+
+class TestTransferHolds(unittest.TestCase):
+    """Test two-phase transfer holds in a single BankingSystem"""
+    
+    def setUp(self):
+        self.test_file = "test_holds.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_holds_survive_restart_and_checkpoint(self):
+        """Test a prepared debit is replayed from the journal and the holds file"""
+        bank = BankingSystem(self.test_file, storage="journal")
+        account = bank.create_account("Personal")
+        account.deposit(100)
+        bank.save_accounts(account)
+        bank.prepare_debit("tx1", account.account_id, 25)
+        bank.prepare_debit("tx1", account.account_id, 25) # a retried prepare is not applied twice
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="journal")
+        self.assertEqual(bank.accounts[account.account_id].funds, 75.0)
+        self.assertEqual(bank.holds, {"tx1": ("debit", account.account_id, 2500)})
+        bank.checkpoint()
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="journal")
+        self.assertIn("tx1", bank.holds)
+        bank.abort_hold("tx1")
+        bank.abort_hold("tx1")
+        self.assertEqual(bank.accounts[account.account_id].funds, 100.0)
+        bank.close()
+        bank = BankingSystem(self.test_file, storage="journal")
+        self.assertEqual(bank.holds, {})
+        self.assertEqual(bank.accounts[account.account_id].funds, 100.0)
+        bank.close()
+
+class TestTransactionHistory(unittest.TestCase):
+    """Test the per-account transaction history and paged statements"""
+    
+    def setUp(self):
+        self.test_file = "test_history.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_statement_pages_and_date_range(self):
+        """Test statements are paged, filtered by time and kept across restarts"""
+        bank = BankingSystem(self.test_file, storage="journal", history=True)
+        account, other = bank.create_accounts(2, "Personal")
+        for amount in range(1, 26):
+            bank.apply_operation("deposit", account.account_id, amount)
+        middle = bank.history._times[account.account_id][9] # time of the 10th entry
+        bank.apply_operation("transfer", account.account_id, 5, other.account_id)
+        bank.apply_operation("topup", other.account_id, 1)
+        
+        page = bank.statement(account.account_id, page=3, page_size=10)
+        self.assertEqual((page["page"], page["pages"], page["total"]), (3, 3, 26))
+        self.assertEqual([entry["amount"] for entry in page["entries"]], [21, 22, 23, 24, 25, 5])
+        self.assertEqual(page["entries"][-1]["kind"], "transfer_out")
+        self.assertEqual(page["entries"][-1]["balance"], 320.0)
+        self.assertEqual(bank.history.count(account.account_id, start=middle), 17)
+        self.assertEqual(bank.statement(account.account_id, end=middle)["total"], 9)
+        self.assertEqual(bank.statement(account.account_id, page=9)["entries"], [])
+        bank.save_accounts(account, other)
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="journal", history=True) # index comes from the sidecar
+        bank.apply_operation("withdraw", other.account_id, 2)
+        entries = bank.statement(other.account_id)["entries"]
+        self.assertEqual([(entry["kind"], entry["balance"]) for entry in entries],
+                         [("transfer_in", 5.0), ("topup", 4.0), ("withdraw", 2.0)])
+        bank.close()
+        os.remove(self.test_file + ".history.idx") # without the sidecar the history is scanned once
+        with open(self.test_file + ".history", "a") as file:
+            file.write("1.0,torn") # a crash in the middle of a line
+        bank = BankingSystem(self.test_file, storage="journal", history=True)
+        self.assertEqual(bank.statement(account.account_id)["total"], 26)
+        self.assertEqual(bank.statement(other.account_id)["total"], 3)
+        bank.close()
+    
+    def test_history_is_written_after_the_locks(self):
+        """Test an operation only buffers its history and the save writes it, outside the account locks"""
+        bank = BankingSystem(self.test_file, storage="journal", history=True)
+        account = bank.create_account("Personal")
+        history_file = self.test_file + ".history"
+        size = os.path.getsize(history_file)
+        changed, _ = bank.apply_operation("deposit", account.account_id, 5)
+        self.assertEqual(os.path.getsize(history_file), size)
+        bank.save_accounts(*changed)
+        self.assertGreater(os.path.getsize(history_file), size)
+        bank.apply_operation("withdraw", account.account_id, 2)
+        self.assertEqual(bank.statement(account.account_id)["total"], 2) # a statement sees buffered entries too
+        bank.close()
+
+class TestDirtyTracking(unittest.TestCase):
+    """Test that only changed accounts are written back"""
+    
+    def setUp(self):
+        self.test_file = "test_dirty.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_fixed_storage_rewrites_only_dirty_lines(self):
+        """Test fixed storage overwrites the changed lines in place"""
+        with open(self.test_file, "w") as file: # a normal accounts file is converted on first load
+            file.write("10001,1111,Personal,5.00,1.00\n10002,2222,Business,7.50\n10003,3333,Business,0.00\n")
+        bank = BankingSystem(self.test_file, storage="fixed")
+        first, second, third = (bank.accounts[account_id] for account_id in ("10001", "10002", "10003"))
+        self.assertFalse(first.dirty)
+        with open(self.test_file, "rb") as file:
+            before = file.readlines()
+        self.assertEqual(len({len(line) for line in before}), 1)
+        
+        first.top_up_mobile(2)
+        self.assertTrue(first.dirty)
+        bank.save_accounts() # finds the dirty account on its own
+        self.assertFalse(first.dirty)
+        with open(self.test_file, "rb") as file:
+            after = file.readlines()
+        self.assertEqual(after[1:], before[1:])
+        self.assertEqual(after[0].split(), [b"10001,1111,Personal,3.00,3.00"])
+        
+        bank.delete_account("10002")
+        new = bank.create_account("Personal") # takes the blank line left by the deleted account
+        new.deposit(4)
+        bank.save_accounts(new)
+        self.assertEqual(os.path.getsize(self.test_file), 3 * len(before[0]))
+        bank.close()
+        
+        bank = BankingSystem(self.test_file, storage="fixed")
+        self.assertEqual(sorted(bank.accounts), sorted(["10001", "10003", new.account_id]))
+        self.assertEqual(bank.accounts["10001"].mobile_balance, 3.0)
+        self.assertEqual(bank.accounts[new.account_id].funds, 4.0)
+        bank.close()
+    
+    def test_binary_ledger_flushes_only_dirty_pages(self):
+        """Test the binary ledger remembers which pages need writing back"""
+        binary_file = self.test_file + ".bin"
+        self.addCleanup(remove_ledger_files, binary_file)
+        with open(self.test_file, "w") as file:
+            file.writelines(f"{10000 + number},1234,Business,1.00\n" for number in range(2000))
+        convert_text_to_binary(self.test_file, binary_file)
+        bank = BankingSystem(binary_file, storage="binary")
+        bank.accounts["10000"].deposit(1)
+        bank.accounts["11999"].deposit(1)
+        self.assertEqual(len(bank.accounts.ledger._dirty_pages), 2)
+        bank.save_accounts(bank.accounts["10000"], bank.accounts["11999"])
+        self.assertEqual(bank.accounts.ledger._dirty_pages, set())
+        bank.close()
+        bank = BankingSystem(binary_file, storage="binary")
+        self.assertEqual(bank.accounts["11999"].funds, 2.0)
+        bank.close()
+
+class TestBulkOperations(unittest.TestCase):
+    """Test interest, fee and totals passes over every account"""
+    
+    def setUp(self):
+        self.test_file = "test_bulk.txt"
+        remove_ledger_files(self.test_file)
+    
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+    
+    def test_bulk_operations(self):
+        """Test interest, fees and totals on account objects, a fixed-width ledger and the columnar arrays"""
+        for options in ({"storage": "journal"}, {"storage": "fixed"},
+                        {"storage": "journal", "columnar": True, "history": True}):
+            with self.subTest(**options):
+                write_four_accounts(self.test_file)
+                bank = BankingSystem(self.test_file, **options)
+                self.assertEqual(bank.totals()["total"], {"accounts": 4, "funds": 1102.5, "mobile": 5.0})
+                
+                result = bank.post_interest(0.015, "Business") # 1.5% for business accounts only
+                self.assertEqual(result, {"accounts": 2, "total": 15.03})
+                result = bank.charge_fee(3) # no account is overdrawn
+                self.assertEqual((result["accounts"], result["total"]), (2, 6.0))
+                self.assertEqual(sorted(result["skipped"]), ["10003", "10004"])
+                with self.assertRaises(InvalidAmountError):
+                    bank.charge_fee(-1)
+                totals = bank.totals()
+                self.assertEqual(totals["Business"], {"accounts": 2, "funds": 1014.03, "mobile": 0.0})
+                self.assertEqual(totals["Personal"], {"accounts": 2, "funds": 97.5, "mobile": 5.0})
+                if bank.history is not None:
+                    entries = bank.statement("10002")["entries"]
+                    self.assertEqual([(entry["kind"], entry["amount"]) for entry in entries],
+                                     [("interest", 15.0), ("fee", 3.0)])
+                bank.close()
+                
+                bank = BankingSystem(self.test_file, **options) # saved once at the end of each pass
+                self.assertEqual(bank.accounts["10002"].funds, 1012.0)
+                self.assertEqual(bank.accounts["10003"].funds, 2.03)
+                bank.close()
+    
+    def test_interest_that_would_overflow_changes_nothing(self):
+        """Test a balance that would not fit in 64 bits stops the whole interest pass before it starts"""
+        for options in ({"storage": "journal"}, {"storage": "journal", "columnar": True}):
+            with self.subTest(**options):
+                write_four_accounts(self.test_file)
+                bank = BankingSystem(self.test_file, **options)
+                bank.accounts["10002"].cents = 2**63 - 100 # just below the largest balance
+                with self.assertRaises(InvalidAmountError):
+                    bank.post_interest(0.5)
+                self.assertEqual(bank.accounts["10001"].cents, 10000) # accounts before it were not credited either
+                self.assertEqual(bank.accounts["10002"].cents, 2**63 - 100)
+                self.assertEqual(bank.accounts["10003"].cents, 200)
+                bank.close()
+
+class TestSnapshotRecovery(unittest.TestCase):
+    """Test checksummed snapshot generations and recovery at startup"""
+    
+    def setUp(self):
+        self.test_file = "test_recovery.txt"
+        remove_ledger_files(self.test_file)
+        bank = BankingSystem(self.test_file)
+        self.account = bank.create_account("Personal") # generation 1
+        self.account.deposit(10)
+        bank.save_accounts() # generation 2, generation 1 is kept as .prev
+        bank.close()
+
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+
+    def damage(self, filename):
+        """Change one byte of the first record (to a different digit, whatever the random id starts with)"""
+        with open(filename, "r+b") as file:
+            file.seek(BankingSystem.SNAPSHOT_HEADER_SIZE)
+            byte = file.read(1)
+            file.seek(BankingSystem.SNAPSHOT_HEADER_SIZE)
+            file.write(b"8" if byte == b"9" else b"9")
+
+    def test_damaged_snapshot_falls_back_to_previous_generation(self):
+        """Test a snapshot that fails its checksum is set aside and the previous one is loaded"""
+        with open(self.test_file, "rb") as file:
+            self.assertTrue(file.readline().startswith(b"#snapshot,2,1,"))
+        self.damage(self.test_file)
+        bank = BankingSystem(self.test_file)
+        self.assertEqual(bank.snapshot_generation, 2)
+        self.assertEqual(bank.accounts[self.account.account_id].funds, 0) # the generation before the deposit
+        self.assertTrue(os.path.exists(self.test_file + ".corrupt"))
+        bank.save_accounts()
+        self.assertEqual(bank.snapshot_generation, 3) # never reuses the number of the damaged file
+        bank.close()
+
+        with open(self.test_file + ".prev", "r+b") as file:
+            file.truncate(os.path.getsize(self.test_file + ".prev") - 3) # cut short
+        self.damage(self.test_file)
+        with self.assertRaises(BankingError): # no intact generation left - nothing is loaded
+            BankingSystem(self.test_file)
+
+    def test_crash_between_renames_and_torn_temp_file(self):
+        """Test a completely written temp file is used and a torn one is ignored"""
+        os.replace(self.test_file, self.test_file + ".tmp") # crashed after keeping .prev, before the rename
+        bank = BankingSystem(self.test_file, lazy=True)
+        self.assertEqual(bank.accounts[self.account.account_id].funds, 10)
+        self.assertFalse(os.path.exists(self.test_file + ".tmp"))
+        bank.close()
+
+        with open(self.test_file + ".tmp", "wb") as file:
+            file.write(b"#incomplete" + b" " * 52 + b"\n12345,1111,Business,5") # crashed mid write
+        bank = BankingSystem(self.test_file, lazy=True) # the sidecar index is current, the file is not read again
+        self.assertEqual(bank.accounts[self.account.account_id].funds, 10)
+        self.assertFalse(bank.account_exists("12345"))
+        self.assertFalse(os.path.exists(self.test_file + ".tmp"))
+        bank.close()
+
+class TestSecondaryIndexes(unittest.TestCase):
+    """Test the balance indexes behind range and top-k account queries"""
+    
+    def setUp(self):
+        self.test_file = "test_indexes.txt"
+        self.binary_file = self.test_file + ".bin"
+        self.cleanup()
+
+    def tearDown(self):
+        self.cleanup()
+
+    def cleanup(self):
+        remove_ledger_files(self.test_file)
+        remove_ledger_files(self.binary_file)
+
+    def test_indexes_follow_balance_changes(self):
+        """Test queries stay correct as account objects, columnar views and binary ledger views change"""
+        for options in ({"storage": "journal"}, {"storage": "journal", "columnar": True}, {"storage": "binary"}):
+            with self.subTest(**options):
+                write_four_accounts(self.test_file)
+                filename = self.test_file
+                if options["storage"] == "binary":
+                    filename = self.binary_file
+                    convert_text_to_binary(self.test_file, filename)
+                bank = BankingSystem(filename, indexes=True, **options)
+                self.assertEqual(bank.top_accounts(2), [("10002", 1000.0), ("10001", 100.0)])
+                self.assertEqual(bank.query_accounts("Business", min_balance=1), [("10003", 2.0), ("10002", 1000.0)])
+
+                bank.accounts["10003"].deposit(500) # every balance change moves the account in the index
+                bank.accounts["10001"].transfer(99.5, bank.accounts["10004"])
+                bank.accounts["10004"].top_up_mobile(10)
+                bank.accounts["10002"].withdraw(1)
+                self.assertEqual(bank.query_accounts("Business", min_balance=500), [("10003", 502.0), ("10002", 999.0)])
+                self.assertEqual(bank.query_accounts(max_balance=90), [("10001", 0.5)])
+                self.assertEqual(bank.top_accounts(1, "mobile_balance"), [("10004", 10.0)])
+                self.assertEqual(bank.query_accounts("Personal", field="mobile_balance", limit=1), [("10001", 5.0)])
+
+                bank.delete_account("10002")
+                new = bank.create_account("Business")
+                new.deposit(2000)
+                bank.charge_fee(1, "Business")
+                self.assertEqual(bank.top_accounts(5, account_type="Business"), [(new.account_id, 1999.0), ("10003", 501.0)])
+                with self.assertRaises(BankingError):
+                    bank.top_accounts(1, "overdraft")
+                bank.close()
+    
+    def test_reloading_rebuilds_the_indexes(self):
+        """Test accounts loaded again with load_accounts are indexed and keep the index up to date"""
+        for options in ({"storage": "journal"}, {"storage": "journal", "columnar": True}, {"storage": "binary"}):
+            with self.subTest(**options):
+                write_four_accounts(self.test_file)
+                filename = self.test_file
+                if options["storage"] == "binary":
+                    filename = self.binary_file
+                    convert_text_to_binary(self.test_file, filename)
+                bank = BankingSystem(filename, indexes=True, **options)
+                bank.load_accounts()
+                bank.accounts["10003"].deposit(5000) # a new object (or view) after the reload
+                self.assertEqual(bank.top_accounts(2), [("10003", 5002.0), ("10002", 1000.0)])
+                bank.close()
+
+class TestAccountCommands(unittest.TestCase):
+    """Test the one-shot balance, deposit, transfer and stats commands"""
+    
+    def setUp(self):
+        self.test_file = "test_commands.txt"
+        self.write_ledger()
+
+    def write_ledger(self):
+        remove_ledger_files(self.test_file)
+        with open(self.test_file, "w") as file:
+            file.write("10001,1111,Personal,100.00,5.00\n10002,2222,Business,1000.00\n")
+
+    def tearDown(self):
+        remove_ledger_files(self.test_file)
+
+    def run_cli(self, *argv):
+        """Run the command line and return (exit code, printed output)"""
+        output = io.StringIO()
+        with redirect_stdout(output), redirect_stderr(output):
+            code = cli(list(argv))
+        return code, output.getvalue()
+
+    def test_commands_change_and_report_balances(self):
+        """Test balance, deposit, transfer and stats on both text storage modes"""
+        for storage in ("journal", "snapshot"):
+            with self.subTest(storage=storage):
+                self.write_ledger() # each case starts from the same two accounts
+                options = ("--ledger", self.test_file, "--storage", storage)
+                self.assertEqual(self.run_cli(*options, "deposit", "10001", "50")[0], 0)
+                self.assertEqual(self.run_cli(*options, "transfer", "10002", "100", "10001")[0], 0)
+                code, output = self.run_cli(*options, "balance", "10001")
+                self.assertEqual(code, 0)
+                self.assertIn("250.00", output)
+                code, output = self.run_cli(*options, "stats")
+                self.assertIn("Business: 1 accounts, funds $900.00", output)
+                self.assertEqual(self.run_cli(*options, "balance", "99999")[0], 1)
+                self.assertEqual(self.run_cli(*options, "transfer", "10001", "5000", "10002")[0], 1)
+
+    def test_lazy_lookup_without_loading_index(self):
+        """Test a current sidecar index is searched instead of loaded for a few accounts"""
+        with open(self.test_file, "a") as file:
+            file.writelines(f"{20000 + i},1234,Personal,{i}.00,0.00\n" for i in range(100))
+        BankingSystem(self.test_file, lazy=True).close() # writes the sidecar
+        bank = BankingSystem(self.test_file, lazy=True)
+        self.assertIsNone(bank.accounts._offsets)
+        self.assertEqual(bank.accounts["20042"].funds, 42.0)
+        self.assertEqual(bank.accounts["10002"].funds, 1000.0)
+        self.assertNotIn("20100", bank.accounts)
+        self.assertIsNone(bank.accounts._offsets)
+        self.assertEqual([name for name in os.listdir(".") if name.startswith(self.test_file + ".idx.")], []) # no temp file left
+        os.remove(self.test_file + ".idx") # e.g. replaced by another process - the index is built instead
+        self.assertEqual(bank.accounts["20007"].funds, 7.0)
+        self.assertEqual(len(bank.accounts), 102) # needs the whole index
+        bank.close()
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file